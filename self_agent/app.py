@@ -1,18 +1,42 @@
 # FastAPI 应用主入口
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from core.config import settings
 from core.auth import jwt_auth
 from core.errors import register_exception_handlers
-from modules.conversation import router as conversation_router
-from modules.folders import router as folders_router
+from modules.conversation import router as conversation_router, turn_pipeline
+from modules.folders import router as folders_router, ensure_default_folder
 from modules.tags import router as tags_router
+from modules.search import router as search_router, search_index
+from modules.changes import router as changes_router, change_feed
+from modules.llm import llm_engine
+from modules.summarizer import summarizer
+from modules.metrics import router as metrics_router, MetricsMiddleware
+from core.storage import storage
 from fastapi import APIRouter
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动：预热模型客户端与连接池，确保默认收藏夹存在
+    llm_engine.prewarm(settings.LLM_MODELS)
+    await ensure_default_folder()
+    # 重放上次退出前未完成的后台保存任务
+    await turn_pipeline.recover()
+    yield
+    # 关闭：等待后台保存完成并停止摘要任务，释放连接池，写回尚未落盘的数据
+    await turn_pipeline.close()
+    await summarizer.close()
+    await llm_engine.aclose()
+    await storage.close()
+    search_index.close()
+    change_feed.close()
+
 app = FastAPI(
     title=settings.APP_NAME,
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan
 )
 
 # 跨域配置
@@ -22,17 +46,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 前端可读取 ETag 用于条件请求
+    expose_headers=["ETag"],
 )
 
+# 请求耗时指标
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # 注册路由
 app.include_router(conversation_router, prefix="/api/v1/conversations", tags=["Conversations"])
 app.include_router(folders_router, prefix="/api/v1/folders", tags=["Folders"])
 app.include_router(tags_router)
+app.include_router(search_router, prefix="/api/v1/search", tags=["Search"])
+app.include_router(changes_router, prefix="/api/v1/changes", tags=["Changes"])
+if settings.METRICS_ENABLED:
+    app.include_router(metrics_router)
 
 # 新增：/api/v1/models 路由，供前端获取模型列表
 @app.get("/api/v1/models", tags=["Models"])
 async def get_models():
-    return {"data": ["gpt-4.1", "o4-mini"]}
+    return {"data": settings.LLM_MODELS}
+
+# 大模型回复缓存命中统计
+@app.get("/api/v1/models/cache_stats", tags=["Models"])
+async def get_cache_stats():
+    if llm_engine.cache is None:
+        return {"data": {"enabled": False}}
+    return {"data": {"enabled": True, **llm_engine.cache.snapshot()}}
+
+# 大模型调用准入控制：各模型并发、排队与等待时间统计
+@app.get("/api/v1/models/admission_stats", tags=["Models"])
+async def get_admission_stats():
+    if llm_engine.admission is None:
+        return {"data": {"enabled": False}}
+    return {"data": {"enabled": True, "models": llm_engine.admission.snapshot()}}
 
 # 注册异常处理
 register_exception_handlers(app)
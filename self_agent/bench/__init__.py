@@ -0,0 +1,2 @@
+# 压测与基准测试工具：本地假模型 + 合成数据 + 进程内 ASGI 并发驱动
+# 用法（在 self_agent 目录下）：python -m bench --help
@@ -0,0 +1,120 @@
+# 基准测试命令行入口
+# 用法（在 self_agent 目录下）：
+#   python -m bench --conversations 500 --messages 50 --requests 300 --concurrency 20 --out bench-results.json
+#   python -m bench ... --compare bench-results-old.json
+# 数据写入临时目录（或 --data-dir），模型为本地假模型，不访问网络。
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="self_agent 接口基准测试")
+    p.add_argument("--conversations", type=int, default=200, help="合成会话数 N")
+    p.add_argument("--messages", type=int, default=20, help="每个会话的消息数 M")
+    p.add_argument("--words", type=int, default=30, help="每条消息的词数")
+    p.add_argument("--requests", type=int, default=200, help="每个场景的请求数")
+    p.add_argument("--concurrency", type=int, default=10, help="并发数")
+    p.add_argument("--scenarios", nargs="*", help="只运行指定场景，默认全部")
+    p.add_argument("--backend", choices=["file", "sqlite"], default="file", help="存储后端")
+    p.add_argument("--llm-latency", type=float, default=0.05, help="假模型首 token 延迟（秒）")
+    p.add_argument("--token-delay", type=float, default=0.0, help="假模型后续每个 token 的间隔（秒）")
+    p.add_argument("--reply-tokens", type=int, default=50, help="假模型每次回复的 token 数")
+    p.add_argument("--data-dir", help="数据目录，默认使用临时目录")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", default="bench-results.json", help="结果 JSON 文件")
+    p.add_argument("--compare", help="与之前的结果 JSON 对比")
+    return p.parse_args(argv)
+
+
+def configure_env(args, data_dir: str):
+    """必须在导入 app / core.config 之前设置"""
+    os.environ["DATA_PATH"] = data_dir
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["SQLITE_PATH"] = ""
+    os.environ["SEARCH_PATH"] = ""
+    os.environ["LLM_ENGINE"] = "fake"
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["LLM_MODELS"] = "[]"
+    os.environ["FAKE_LLM_REPLY"] = "好" * args.reply_tokens
+    os.environ["FAKE_LLM_FIRST_TOKEN_DELAY"] = str(args.llm_latency)
+    os.environ["FAKE_LLM_TOKEN_DELAY"] = str(args.token_delay)
+    os.environ.setdefault("JWT_SECRET", "bench-secret-not-for-production-use-000")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return ""
+
+
+async def run(args) -> dict:
+    from app import app
+    from core.storage import storage
+    from modules.search import search_index
+    from bench.dataset import generate
+    from bench.runner import run_benchmark
+
+    async with app.router.lifespan_context(app):
+        start = time.perf_counter()
+        dataset = await generate(storage, search_index, args.conversations, args.messages, args.words, args.seed)
+        setup_seconds = time.perf_counter() - start
+        results = await run_benchmark(app, dataset, args.requests, args.concurrency, args.scenarios, args.seed)
+    search_index.close()
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "dataset_seconds": round(setup_seconds, 3),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        },
+        "results": results,
+    }
+
+
+def print_table(results: dict):
+    header = f"{'scenario':<24}{'req':>6}{'err':>5}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<24}{r['requests']:>6}{r['errors']:>5}{r['rps']:>10}{r['p50_ms']:>10}"
+              f"{r['p95_ms']:>10}{r['p99_ms']:>10}{r['peak_rss_mb']:>9}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="self_agent_bench_") as tmp:
+        configure_env(args, os.path.abspath(args.data_dir or tmp))
+        # 压测期间只保留警告以上日志
+        from core.logger import logger
+        logger.setLevel(logging.WARNING)
+        report = asyncio.run(run(args))
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_table(report["results"])
+    print(f"\n结果已保存到 {args.out}")
+
+    if args.compare:
+        from bench.runner import compare
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+        print(f"\n对比 {args.compare}（commit {old.get('meta', {}).get('commit', '?')}）：")
+        for line in compare(old.get("results", {}), report["results"]):
+            print(line)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+# 合成数据集：N 个会话 × 每个 M 条消息，外加标签与收藏夹
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List
+
+# 生成消息内容用的词表（中英混合，便于搜索场景命中）
+WORDS = [
+    "机器学习", "深度学习", "数据库", "索引", "缓存", "并发", "性能", "接口", "模型", "向量",
+    "python", "fastapi", "sqlite", "latency", "throughput", "token", "prompt", "stream",
+]
+TAGS = ["工作", "学习", "生活", "灵感", "待办"]
+
+
+@dataclass
+class Dataset:
+    conversation_ids: List[str] = field(default_factory=list)
+    messages_per_conversation: int = 0
+    tags: List[str] = field(default_factory=list)
+    words: List[str] = field(default_factory=lambda: list(WORDS))
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+async def generate(storage, search_index=None, conversations: int = 100, messages: int = 20,
+                   words_per_message: int = 30, seed: int = 0) -> Dataset:
+    """写入合成会话（直接经由存储层，不走 HTTP），返回数据集描述"""
+    rng = random.Random(seed)
+    base = datetime(2025, 1, 1)
+    dataset = Dataset(messages_per_conversation=messages, tags=list(TAGS))
+    await storage.folders.save({
+        "folder_id": "default", "name": "默认收藏夹", "conversation_ids": [],
+        "created_at": base.isoformat() + "Z", "updated_at": base.isoformat() + "Z", "is_default": True,
+    })
+    for i in range(conversations):
+        cid = f"bench-{i:06d}"
+        created = base + timedelta(minutes=i)
+        msgs = [
+            {
+                "role": "user" if j % 2 == 0 else "assistant",
+                "content": _text(rng, words_per_message),
+                "timestamp": (created + timedelta(seconds=j)).isoformat() + "Z",
+            }
+            for j in range(messages)
+        ]
+        meta = {
+            "conversation_id": cid,
+            "name": msgs[0]["content"][:10] if msgs else cid,
+            "summary": msgs[0]["content"] if msgs else "",
+            "created_at": created.isoformat() + "Z",
+            "updated_at": (created + timedelta(seconds=messages)).isoformat() + "Z",
+            "config": {"model": rng.choice(["gpt-4.1", "o4-mini"])},
+        }
+        await storage.conversations.append(cid, msgs, meta)
+        if search_index is not None:
+            await search_index.index_messages(cid, msgs, 0, meta=meta)
+        await storage.tags.add({
+            "id": f"tag-{i:06d}", "conversation_id": cid, "tag": rng.choice(TAGS),
+            "created_at": meta["created_at"], "updated_at": meta["created_at"],
+        })
+        if i % 10 == 0:
+            await storage.folders.add_conversation("default", cid, meta["updated_at"])
+        dataset.conversation_ids.append(cid)
+    await storage.folders.flush()
+    await storage.tags.flush()
+    return dataset
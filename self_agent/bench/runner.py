@@ -0,0 +1,215 @@
+# 基准测试驱动：以固定并发在进程内调用 ASGI 应用，统计各接口延迟分位数、吞吐与峰值内存
+import os
+import math
+import time
+import random
+import asyncio
+import resource
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from bench.dataset import Dataset
+
+# 一次请求：给定随机数发生器与数据集，发出请求并返回响应
+RequestFn = Callable[[httpx.AsyncClient, random.Random, Dataset], Awaitable[httpx.Response]]
+
+
+@dataclass
+class Scenario:
+    name: str
+    request: RequestFn
+    # 写操作场景会改变数据，放在只读场景之后执行
+    writes: bool = False
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法分位数，输入需已排序"""
+    if not sorted_values:
+        return 0.0
+    k = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float, peak_rss: int) -> dict:
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(values) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if count else 0.0,
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 2),
+    }
+
+
+def current_rss() -> int:
+    """当前常驻内存（字节）；非 Linux 平台退化为进程历史峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """后台定时采样 RSS，记录某个场景期间的峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, current_rss())
+            await asyncio.sleep(self.interval)
+
+    async def __aenter__(self):
+        self.peak = current_rss()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        self.peak = max(self.peak, current_rss())
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, dataset: Dataset,
+                       requests: int, concurrency: int, seed: int = 0) -> dict:
+    """共发出 requests 个请求，最多 concurrency 个同时进行"""
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker(worker_id: int):
+        nonlocal remaining, errors
+        rng = random.Random(seed * 1000 + worker_id)
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                resp = await scenario.request(client, rng, dataset)
+                ok = resp.status_code < 400
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    async with RssSampler() as sampler:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed, sampler.peak)
+
+
+# ---------- 场景 ----------
+def _cid(rng: random.Random, dataset: Dataset) -> str:
+    return rng.choice(dataset.conversation_ids)
+
+
+async def _list_conversations(client, rng, dataset):
+    pages = max(len(dataset.conversation_ids) // 20, 1)
+    return await client.get("/api/v1/conversations/", params={"page": rng.randint(1, pages), "size": 20})
+
+
+async def _get_conversation(client, rng, dataset):
+    return await client.get(f"/api/v1/conversations/{_cid(rng, dataset)}", params={"size": 50})
+
+
+async def _get_conversation_tail(client, rng, dataset):
+    return await client.get(f"/api/v1/conversations/{_cid(rng, dataset)}", params={"size": 50, "reverse": True})
+
+
+async def _send_message(client, rng, dataset):
+    return await client.post(f"/api/v1/conversations/{_cid(rng, dataset)}/messages",
+                             json={"content": " ".join(rng.sample(dataset.words, 5))})
+
+
+async def _send_message_stream(client, rng, dataset):
+    # ASGITransport 读完整个事件流才返回，延迟为整轮生成耗时
+    return await client.post(f"/api/v1/conversations/{_cid(rng, dataset)}/messages/stream",
+                             json={"content": " ".join(rng.sample(dataset.words, 5))})
+
+
+async def _send_batch(client, rng, dataset):
+    # 同一问题发给两个会话、两个模型
+    targets = [{"conversation_id": _cid(rng, dataset), "model": m} for m in ("gpt-4.1", "o4-mini")]
+    return await client.post("/api/v1/conversations/batch",
+                             json={"content": " ".join(rng.sample(dataset.words, 5)), "targets": targets})
+
+
+async def _list_folders(client, rng, dataset):
+    return await client.get("/api/v1/folders/")
+
+
+async def _add_to_folder(client, rng, dataset):
+    return await client.post("/api/v1/folders/default/add", json={"conversation_id": _cid(rng, dataset)})
+
+
+async def _list_tags(client, rng, dataset):
+    return await client.get("/api/v1/conversation_tags/", params={"conversation_id": _cid(rng, dataset)})
+
+
+async def _tag_conversations(client, rng, dataset):
+    return await client.get("/api/v1/conversation_tags/conversations", params={"tag": rng.choice(dataset.tags)})
+
+
+async def _add_tag(client, rng, dataset):
+    return await client.post("/api/v1/conversation_tags/",
+                             json={"conversation_id": _cid(rng, dataset), "tag": rng.choice(dataset.tags)})
+
+
+async def _search(client, rng, dataset):
+    return await client.get("/api/v1/search/", params={"q": rng.choice(dataset.words)})
+
+
+SCENARIOS: Dict[str, Scenario] = {s.name: s for s in [
+    Scenario("list_conversations", _list_conversations),
+    Scenario("get_conversation", _get_conversation),
+    Scenario("get_conversation_tail", _get_conversation_tail),
+    Scenario("list_folders", _list_folders),
+    Scenario("list_tags", _list_tags),
+    Scenario("tag_conversations", _tag_conversations),
+    Scenario("search", _search),
+    Scenario("send_message", _send_message, writes=True),
+    Scenario("send_message_stream", _send_message_stream, writes=True),
+    Scenario("send_batch", _send_batch, writes=True),
+    Scenario("add_to_folder", _add_to_folder, writes=True),
+    Scenario("add_tag", _add_tag, writes=True),
+]}
+
+
+async def run_benchmark(app, dataset: Dataset, requests: int = 200, concurrency: int = 10,
+                        scenarios: Optional[List[str]] = None, seed: int = 0) -> Dict[str, dict]:
+    """依次执行各场景（先只读后写入），返回 场景名 -> 统计结果"""
+    names = scenarios or list(SCENARIOS)
+    selected = sorted((SCENARIOS[n] for n in names), key=lambda s: s.writes)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for scenario in selected:
+            results[scenario.name] = await run_scenario(client, scenario, dataset, requests, concurrency, seed)
+    return results
+
+
+def compare(old: Dict[str, dict], new: Dict[str, dict]) -> List[str]:
+    """与上一次结果对比，输出每个场景关键指标的变化"""
+    lines = []
+    for name, cur in new.items():
+        prev = old.get(name)
+        if prev is None:
+            continue
+        parts = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb"):
+            before, after = prev.get(key) or 0, cur.get(key) or 0
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            parts.append(f"{key} {before} -> {after} ({change})")
+        lines.append(f"{name}: " + ", ".join(parts))
+    return lines
@@ -1,20 +1,81 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field, field_validator, ConfigDict
-from typing import Literal, Optional
+from typing import Dict, List, Literal, Optional
 
 class Settings(BaseSettings):
     APP_NAME: str = Field("ChatAgent", description="应用程序名称")
     HOST: str = Field("0.0.0.0", description="服务监听地址")
     PORT: int = Field(5000, description="服务监听端口")
     DEBUG: bool = Field(False, description="调试模式")
-    DATA_PATH: str = Field("./data", description="数据存储路径")
+    DATA_PATH: str = Field("./data", description="数据存储路径（相对路径以 self_agent 目录为基准）")
+    STORAGE_BACKEND: Literal["file", "sqlite"] = Field("file", description="存储后端：file 为 data 目录下的文件，sqlite 为嵌入式数据库")
+    SQLITE_PATH: str = Field("", description="SQLite 数据库文件路径，留空则为 DATA_PATH/system 下的 self_agent.db")
+    ARCHIVE_AFTER_DAYS: float = Field(30, description="manage.py archive 默认归档空闲多少天以上的会话")
+    ARCHIVE_COMPRESSION: Literal["gzip", "zstd"] = Field("gzip", description="冷存储压缩算法，zstd 需安装 zstandard")
+    STORAGE_FLUSH_DELAY: float = Field(0.5, description="文件后端收藏夹、标签延迟合并写盘的间隔（秒）")
+    STORAGE_MULTIPROCESS: bool = Field(False, description="数据目录是否由多个进程共用（uvicorn --workers N 或多个实例）：开启后文件后端的收藏夹、标签改为加锁立即写盘，并在其他进程改写后重新载入")
+    STORAGE_FORMAT: Literal["json", "msgpack"] = Field("json", description="文件后端收藏夹、标签文件的写入格式：json 为紧凑 JSON，msgpack 需安装 msgpack；读取时按内容自动识别")
+    LOG_PATH: str = Field("", description="日志目录，留空则为 self_agent 目录下的 logs")
     LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = Field("INFO", description="日志级别")
+    LOG_MAX_BYTES: int = Field(10 * 1024 * 1024, description="单个日志文件大小上限（字节），超出后轮转")
+    LOG_BACKUP_COUNT: int = Field(5, description="保留的轮转日志文件数")
+    LOG_QUEUE_SIZE: int = Field(10000, description="待写日志队列长度上限，队列满时丢弃新记录")
+    LOG_BODY_MODE: Literal["truncate", "hash", "full"] = Field("truncate", description="日志中用户输入/模型回复正文的记录方式：截断、只记哈希或完整记录")
+    LOG_BODY_MAX_CHARS: int = Field(200, description="LOG_BODY_MODE 为 truncate 时正文保留的字符数")
+    LOG_SAMPLE_RATE: float = Field(1.0, ge=0, le=1, description="高频日志（每条消息的输入/输出记录）的抽样比例，1 为全部记录")
     JWT_SECRET: str = Field(..., description="JWT密钥", min_length=32)
     JWT_ALGORITHM: str = Field("HS256", description="JWT算法")
     OPENAI_API_KEY: Optional[str] = Field(None, description="OpenAI API密钥")
     AZURE_OPENAI_API_KEY: str = Field("", description="Azure OpenAI API密钥")
     AZURE_OPENAI_ENDPOINT: str = Field("", description="Azure OpenAI端点")
     AZURE_OPENAI_API_VERSION: str = Field("", description="Azure OpenAI API版本")
+    LLM_MODELS: List[str] = Field(["gpt-4.1", "o4-mini"], description="可用模型列表（/api/v1/models 返回，启动时预热）")
+    LLM_CLIENT_CACHE_SIZE: int = Field(16, description="缓存的大模型客户端实例上限")
+    LLM_MAX_CONNECTIONS: int = Field(100, description="每个 endpoint 的最大 HTTP 连接数")
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = Field(20, description="每个 endpoint 保持的空闲 keep-alive 连接数")
+    LLM_KEEPALIVE_EXPIRY: float = Field(60.0, description="空闲连接保持时间（秒）")
+    LLM_TIMEOUT: float = Field(120.0, description="大模型请求超时（秒）")
+    TOKENIZER_ENCODING: str = Field("o200k_base", description="tiktoken 编码名称，加载失败时按字符数估算")
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = Field(
+        {"gpt-4.1": 32000, "o4-mini": 32000},
+        description="各模型每轮发送历史消息的 token 预算",
+    )
+    CONTEXT_DEFAULT_TOKEN_BUDGET: int = Field(16000, description="未单独配置的模型使用的 token 预算")
+    SUMMARY_ENABLED: bool = Field(True, description="是否在后台为长会话生成滚动摘要")
+    SUMMARY_MODEL: str = Field("o4-mini", description="生成滚动摘要使用的模型")
+    SUMMARY_TRIGGER_TOKENS: int = Field(8000, description="摘要水位线之后的历史超过该 token 数时生成新摘要")
+    SUMMARY_KEEP_RECENT_TOKENS: int = Field(2000, description="生成摘要时保留原文、不纳入摘要的最近消息 token 数")
+    METRICS_ENABLED: bool = Field(True, description="是否开启 /metrics 指标接口与请求耗时统计")
+    POSTPROCESS_ENABLED: bool = Field(True, description="是否在返回回复后由后台流水线保存对话、更新索引")
+    POSTPROCESS_QUEUE_SIZE: int = Field(1000, description="后台流水线未完成任务数上限，达到上限时新请求等待")
+    POSTPROCESS_JOURNAL_FSYNC: bool = Field(True, description="后台流水线每次写交接日志后是否 fsync；关闭可降低发送延迟，但断电时可能丢失最近几轮尚未保存的对话")
+    POSTPROCESS_RETRIES: int = Field(3, ge=0, description="后台保存失败后的重试次数，仍失败的任务保留在交接日志中，下次启动时重放")
+    POSTPROCESS_RETRY_DELAY: float = Field(0.5, ge=0, description="后台保存首次重试的间隔（秒），之后每次加倍")
+    POSTPROCESS_JOURNAL_PATH: str = Field("", description="后台流水线交接日志路径，留空则为 DATA_PATH/system 下的 pending_turns.jsonl")
+    BATCH_MAX_TARGETS: int = Field(16, description="批量发送接口单次请求的目标数上限")
+    SEARCH_ENABLED: bool = Field(True, description="是否维护全文搜索索引")
+    SEARCH_MAX_CANDIDATES: int = Field(1000, ge=1, description="全文搜索每次先按相关度取的候选条数，名称加权与过滤只在候选内进行；过滤后不足一页时自动扩大")
+    SEARCH_PATH: str = Field("", description="搜索索引数据库文件路径，留空则为 DATA_PATH/system 下的 search.db")
+    CHANGES_ENABLED: bool = Field(True, description="是否记录会话、收藏夹、标签的变更流（增量同步接口 /api/v1/changes）")
+    CHANGES_PATH: str = Field("", description="变更流数据库文件路径，留空则为 DATA_PATH/system 下的 changes.db")
+    LLM_CACHE_ENABLED: bool = Field(False, description="是否开启大模型回复缓存")
+    LLM_CACHE_MEMORY_SIZE: int = Field(1024, description="回复缓存内存层条目上限（LRU）")
+    LLM_CACHE_TTL: float = Field(86400.0, description="回复缓存有效期（秒）")
+    LLM_CACHE_DISK: bool = Field(True, description="回复缓存是否持久化到磁盘")
+    LLM_CACHE_PATH: str = Field("", description="回复缓存数据库文件路径，留空则为 DATA_PATH/system 下的 llm_cache.db")
+    LLM_ADMISSION_ENABLED: bool = Field(True, description="是否对上游模型调用做并发/配额准入控制")
+    LLM_MAX_CONCURRENCY: Dict[str, int] = Field({}, description="各模型同时进行的上游调用数上限")
+    LLM_DEFAULT_MAX_CONCURRENCY: int = Field(16, description="未单独配置的模型的并发上限")
+    LLM_RPM_LIMITS: Dict[str, int] = Field({}, description="各模型每分钟请求数配额，0 为不限制")
+    LLM_DEFAULT_RPM: int = Field(0, description="未单独配置的模型的每分钟请求数配额，0 为不限制")
+    LLM_TPM_LIMITS: Dict[str, int] = Field({}, description="各模型每分钟 token 数配额，0 为不限制")
+    LLM_DEFAULT_TPM: int = Field(0, description="未单独配置的模型的每分钟 token 数配额，0 为不限制")
+    LLM_QUEUE_SIZE: int = Field(100, description="每个模型排队等待的请求数上限，超出立即返回 429")
+    LLM_QUEUE_TIMEOUT: float = Field(30.0, description="排队等待超时（秒），超时返回 429；0 为不限")
+    LLM_ENGINE: Literal["azure", "fake"] = Field("azure", description="大模型引擎：azure 为 Azure OpenAI，fake 为本地假模型（测试/压测用）")
+    FAKE_LLM_REPLY: str = Field("这是AI的回复", description="本地假模型的回复内容")
+    FAKE_LLM_FIRST_TOKEN_DELAY: float = Field(0.0, description="本地假模型首个 token 延迟（秒）")
+    FAKE_LLM_TOKEN_DELAY: float = Field(0.0, description="本地假模型后续每个 token 的间隔（秒）")
 
     @field_validator("JWT_SECRET")
     @classmethod
@@ -4,10 +4,12 @@ from fastapi.responses import JSONResponse
 from fastapi import status
 
 class APIException(Exception):
-    def __init__(self, code: int, message: str, details=None):
+    def __init__(self, code: int, message: str, details=None, headers=None):
         self.code = code
         self.message = message
         self.details = details
+        # 附加的响应头，如 429 的 Retry-After
+        self.headers = headers
 
 def register_exception_handlers(app):
     @app.exception_handler(APIException)
@@ -19,6 +21,7 @@ def register_exception_handlers(app):
                 "message": exc.message,
                 "details": exc.details,
             },
+            headers=exc.headers,
         )
 
     @app.exception_handler(HTTPException)
@@ -30,6 +33,7 @@ def register_exception_handlers(app):
                 "message": exc.detail,
                 "details": None,
             },
+            headers=getattr(exc, "headers", None),
         )
 
     @app.exception_handler(Exception)
@@ -0,0 +1,38 @@
+# 条件请求：强 ETag 与 If-None-Match -> 304
+# ETag 由资源的版本信息（会话修订号、收藏夹/标签的版本号）与请求参数计算，校验时不读取、不序列化响应正文；
+# 请求头 If-None-Match 与当前 ETag 相同时直接返回 304 空响应。
+# Cache-Control: no-cache 让浏览器缓存响应、但每次使用前带 If-None-Match 重新校验。
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    raw = "\x1f".join("" if p is None else str(p) for p in parts)
+    return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match 按弱比较：忽略 W/ 前缀（经压缩代理转发时可能被改为弱 ETag）
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def check_etag(request: Request, response: Response, *parts) -> Optional[Response]:
+    """
+    按版本信息计算 ETag 并写入响应头；客户端的缓存仍然有效时返回 304 响应，路由应直接返回它，
+    否则返回 None，路由照常生成正文
+    """
+    etag = make_etag(*parts)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -1,22 +1,102 @@
+# 日志：请求处理中只把记录放入内存队列，由后台线程写文件与控制台，磁盘 I/O 不占用事件循环
+# - 文件按大小轮转（LOG_MAX_BYTES / LOG_BACKUP_COUNT）；STORAGE_MULTIPROCESS 开启时每个进程写各自的 app.{pid}.log，
+#   多个 worker 不会同时轮转同一个文件而覆盖彼此的记录
+# - 级别取 LOG_LEVEL
+# - 用户输入、模型回复等正文经 brief() 截断或只记录哈希（LOG_BODY_MODE / LOG_BODY_MAX_CHARS）
+# - 每条消息都会产生的高频记录带 extra=SAMPLED，按 LOG_SAMPLE_RATE 抽样；WARNING 及以上不抽样
+# - 队列满时丢弃新记录而不阻塞调用方，丢弃数计入 log_records_dropped_total 指标
+import atexit
+import hashlib
 import logging
 import os
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
+from core.config import settings
+from core.metrics import Counter
+
+LOG_DIR = settings.LOG_PATH or os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
-LOG_FILE = os.path.join(LOG_DIR, "app.log")
 
-logger = logging.getLogger("self_agent")
-logger.setLevel(logging.INFO)
+
+def log_file_path(multiprocess: bool = False, pid: int = None) -> str:
+    """日志文件路径；多进程共用 logs 目录时按进程号区分"""
+    if multiprocess:
+        return os.path.join(LOG_DIR, f"app.{pid or os.getpid()}.log")
+    return os.path.join(LOG_DIR, "app.log")
+
+
+LOG_FILE = log_file_path(settings.STORAGE_MULTIPROCESS)
+
+# 高频记录的标记：logger.info(..., extra=SAMPLED)
+SAMPLED = {"sampled": True}
+
+DROPPED = Counter("log_records_dropped_total", "日志队列已满而丢弃的记录数")
+
+
+def brief(text) -> str:
+    """按配置处理要写入日志的正文：full 原样，truncate 截断并注明总长度，hash 只记录长度与摘要"""
+    text = "" if text is None else str(text)
+    mode = settings.LOG_BODY_MODE
+    if mode == "full":
+        return text
+    if mode == "hash":
+        return f"<{len(text)} 字 sha256:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]}>"
+    limit = settings.LOG_BODY_MAX_CHARS
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…(共 {len(text)} 字)"
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1 or record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
 
 formatter = logging.Formatter(
     "[%(asctime)s] [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S"
 )
 
-file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
+file_handler = RotatingFileHandler(
+    LOG_FILE, maxBytes=settings.LOG_MAX_BYTES, backupCount=settings.LOG_BACKUP_COUNT, encoding="utf-8"
+)
 file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
 
 # 控制台输出
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+
+log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+queue_handler.addFilter(SamplingFilter(settings.LOG_SAMPLE_RATE))
+
+logger = logging.getLogger("self_agent")
+logger.setLevel(settings.LOG_LEVEL)
+logger.addHandler(queue_handler)
+
+listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+listener.start()
+
+
+def flush_logs():
+    """等待队列中的记录全部写出（进程退出时自动调用）"""
+    listener.stop()
+    file_handler.close()
+
+
+atexit.register(flush_logs)
@@ -0,0 +1,196 @@
+# 进程内指标，按 Prometheus 文本格式（0.0.4）输出
+# 不依赖 prometheus_client：只实现本项目用到的计数器、直方图，以及采集时才读取数值的回调收集器。
+# 指标在模块导入时注册到 REGISTRY，GET /metrics 调用 REGISTRY.render() 输出全部指标。
+import time
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 秒级耗时的默认分桶
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(pairs: Sequence[Tuple[str, object]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def header(name: str, kind: str, help_text: str) -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def histogram_lines(name: str, labels: Sequence[Tuple[str, object]], buckets: Sequence[float],
+                    counts: Sequence[int], total: float) -> List[str]:
+    """counts 为各区间（最后一项为 +Inf）的非累计计数"""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(buckets) + [float("inf")], counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{format_labels(list(labels) + [('le', format_value(bound))])} {cumulative}")
+    lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+    lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+    return lines
+
+
+class Registry:
+    def __init__(self):
+        # 名称 -> 指标或回调收集器；同名重复注册时后者覆盖前者
+        self._collectors: Dict[str, object] = {}
+
+    def register(self, name: str, collector):
+        self._collectors[name] = collector
+        return collector
+
+    def get(self, name: str):
+        return self._collectors.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for collector in list(self._collectors.values()):
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # 同步回调与线程中都可能更新，计数需加锁
+        self._lock = threading.Lock()
+        registry.register(name, self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _pairs(self, key: tuple):
+        return list(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        return header(self.name, self.kind, self.help) + self.samples()
+
+    def samples(self) -> List[str]:
+        return []
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        self._values: Dict[tuple, float] = {}
+        super().__init__(*args, **kwargs)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self._pairs(k))} {format_value(v)}" for k, v in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(buckets)
+        # 标签 -> [各区间计数..., +Inf 区间计数], 总和
+        self._counts: Dict[tuple, List[int]] = {}
+        self._sums: Dict[tuple, float] = {}
+        super().__init__(name, help_text, labelnames, registry)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next((i for i, b in enumerate(self.buckets) if value <= b), len(self.buckets))
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key in sorted(self._counts):
+            lines.extend(histogram_lines(self.name, self._pairs(key), self.buckets, self._counts[key], self._sums[key]))
+        return lines
+
+
+class CallbackCollector:
+    """采集时调用 collect() 取当前值（队列深度、缓存计数等已由其他模块维护的数据）"""
+
+    def __init__(self, name: str, collect: Callable[[], Iterable[str]], registry: Registry = REGISTRY):
+        self.name = name
+        self.collect = collect
+        registry.register(name, self)
+
+    def render(self) -> List[str]:
+        try:
+            return list(self.collect())
+        except Exception:
+            # 某个数据源出错时不影响其他指标输出
+            return []
+
+
+def timed_methods(histogram: Histogram, **labels):
+    """类装饰器：记录类中每个公开 async 方法的耗时，方法名作为 op 标签"""
+    def decorate(cls):
+        for name, fn in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.iscoroutinefunction(fn):
+                continue
+
+            def wrap(fn, op):
+                @functools.wraps(fn)
+                async def wrapper(*args, **kwargs):
+                    with histogram.time(op=op, **labels):
+                        return await fn(*args, **kwargs)
+                return wrapper
+            setattr(cls, name, wrap(fn, name))
+        return cls
+    return decorate
+
+
+# ---------- 各模块共用的指标 ----------
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP 请求处理耗时（流式接口为整个响应的耗时）",
+    ("method", "route", "status"),
+)
+STORAGE_SECONDS = Histogram(
+    "storage_operation_duration_seconds", "存储层操作耗时",
+    ("backend", "repo", "op"),
+)
@@ -0,0 +1,30 @@
+# storage 包初始化：会话、收藏夹、标签的持久化
+# 路由通过 storage.conversations / storage.folders / storage.tags 访问数据，
+# 具体后端由配置 STORAGE_BACKEND 决定。
+from pathlib import Path
+from typing import Optional
+
+from core.config import settings
+from core.storage.base import Storage
+from core.storage.layout import system_path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+DATA_DIR = BASE_DIR / settings.DATA_PATH
+
+
+def default_sqlite_path(data_dir: Path = DATA_DIR) -> Path:
+    return Path(settings.SQLITE_PATH) if settings.SQLITE_PATH else system_path(data_dir, "self_agent.db")
+
+
+def create_storage(backend: Optional[str] = None, data_dir: Optional[Path] = None, sqlite_path: Optional[Path] = None) -> Storage:
+    backend = backend or settings.STORAGE_BACKEND
+    data_dir = Path(data_dir) if data_dir is not None else DATA_DIR
+    if backend == "sqlite":
+        from core.storage.sqlite_backend import SQLiteStorage
+        return SQLiteStorage(sqlite_path or default_sqlite_path(data_dir))
+    from core.storage.file_backend import FileStorage
+    return FileStorage(data_dir, flush_delay=settings.STORAGE_FLUSH_DELAY, storage_format=settings.STORAGE_FORMAT,
+                       multiprocess=settings.STORAGE_MULTIPROCESS)
+
+
+storage = create_storage()
@@ -0,0 +1,85 @@
+# 文件后端的冷存储：按最后更新时间统计会话大小分布，并把长期未更新的会话压缩归档到 cold/ 目录
+# 元数据索引（index.jsonl）不受影响，会话列表照常显示已归档会话；读写时自动解压回热日志（见 conv_log.py）。
+from datetime import datetime
+from typing import List, Optional
+
+from core.storage.conv_log import file_size
+from core.storage.file_backend import FileConversationRepository
+
+# (上限天数, 名称)，按最后更新时间距今的天数分组
+AGE_BUCKETS = [(7, "<7d"), (30, "7-30d"), (90, "30-90d"), (None, ">=90d")]
+
+
+def idle_days(entry: dict, now: datetime) -> float:
+    """距最后更新（没有则为创建时间）的天数，时间无法解析时视为 0"""
+    stamp = entry.get("updated_at") or entry.get("created_at") or ""
+    try:
+        updated = datetime.fromisoformat(stamp.rstrip("Z"))
+    except ValueError:
+        return 0.0
+    return max((now - updated).total_seconds() / 86400, 0.0)
+
+
+def age_bucket(days: float) -> str:
+    for limit, name in AGE_BUCKETS:
+        if limit is None or days < limit:
+            return name
+    return AGE_BUCKETS[-1][1]
+
+
+def _entries(repo: FileConversationRepository) -> List[dict]:
+    repo.index.ensure_loaded()
+    return repo.index.page(0, repo.index.total)
+
+
+def _hot_bytes(repo: FileConversationRepository, conversation_id: str) -> int:
+    store = repo.store
+    path = store.hot_path(conversation_id)
+    idx = store.offsets.idx_path(path) if path is not None else None
+    return file_size(path) + file_size(idx) + file_size(store.legacy_path(conversation_id))
+
+
+def storage_report(repo: FileConversationRepository, archive_after_days: float,
+                   now: Optional[datetime] = None) -> dict:
+    """热/冷两层的会话数与字节数、按空闲时间的分布，以及可归档的会话数"""
+    now = now or datetime.utcnow()
+    report = {
+        "hot": {"conversations": 0, "bytes": 0},
+        "cold": {"conversations": 0, "bytes": 0},
+        "age": {name: {"conversations": 0, "bytes": 0} for _, name in AGE_BUCKETS},
+        "archivable": {"conversations": 0, "bytes": 0},
+    }
+    for entry in _entries(repo):
+        cid = entry["conversation_id"]
+        tier = "cold" if repo.store.is_archived(cid) else "hot"
+        size = file_size(repo.store.cold_path(cid)) if tier == "cold" else _hot_bytes(repo, cid)
+        days = idle_days(entry, now)
+        for bucket in (report[tier], report["age"][age_bucket(days)]):
+            bucket["conversations"] += 1
+            bucket["bytes"] += size
+        if tier == "hot" and days >= archive_after_days:
+            report["archivable"]["conversations"] += 1
+            report["archivable"]["bytes"] += size
+    return report
+
+
+async def archive_idle(repo: FileConversationRepository, days: float, compression: str = "gzip",
+                       dry_run: bool = False, now: Optional[datetime] = None) -> dict:
+    """归档空闲 days 天及以上的热会话，返回数量与归档前后的字节数"""
+    now = now or datetime.utcnow()
+    result = {"conversations": 0, "bytes_before": 0, "bytes_after": 0}
+    for entry in _entries(repo):
+        cid = entry["conversation_id"]
+        if idle_days(entry, now) < days or not repo.store.exists(cid) or repo.store.is_archived(cid):
+            continue
+        if dry_run:
+            result["conversations"] += 1
+            result["bytes_before"] += _hot_bytes(repo, cid)
+            continue
+        sizes = await repo.archive(cid, compression)
+        if sizes is None:
+            continue
+        result["conversations"] += 1
+        result["bytes_before"] += sizes[0]
+        result["bytes_after"] += sizes[1]
+    return result
@@ -0,0 +1,160 @@
+# 存储抽象接口：路由只通过这些接口读写会话、收藏夹与标签，
+# 具体落地为文件（file_backend）或 SQLite（sqlite_backend）。
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+
+class ConflictError(Exception):
+    """写入时会话版本号与预期不符（期间已被其他写入者修改）"""
+
+    def __init__(self, conversation_id: str, expected: int, actual: int):
+        super().__init__(f"会话 {conversation_id} 版本冲突：预期 {expected}，实际 {actual}")
+        self.conversation_id = conversation_id
+        self.expected = expected
+        self.actual = actual
+
+
+class ConversationRepository(ABC):
+    """
+    会话元数据带有 revision（版本号），每次写入元数据时加 1。
+    append / write_meta 传入 expected_revision 时，只有当前版本号与之相等才会写入，
+    否则抛出 ConflictError，用于防止读-改-写期间的更新丢失。
+    """
+
+    @abstractmethod
+    async def exists(self, conversation_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def load(self, conversation_id: str) -> Optional[dict]:
+        """完整会话对象（元数据 + messages），不存在返回 None"""
+
+    @abstractmethod
+    async def load_page(self, conversation_id: str, offset: int, limit: int,
+                        reverse: bool = False) -> Optional[Tuple[dict, List[dict], int]]:
+        """
+        只读取一页消息，返回 (元数据, 本页消息, 消息总数)，不存在返回 None
+        reverse=True 时 offset 从最新一条往前数（取最后 N 条），本页消息仍按时间正序
+        """
+
+    @abstractmethod
+    async def append(self, conversation_id: str, messages: List[dict], meta: Optional[dict] = None,
+                     expected_revision: Optional[int] = None) -> int:
+        """追加消息，meta 不为空时同时更新元数据；返回写入后的版本号"""
+
+    async def write_meta(self, conversation_id: str, meta: dict, expected_revision: Optional[int] = None) -> int:
+        return await self.append(conversation_id, [], meta, expected_revision)
+
+    @abstractmethod
+    async def put(self, conversation_id: str, meta: dict, messages: List[dict]):
+        """整体写入一个会话（迁移、导入用）"""
+
+    @abstractmethod
+    async def delete(self, conversation_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def list_page(self, offset: int, limit: int) -> Tuple[List[dict], int]:
+        """按 created_at 降序返回 (本页元数据条目, 总数)"""
+
+    @abstractmethod
+    async def get_meta(self, conversation_id: str) -> Optional[dict]:
+        """索引中的元数据条目（不含消息）"""
+
+    @abstractmethod
+    def iter_conversations(self) -> AsyncIterator[dict]:
+        """遍历所有完整会话对象（只读，迁移用）"""
+
+    @abstractmethod
+    async def rebuild_index(self) -> int:
+        """重建列表索引，返回会话总数"""
+
+
+class FolderRepository(ABC):
+    @abstractmethod
+    async def list(self) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def get(self, folder_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def save(self, folder: dict):
+        """新增或整体更新一个收藏夹"""
+
+    @abstractmethod
+    async def delete(self, folder_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def rename(self, folder_id: str, name: str, updated_at: str) -> Optional[dict]:
+        """只修改名称（不覆盖会话成员），返回收藏夹，不存在返回 None"""
+
+    @abstractmethod
+    async def add_conversation(self, folder_id: str, conversation_id: str, updated_at: str) -> Optional[dict]:
+        """会话加入收藏夹（已在其中则不变），返回收藏夹，不存在返回 None"""
+
+    @abstractmethod
+    async def remove_conversation(self, folder_id: str, conversation_id: str, updated_at: str) -> Optional[dict]:
+        """从收藏夹移除会话，返回收藏夹，不存在返回 None"""
+
+    @abstractmethod
+    async def version(self) -> str:
+        """收藏夹整体的版本号，任何变更后都会改变；用于 ETag，不读取收藏夹内容"""
+
+    async def flush(self):
+        """写回尚未落盘的变更（仅延迟写入的后端需要）"""
+
+
+class TagRepository(ABC):
+    @abstractmethod
+    async def add(self, tag: dict):
+        ...
+
+    @abstractmethod
+    async def get(self, tag_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def update(self, tag_id: str, fields: dict) -> Optional[dict]:
+        """更新并返回新标签对象，不存在返回 None"""
+
+    @abstractmethod
+    async def delete(self, tag_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def list_by_conversation(self, conversation_id: str) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def list_all(self) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def list_conversations(self, tag: str) -> List[str]:
+        """带有该标签文本的会话ID（去重）"""
+
+    @abstractmethod
+    async def counts(self) -> Dict[str, int]:
+        """标签文本 -> 带有该标签的会话数"""
+
+    @abstractmethod
+    async def version(self) -> str:
+        """全部标签的版本号，任何变更后都会改变；用于 ETag，不读取标签内容"""
+
+    async def flush(self):
+        """写回尚未落盘的变更（仅延迟写入的后端需要）"""
+
+
+class Storage:
+    """一组仓库的组合，由 create_storage 按配置创建"""
+
+    def __init__(self, conversations: ConversationRepository, folders: FolderRepository, tags: TagRepository):
+        self.conversations = conversations
+        self.folders = folders
+        self.tags = tags
+
+    async def close(self):
+        pass
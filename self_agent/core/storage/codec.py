@@ -0,0 +1,96 @@
+# 持久化数据的编解码
+# - json：紧凑 JSON（无多余空白）。安装了 orjson 时用 orjson 编解码，否则退回标准库 json。
+# - msgpack：MessagePack 二进制，需安装 msgpack。
+# 整文档文件（folders.json、tags.json）按配置 STORAGE_FORMAT 编码，读取时按内容识别格式，与文件名无关：
+# JSON 文档以 { 或 [ 开头，MessagePack 的 map/array 首字节不会是这两个字符或空白。
+# 会话日志、元数据索引等按行追加的文件依赖换行分隔与字节偏移，始终为每行一条紧凑 JSON。
+import json
+from pathlib import Path
+from typing import Any, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_json(obj: Any) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson 不支持的类型（如超出 64 位的整数）退回标准库
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_line(obj: Any) -> bytes:
+    """按行追加的文件中的一行"""
+    return dumps_json(obj) + b"\n"
+
+
+class JsonCodec:
+    name = "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return dumps_json(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return loads_json(data)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError as e:
+            raise RuntimeError("STORAGE_FORMAT=msgpack 需要安装 msgpack：pip install msgpack") from e
+        self._msgpack = msgpack
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes) -> Any:
+        return self._msgpack.unpackb(data, raw=False)
+
+
+CODECS = {"json": JsonCodec, "msgpack": MsgpackCodec}
+_instances = {}
+
+
+def get_codec(name: str):
+    codec = _instances.get(name)
+    if codec is None:
+        if name not in CODECS:
+            raise ValueError(f"未知的存储格式: {name}")
+        codec = _instances[name] = CODECS[name]()
+    return codec
+
+
+def detect_format(data: bytes) -> str:
+    head = data.lstrip()[:1]
+    return "json" if head in (b"{", b"[", b"") else "msgpack"
+
+
+def decode_document(data: bytes) -> Any:
+    if not data.strip():
+        return None
+    return get_codec(detect_format(data)).loads(data)
+
+
+def read_document(path: Path) -> Optional[Any]:
+    """读取整文档文件，自动识别格式；文件不存在或为空返回 None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return decode_document(data)
@@ -0,0 +1,53 @@
+# 冷存储使用的压缩算法
+# gzip 使用标准库；zstd 需安装 zstandard（pip install zstandard），压缩率与速度都更好。
+# 冷文件的扩展名标明算法，读取时按扩展名选择解压方式，不同算法的冷文件可以共存。
+import gzip
+from typing import Dict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Gzip:
+    name = "gzip"
+    suffix = ".gz"
+
+    def compress(self, data: bytes) -> bytes:
+        # mtime=0：相同内容得到相同的压缩结果
+        return gzip.compress(data, compresslevel=6, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+
+class Zstd:
+    name = "zstd"
+    suffix = ".zst"
+
+    def __init__(self):
+        if zstandard is None:
+            raise RuntimeError("ARCHIVE_COMPRESSION=zstd 需要安装 zstandard：pip install zstandard")
+
+    def compress(self, data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=10).compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        # 压缩时写入了内容长度，可一次性解压
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+COMPRESSORS = {"gzip": Gzip, "zstd": Zstd}
+# 读取冷文件时按扩展名识别
+SUFFIXES = {cls.suffix: name for name, cls in COMPRESSORS.items()}
+_instances: Dict[str, object] = {}
+
+
+def get_compressor(name: str):
+    compressor = _instances.get(name)
+    if compressor is None:
+        if name not in COMPRESSORS:
+            raise ValueError(f"未知的压缩算法: {name}")
+        compressor = _instances[name] = COMPRESSORS[name]()
+    return compressor
@@ -0,0 +1,356 @@
+# 会话追加日志存储
+# 每个会话一个 conversations/ab/cd/{conversation_id}.jsonl 文件（按 id 哈希前缀分片，见 layout），每行一条记录：
+#   {"type": "meta", "data": {...}}  会话元数据快照（名称、摘要、时间、配置等），最后一条生效
+#   {"type": "msg", "data": {...}}   一条消息
+# 发送消息只追加新行，不再重写整个文件；元数据记录累积过多时压缩为单条。
+# 旧版 {conversation_id}.json 在首次访问时迁移为日志格式，旧版平铺在 data/ 下的日志首次访问时移动到分片目录。
+# 长期未访问的会话可归档到冷目录 cold/ab/cd/{conversation_id}.jsonl.gz（或 .zst），首次访问时解压回原位置。
+import os
+import uuid
+import asyncio
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+import aiofiles
+
+from core.logger import logger
+from core.storage.codec import encode_line, loads_json
+from core.storage.compression import SUFFIXES, get_compressor
+from core.storage.layout import COLD_DIR, CONVERSATIONS_DIR, shard
+from core.storage.locks import KeyedLocks
+from core.storage.msg_offsets import MessageOffsets
+
+# 单个文件中元数据记录超过该数量时压缩
+META_COMPACT_THRESHOLD = 50
+
+
+def file_size(path: Optional[Path]) -> int:
+    try:
+        return path.stat().st_size if path is not None else 0
+    except FileNotFoundError:
+        return 0
+
+
+def encode_record(record_type: str, data: dict) -> bytes:
+    return encode_line({"type": record_type, "data": data})
+
+
+def replay(lines: Iterable[bytes]):
+    """重放日志行，返回 (meta, messages, meta 记录数)"""
+    meta = {}
+    messages = []
+    meta_records = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = loads_json(line)
+        except ValueError:
+            # 写入中断留下的半行，跳过
+            continue
+        if record.get("type") == "msg":
+            messages.append(record["data"])
+        elif record.get("type") == "meta":
+            meta = record["data"]
+            meta_records += 1
+    return meta, messages, meta_records
+
+
+class ConversationLogStore:
+    def __init__(self, data_dir: Path, system_files: Iterable[str] = (), meta_compact_threshold: int = META_COMPACT_THRESHOLD,
+                 lock_dir: Optional[Path] = None):
+        self.data_dir = Path(data_dir)
+        # 旧版平铺布局下与会话文件同目录的系统文件，扫描平铺文件时排除
+        self.system_files = set(system_files)
+        self.meta_compact_threshold = meta_compact_threshold
+        # 本进程内已知的每个会话 meta 记录数，用于判断何时压缩
+        self._meta_records = {}
+        # 消息偏移索引（{id}.idx），分页读取用；指定 lock_dir 时其锁跨进程有效
+        self.offsets = MessageOffsets(lock_dir=lock_dir)
+        self.conv_dir = self.data_dir / CONVERSATIONS_DIR
+        # 冷存储目录；同一会话的解压与归档串行
+        self.cold_dir = self.data_dir / COLD_DIR
+        self._cold_locks = KeyedLocks()
+
+    def log_path(self, conversation_id: str) -> Path:
+        return self.conv_dir / shard(conversation_id) / f"{conversation_id}.jsonl"
+
+    def flat_log_path(self, conversation_id: str) -> Path:
+        """旧版平铺布局下的日志"""
+        return self.data_dir / f"{conversation_id}.jsonl"
+
+    def legacy_path(self, conversation_id: str) -> Path:
+        return self.data_dir / f"{conversation_id}.json"
+
+    def hot_path(self, conversation_id: str) -> Optional[Path]:
+        """现存的热日志（分片或旧版平铺位置），没有返回 None"""
+        for path in (self.log_path(conversation_id), self.flat_log_path(conversation_id)):
+            if path.exists():
+                return path
+        return None
+
+    def cold_path(self, conversation_id: str) -> Optional[Path]:
+        """已归档会话的冷文件，未归档返回 None"""
+        for directory in (self.cold_dir / shard(conversation_id), self.cold_dir):
+            for suffix in SUFFIXES:
+                path = directory / f"{conversation_id}.jsonl{suffix}"
+                if path.exists():
+                    return path
+        return None
+
+    def is_archived(self, conversation_id: str) -> bool:
+        """只有冷文件、没有热日志"""
+        return self.hot_path(conversation_id) is None and self.cold_path(conversation_id) is not None
+
+    def exists(self, conversation_id: str) -> bool:
+        return (self.hot_path(conversation_id) is not None or self.legacy_path(conversation_id).exists()
+                or self.cold_path(conversation_id) is not None)
+
+    # ---------- 迁移 ----------
+    def migrate_flat(self, conversation_id: str) -> bool:
+        """将旧版平铺布局的日志与偏移索引移动到分片目录，返回是否发生移动"""
+        flat = self.flat_log_path(conversation_id)
+        path = self.log_path(conversation_id)
+        if not flat.exists() or path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 两个路径文件名相同，对应同一把偏移索引锁：移动期间不会有分页读取
+        with self.offsets.lock_for(path):
+            try:
+                os.rename(flat, path)
+            except FileNotFoundError:
+                # 其他协程或进程刚移动完
+                return False
+            try:
+                os.rename(self.offsets.idx_path(flat), self.offsets.idx_path(path))
+            except FileNotFoundError:
+                pass
+        return True
+
+    async def migrate_legacy(self, conversation_id: str) -> bool:
+        """将旧版整文件 JSON 转为日志格式，返回是否发生迁移"""
+        legacy = self.legacy_path(conversation_id)
+        if not legacy.exists() or self.log_path(conversation_id).exists():
+            return False
+        async with aiofiles.open(legacy, "rb") as f:
+            conv_obj = loads_json(await f.read())
+        messages = conv_obj.pop("messages", None) or []
+        await self._rewrite(conversation_id, conv_obj, messages)
+        legacy.unlink()
+        logger.info(f"[会话ID:{conversation_id}] 已迁移为追加日志格式")
+        return True
+
+    async def ensure_hot(self, conversation_id: str) -> bool:
+        """读写前把旧版文件或冷文件转为分片目录中的热日志，返回热日志是否存在；已存在时只需一次 stat"""
+        if self.log_path(conversation_id).exists():
+            return True
+        # 移动在偏移索引的跨进程锁内进行，放到线程中，不阻塞事件循环
+        await asyncio.to_thread(self.migrate_flat, conversation_id)
+        await self.migrate_legacy(conversation_id)
+        if self.cold_path(conversation_id) is not None:
+            await self.rehydrate(conversation_id)
+        return self.log_path(conversation_id).exists()
+
+    # ---------- 冷存储 ----------
+    async def rehydrate(self, conversation_id: str) -> bool:
+        """将冷文件解压回热日志，返回是否发生解压"""
+        async with self._cold_locks.lock(conversation_id):
+            cold = self.cold_path(conversation_id)
+            # 热日志已存在（其他协程刚解压完）时以热日志为准
+            if cold is None or self.log_path(conversation_id).exists():
+                return False
+            await asyncio.to_thread(self._rehydrate_sync, conversation_id, cold)
+        logger.info(f"[会话ID:{conversation_id}] 已从冷存储恢复")
+        return True
+
+    def _rehydrate_sync(self, conversation_id: str, cold: Path):
+        data = get_compressor(SUFFIXES[cold.suffix]).decompress(cold.read_bytes())
+        path = self.log_path(conversation_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        # 偏移索引在首次分页读取时重建
+        self.offsets.remove(path)
+        cold.unlink()
+
+    async def archive(self, conversation_id: str, compression: str = "gzip") -> Optional[Tuple[int, int]]:
+        """压缩并移入冷目录，返回 (归档前字节数, 冷文件字节数)；会话不存在或已归档返回 None"""
+        compressor = get_compressor(compression)
+        await self.migrate_legacy(conversation_id)
+        # 先压缩为一条元数据 + 全部消息，去掉历史元数据快照
+        await self.compact(conversation_id)
+        async with self._cold_locks.lock(conversation_id):
+            path = self.log_path(conversation_id)
+            if not path.exists():
+                return None
+            return await asyncio.to_thread(self._archive_sync, conversation_id, path, compressor)
+
+    def _archive_sync(self, conversation_id: str, path: Path, compressor) -> Tuple[int, int]:
+        data = path.read_bytes()
+        before = len(data) + file_size(self.offsets.idx_path(path))
+        compressed = compressor.compress(data)
+        cold = self.cold_dir / shard(conversation_id) / f"{conversation_id}.jsonl{compressor.suffix}"
+        cold.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cold.with_name(f"{cold.name}.{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, cold)
+        # 冷文件就位后才删除热日志，任何时刻至少有一份完整数据
+        path.unlink()
+        self.offsets.remove(path)
+        self._meta_records.pop(conversation_id, None)
+        return before, len(compressed)
+
+    def _drop_cold(self, conversation_id: str) -> bool:
+        cold = self.cold_path(conversation_id)
+        if cold is None:
+            return False
+        cold.unlink(missing_ok=True)
+        return True
+
+
+    # ---------- 读 ----------
+    async def load(self, conversation_id: str) -> Optional[dict]:
+        """读取完整会话对象（元数据 + 全部消息），不存在返回 None"""
+        if not await self.ensure_hot(conversation_id):
+            return None
+        path = self.log_path(conversation_id)
+        async with aiofiles.open(path, "rb") as f:
+            content = await f.read()
+        meta, messages, meta_records = replay(content.splitlines())
+        self._meta_records[conversation_id] = meta_records
+        conv_obj = dict(meta)
+        conv_obj["messages"] = messages
+        return conv_obj
+
+    async def read_page(self, conversation_id: str, offset: int, limit: int, reverse: bool = False):
+        """按偏移索引只读取一页消息，返回 (元数据, 本页消息, 消息总数)，不存在返回 None"""
+        await self.ensure_hot(conversation_id)
+        return await asyncio.to_thread(
+            self.offsets.read_page, self.log_path(conversation_id), offset, limit, reverse)
+
+    # ---------- 写 ----------
+    async def append(self, conversation_id: str, messages: List[dict], meta: Optional[dict] = None):
+        """追加消息，并可同时追加一条新的元数据快照；一次写入完成"""
+        path = self.log_path(conversation_id)
+        if not await self.ensure_hot(conversation_id):
+            # 新会话：分片目录可能尚不存在
+            path.parent.mkdir(parents=True, exist_ok=True)
+        chunk = b"".join(encode_record("msg", m) for m in messages)
+        if meta is not None:
+            chunk += encode_record("meta", self._strip_meta(meta))
+        if self._ends_without_newline(path):
+            chunk = b"\n" + chunk
+        async with aiofiles.open(path, "ab") as f:
+            await f.write(chunk)
+        if meta is not None:
+            await self._count_meta_record(conversation_id)
+
+    async def write_meta(self, conversation_id: str, meta: dict):
+        await self.append(conversation_id, [], meta)
+
+    async def put(self, conversation_id: str, meta: dict, messages: List[dict]):
+        """整体写入（覆盖）一个会话"""
+        await self._rewrite(conversation_id, meta, messages)
+        self._drop_cold(conversation_id)
+
+    async def compact(self, conversation_id: str):
+        """重写为一条元数据 + 全部消息"""
+        conv_obj = await self.load(conversation_id)
+        if conv_obj is None:
+            return
+        messages = conv_obj.pop("messages")
+        await self._rewrite(conversation_id, conv_obj, messages)
+
+    async def delete(self, conversation_id: str) -> bool:
+        deleted = False
+        for path in (self.log_path(conversation_id), self.flat_log_path(conversation_id), self.legacy_path(conversation_id)):
+            if path.exists():
+                path.unlink()
+                deleted = True
+        deleted = self._drop_cold(conversation_id) or deleted
+        await asyncio.to_thread(self.offsets.remove, self.log_path(conversation_id))
+        await asyncio.to_thread(self.offsets.remove, self.flat_log_path(conversation_id))
+        self._meta_records.pop(conversation_id, None)
+        return deleted
+
+    async def _rewrite(self, conversation_id: str, meta: dict, messages: List[dict]):
+        path = self.log_path(conversation_id)
+        lines = [encode_record("meta", self._strip_meta(meta))]
+        lines.extend(encode_record("msg", m) for m in messages)
+        await asyncio.to_thread(self._replace_log, path, lines)
+        self._meta_records[conversation_id] = 1
+
+    def _replace_log(self, path: Path, lines: List[bytes]):
+        """先写临时文件再 rename，并在同一把锁内写入新的偏移索引，读者不会看到日志与索引不一致"""
+        offsets = []
+        pos = len(lines[0])
+        for line in lines[1:]:
+            offsets.append(pos)
+            pos += len(line)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        with self.offsets.lock_for(path):
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(lines))
+            os.replace(tmp_path, path)
+            self.offsets.write(path, 0, offsets, pos)
+
+    async def _count_meta_record(self, conversation_id: str):
+        if conversation_id not in self._meta_records:
+            return
+        self._meta_records[conversation_id] += 1
+        if self._meta_records[conversation_id] > self.meta_compact_threshold:
+            await self.compact(conversation_id)
+
+    @staticmethod
+    def _strip_meta(meta: dict) -> dict:
+        return {k: v for k, v in meta.items() if k != "messages"}
+
+    @staticmethod
+    def _ends_without_newline(path: Path) -> bool:
+        """上次写入被中断时文件末尾可能缺少换行，追加前补齐以免与新记录粘连"""
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return False
+        if size == 0:
+            return False
+        with open(path, "rb") as f:
+            f.seek(size - 1)
+            return f.read(1) != b"\n"
+
+    # ---------- 扫描（重建索引用） ----------
+    def conversation_ids(self) -> List[str]:
+        ids = {p.stem for p in self.conv_dir.glob("*/*/*.jsonl")}
+        # 旧版平铺布局中尚未移动的会话
+        flat = {p.stem for p in self.data_dir.glob("*.jsonl")}
+        flat.update(p.stem for p in self.data_dir.glob("*.json"))
+        # 系统文件及其按进程区分的变体（如 pending_turns.{pid}.jsonl）不是会话
+        ids.update(i for i in flat if i.split(".")[0] not in self.system_files)
+        for suffix in SUFFIXES:
+            for pattern in (f"*/*/*.jsonl{suffix}", f"*.jsonl{suffix}"):
+                ids.update(p.name[:-len(".jsonl" + suffix)] for p in self.cold_dir.glob(pattern))
+        return sorted(ids)
+
+    def read_sync(self, conversation_id: str) -> Optional[dict]:
+        """同步读取会话对象（不触发迁移、不解压回热日志），供命令行和索引重建使用"""
+        path = self.hot_path(conversation_id)
+        cold = self.cold_path(conversation_id)
+        if path is not None or cold is not None:
+            if path is not None:
+                with open(path, "rb") as f:
+                    meta, messages, _ = replay(f)
+            else:
+                data = get_compressor(SUFFIXES[cold.suffix]).decompress(cold.read_bytes())
+                meta, messages, _ = replay(data.splitlines())
+            conv_obj = dict(meta)
+            conv_obj["messages"] = messages
+            return conv_obj
+        legacy = self.legacy_path(conversation_id)
+        if legacy.exists():
+            with open(legacy, "rb") as f:
+                return loads_json(f.read())
+        return None
@@ -0,0 +1,516 @@
+# 文件存储后端：data/conversations 下分片存放的会话日志，data/system 下的 folders.json、tags.json 与元数据索引（布局见 layout）
+# 多个进程可共用同一 data 目录：会话写入、元数据索引与偏移索引始终在 data/system/locks 下的跨进程文件锁内进行；
+# 收藏夹、标签在 multiprocess 模式下改为加锁写穿，并在文件被其他进程改写后重新载入（见 filelock）。
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import aiofiles
+
+from core.logger import logger
+from core.metrics import STORAGE_SECONDS, timed_methods
+from core.storage.base import ConflictError, ConversationRepository, FolderRepository, TagRepository, Storage
+from core.storage.codec import get_codec, read_document
+from core.storage.conv_log import ConversationLogStore
+from core.storage.fileio import atomic_write, file_stamp
+from core.storage.filelock import LOCKS_DIR, ProcessLocks
+from core.storage.index import ConversationIndex, build_index_entry
+from core.storage.layout import system_dir, system_path
+from core.storage.writebehind import DebouncedWriter
+
+# 旧版平铺布局中与会话文件同在 data 目录下的系统文件
+SYSTEM_FILES = {"folders", "tags", "index", "pending_turns"}
+
+
+@timed_methods(STORAGE_SECONDS, backend="file", repo="conversations")
+class FileConversationRepository(ConversationRepository):
+    def __init__(self, data_dir: Path, lock_dir: Optional[Path] = None):
+        self.data_dir = Path(data_dir)
+        lock_dir = Path(lock_dir) if lock_dir is not None else system_dir(self.data_dir) / LOCKS_DIR
+        self.store = ConversationLogStore(self.data_dir, system_files=SYSTEM_FILES, lock_dir=lock_dir)
+        self.index = ConversationIndex(system_path(self.data_dir, "index.jsonl"), scan=self._scan,
+                                       lock_path=lock_dir / "index.lock")
+        # 会话级写锁（跨进程）：版本检查、追加、重写、归档在同一把锁内完成
+        self._write_locks = ProcessLocks(lock_dir, prefix="conv", stripes=256)
+
+    async def exists(self, conversation_id: str) -> bool:
+        return self.store.exists(conversation_id)
+
+    async def _ensure_hot(self, conversation_id: str):
+        # 需要迁移或解压时才加锁，热日志已存在只需一次 stat
+        if not self.store.log_path(conversation_id).exists():
+            async with self._write_locks.lock(conversation_id):
+                await self.store.ensure_hot(conversation_id)
+
+    async def load(self, conversation_id: str) -> Optional[dict]:
+        await self._ensure_hot(conversation_id)
+        return await self.store.load(conversation_id)
+
+    async def load_page(self, conversation_id: str, offset: int, limit: int, reverse: bool = False):
+        await self._ensure_hot(conversation_id)
+        return await self.store.read_page(conversation_id, offset, limit, reverse)
+
+    def _revision(self, conversation_id: str) -> int:
+        entry = self.index.get(conversation_id)
+        return entry["revision"] if entry else 0
+
+    async def append(self, conversation_id: str, messages: List[dict], meta: Optional[dict] = None,
+                     expected_revision: Optional[int] = None) -> int:
+        # 版本检查与写入在同一把锁内完成，避免检查后、写入前被其他协程或进程插入；
+        # 版本号取自元数据索引，读取前已读入其他进程追加的索引记录
+        async with self._write_locks.lock(conversation_id):
+            async with self.index.hold():
+                revision = self._revision(conversation_id)
+                if expected_revision is not None and expected_revision != revision:
+                    raise ConflictError(conversation_id, expected_revision, revision)
+                index_obj = None
+                if meta is not None:
+                    revision += 1
+                    meta = {**meta, "revision": revision}
+                    # 先基于追加前的索引计算条目，再写日志
+                    index_obj = self._index_obj(conversation_id, meta, len(messages))
+            await self.store.append(conversation_id, messages, meta)
+            if index_obj is not None:
+                async with self.index.hold():
+                    self.index.upsert(index_obj)
+            return revision
+
+    async def put(self, conversation_id: str, meta: dict, messages: List[dict]):
+        async with self._write_locks.lock(conversation_id):
+            await self.store.put(conversation_id, meta, messages)
+            async with self.index.hold():
+                self.index.upsert({**meta, "conversation_id": conversation_id, "messages": messages})
+
+    async def delete(self, conversation_id: str) -> bool:
+        async with self._write_locks.lock(conversation_id):
+            deleted = await self.store.delete(conversation_id)
+            async with self.index.hold():
+                self.index.remove(conversation_id)
+        return deleted
+
+    async def compact(self, conversation_id: str):
+        async with self._write_locks.lock(conversation_id):
+            await self.store.compact(conversation_id)
+
+    async def archive(self, conversation_id: str, compression: str = "gzip") -> Optional[Tuple[int, int]]:
+        # 命令行归档可能与服务进程同时运行，与追加写入共用会话锁
+        async with self._write_locks.lock(conversation_id):
+            return await self.store.archive(conversation_id, compression)
+
+    async def list_page(self, offset: int, limit: int) -> Tuple[List[dict], int]:
+        # 索引不存在时（首次启动或被删除）在线程中从磁盘重建一次
+        if not self.index.exists:
+            await asyncio.to_thread(self.index.ensure_loaded)
+        async with self.index.hold():
+            return self.index.page(offset, limit), self.index.total
+
+    async def get_meta(self, conversation_id: str) -> Optional[dict]:
+        if not self.index.exists:
+            await asyncio.to_thread(self.index.ensure_loaded)
+        async with self.index.hold():
+            return self.index.get(conversation_id)
+
+    async def iter_conversations(self):
+        for cid in self.store.conversation_ids():
+            obj = await asyncio.to_thread(self.store.read_sync, cid)
+            if obj is not None:
+                obj["conversation_id"] = cid
+                yield obj
+
+    async def rebuild_index(self) -> int:
+        await asyncio.to_thread(self.index.rebuild, self._scan())
+        async with self.index.hold():
+            return self.index.total
+
+    def _index_obj(self, conversation_id: str, meta: dict, appended: int) -> dict:
+        """meta 中带 messages 时以其长度为准，否则在索引原有计数上累加"""
+        obj = {**meta, "conversation_id": conversation_id}
+        if "messages" not in meta:
+            prev = self.index.get(conversation_id)
+            obj["message_count"] = (prev["message_count"] if prev else 0) + appended
+        return obj
+
+    def _scan(self):
+        """遍历 data 目录读取每个会话文件，生成索引条目（仅用于重建索引）"""
+        for cid in self.store.conversation_ids():
+            try:
+                obj = self.store.read_sync(cid) or {}
+            except Exception as e:
+                logger.error(f"[会话ID:{cid}] 读取会话失败: {e}")
+                obj = {"created_at": "1970-01-01T00:00:00Z"}
+            obj["conversation_id"] = cid
+            # 若无 created_at 字段，取文件创建时间
+            if not obj.get("created_at"):
+                p = self.store.log_path(cid)
+                if not p.exists():
+                    p = self.store.legacy_path(cid)
+                obj["created_at"] = datetime.utcfromtimestamp(p.stat().st_ctime).isoformat() + "Z"
+            yield build_index_entry(obj)
+
+
+@timed_methods(STORAGE_SECONDS, backend="file", repo="folders")
+class FileFolderRepository(FolderRepository):
+    """
+    folders.json 首次访问时载入内存：folder_id -> 收藏夹，会话成员用有序字典保存（按加入顺序、O(1) 判断成员）。
+    变更只改内存并标记脏，由 DebouncedWriter 合并后异步写回，连续的多次添加只写一次盘。
+    multiprocess 模式（多个进程共用文件）下，变更在跨进程锁内“重新载入 - 修改 - 立即写回”，
+    读取前比较文件的 (inode, mtime, 大小)，被其他进程改写过则重新载入。
+    """
+
+    def __init__(self, path: Path, flush_delay: float = 0.5, codec=None, multiprocess: bool = False,
+                 lock_dir: Optional[Path] = None):
+        self.path = Path(path)
+        # 写入格式；读取时按文件内容识别
+        self.codec = codec or get_codec("json")
+        self.multiprocess = multiprocess
+        self._loaded = False
+        self._folders = {}
+        self._writer = DebouncedWriter(self._write, flush_delay, name="folders.json")
+        # 锁文件目录由 FileStorage 统一传入：旧版平铺布局下文件在 data/，锁仍须与其他仓库同在 data/system/locks
+        self._locks = ProcessLocks(lock_dir if lock_dir is not None else self.path.parent / LOCKS_DIR)
+        # 已载入的文件状态与是否有待写回的变更（multiprocess 模式）
+        self._stamp = None
+        self._unwritten = False
+        # 版本号：本实例的随机前缀 + 变更次数，进程重启后不会与旧 ETag 相同
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+
+    def _ensure_loaded(self):
+        # 只在首次访问时同步读取一次；整个过程没有 await，不会与并发变更交错
+        if self.multiprocess:
+            self._sync()
+            return
+        if self._loaded:
+            return
+        self._load()
+        self._loaded = True
+
+    def _sync(self):
+        """multiprocess 模式：文件状态与上次载入时不同（其他进程写过）则重新载入，否则只需一次 stat"""
+        stamp = file_stamp(self.path)
+        if self._loaded and stamp == self._stamp:
+            return
+        self._folders = {}
+        self._load()
+        self._stamp = stamp
+        self._loaded = True
+
+    def _load(self):
+        folders = []
+        try:
+            folders = read_document(self.path) or []
+        except Exception as e:
+            logger.error(f"读取 folders.json 失败: {e}")
+        for folder in folders:
+            self._put(folder)
+
+    @asynccontextmanager
+    async def _mutation(self):
+        """包裹一次读-改-写；multiprocess 模式下持有跨进程锁，并在释放前写回"""
+        if not self.multiprocess:
+            self._ensure_loaded()
+            yield
+            return
+        async with self._locks.lock("folders"):
+            self._sync()
+            try:
+                yield
+            except BaseException:
+                # 修改中途失败，丢弃内存中未写回的部分，下次访问重新载入
+                self._loaded = self._unwritten = False
+                raise
+            if self._unwritten:
+                self._unwritten = False
+                await self._write()
+                self._stamp = file_stamp(self.path)
+
+    def _put(self, folder: dict):
+        self._folders[folder["folder_id"]] = {
+            **folder,
+            "conversation_ids": dict.fromkeys(folder.get("conversation_ids") or ()),
+        }
+
+    @staticmethod
+    def _export(folder: dict) -> dict:
+        return {**folder, "conversation_ids": list(folder["conversation_ids"])}
+
+    async def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        folders = [self._export(f) for f in self._folders.values()]
+        await atomic_write(self.path, self.codec.dumps(folders))
+
+    def _changed(self):
+        self._version += 1
+        if self.multiprocess:
+            self._unwritten = True
+        else:
+            self._writer.schedule()
+
+    async def flush(self):
+        await self._writer.flush()
+
+    async def version(self) -> str:
+        if self.multiprocess:
+            # 取文件状态，各进程对同一份文件得到相同的版本号
+            self._sync()
+            return "-".join(map(str, self._stamp or ()))
+        return f"{self._epoch}-{self._version}"
+
+    async def list(self) -> List[dict]:
+        self._ensure_loaded()
+        return [self._export(f) for f in self._folders.values()]
+
+    async def get(self, folder_id: str) -> Optional[dict]:
+        self._ensure_loaded()
+        folder = self._folders.get(folder_id)
+        return self._export(folder) if folder else None
+
+    async def save(self, folder: dict):
+        async with self._mutation():
+            self._put(folder)
+            self._changed()
+
+    async def delete(self, folder_id: str) -> bool:
+        async with self._mutation():
+            if self._folders.pop(folder_id, None) is None:
+                return False
+            self._changed()
+            return True
+
+    async def rename(self, folder_id: str, name: str, updated_at: str) -> Optional[dict]:
+        async with self._mutation():
+            folder = self._folders.get(folder_id)
+            if folder is None:
+                return None
+            folder["name"] = name
+            folder["updated_at"] = updated_at
+            self._changed()
+            return self._export(folder)
+
+    async def add_conversation(self, folder_id: str, conversation_id: str, updated_at: str) -> Optional[dict]:
+        async with self._mutation():
+            folder = self._folders.get(folder_id)
+            if folder is None:
+                return None
+            if conversation_id not in folder["conversation_ids"]:
+                folder["conversation_ids"][conversation_id] = None
+                folder["updated_at"] = updated_at
+                self._changed()
+            return self._export(folder)
+
+    async def remove_conversation(self, folder_id: str, conversation_id: str, updated_at: str) -> Optional[dict]:
+        async with self._mutation():
+            folder = self._folders.get(folder_id)
+            if folder is None:
+                return None
+            if conversation_id in folder["conversation_ids"]:
+                del folder["conversation_ids"][conversation_id]
+                folder["updated_at"] = updated_at
+                self._changed()
+            return self._export(folder)
+
+
+@timed_methods(STORAGE_SECONDS, backend="file", repo="tags")
+class FileTagRepository(TagRepository):
+    """
+    tags.json 首次访问时整体载入内存，之后读操作只查内存索引：
+    按标签 id、按会话 ID、按标签文本（-> 会话ID 计数）三个字典，查询代价与结果数量成正比。
+    变更先更新内存，再由 DebouncedWriter 合并后异步写回 tags.json。
+    multiprocess 模式下与收藏夹相同：变更加跨进程锁并立即写回，文件被其他进程改写后重新载入。
+    """
+
+    def __init__(self, path: Path, flush_delay: float = 0.5, codec=None, multiprocess: bool = False,
+                 lock_dir: Optional[Path] = None):
+        self.path = Path(path)
+        self.codec = codec or get_codec("json")
+        self.multiprocess = multiprocess
+        self._loaded = False
+        self._by_id = {}
+        self._by_conversation = {}
+        self._by_tag = {}
+        self._writer = DebouncedWriter(self._write, flush_delay, name="tags.json")
+        self._locks = ProcessLocks(lock_dir if lock_dir is not None else self.path.parent / LOCKS_DIR)
+        self._stamp = None
+        self._unwritten = False
+        # 版本号：本实例的随机前缀 + 变更次数，进程重启后不会与旧 ETag 相同
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+
+    def _ensure_loaded(self):
+        # 只在首次访问时同步读取一次；整个过程没有 await，不会与并发变更交错
+        if self.multiprocess:
+            self._sync()
+            return
+        if self._loaded:
+            return
+        self._load()
+        self._loaded = True
+
+    def _sync(self):
+        """multiprocess 模式：文件状态与上次载入时不同（其他进程写过）则重新载入，否则只需一次 stat"""
+        stamp = file_stamp(self.path)
+        if self._loaded and stamp == self._stamp:
+            return
+        self._by_id = {}
+        self._by_conversation = {}
+        self._by_tag = {}
+        self._load()
+        self._stamp = stamp
+        self._loaded = True
+
+    def _load(self):
+        tags = []
+        try:
+            tags = (read_document(self.path) or {}).get("tags", [])
+        except Exception as e:
+            logger.error(f"读取 tags.json 失败: {e}")
+        for t in tags:
+            self._index(t)
+
+    @asynccontextmanager
+    async def _mutation(self):
+        """包裹一次读-改-写；multiprocess 模式下持有跨进程锁，并在释放前写回"""
+        if not self.multiprocess:
+            self._ensure_loaded()
+            yield
+            return
+        async with self._locks.lock("tags"):
+            self._sync()
+            try:
+                yield
+            except BaseException:
+                self._loaded = self._unwritten = False
+                raise
+            if self._unwritten:
+                self._unwritten = False
+                await self._write()
+                self._stamp = file_stamp(self.path)
+
+    def _link_conversation(self, tag: dict):
+        self._by_conversation.setdefault(tag["conversation_id"], {})[tag["id"]] = None
+
+    def _unlink_conversation(self, tag: dict):
+        ids = self._by_conversation[tag["conversation_id"]]
+        del ids[tag["id"]]
+        if not ids:
+            del self._by_conversation[tag["conversation_id"]]
+
+    def _link_tag(self, tag: dict):
+        # 标签文本 -> {会话ID: 该会话上此标签的条数}
+        convs = self._by_tag.setdefault(tag["tag"], {})
+        convs[tag["conversation_id"]] = convs.get(tag["conversation_id"], 0) + 1
+
+    def _unlink_tag(self, tag: dict):
+        convs = self._by_tag[tag["tag"]]
+        convs[tag["conversation_id"]] -= 1
+        if not convs[tag["conversation_id"]]:
+            del convs[tag["conversation_id"]]
+        if not convs:
+            del self._by_tag[tag["tag"]]
+
+    def _index(self, tag: dict):
+        self._by_id[tag["id"]] = tag
+        self._link_conversation(tag)
+        self._link_tag(tag)
+
+    def _unindex(self, tag: dict):
+        self._unlink_conversation(tag)
+        self._unlink_tag(tag)
+
+    async def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"tags": list(self._by_id.values())}
+        await atomic_write(self.path, self.codec.dumps(data))
+
+    def _changed(self):
+        self._version += 1
+        if self.multiprocess:
+            self._unwritten = True
+        else:
+            self._writer.schedule()
+
+    async def flush(self):
+        await self._writer.flush()
+
+    async def version(self) -> str:
+        if self.multiprocess:
+            self._sync()
+            return "-".join(map(str, self._stamp or ()))
+        return f"{self._epoch}-{self._version}"
+
+    async def add(self, tag: dict):
+        async with self._mutation():
+            old = self._by_id.get(tag["id"])
+            if old is not None:
+                self._unindex(old)
+                del self._by_id[tag["id"]]
+            self._index(dict(tag))
+            self._changed()
+
+    async def get(self, tag_id: str) -> Optional[dict]:
+        self._ensure_loaded()
+        t = self._by_id.get(tag_id)
+        return dict(t) if t else None
+
+    async def update(self, tag_id: str, fields: dict) -> Optional[dict]:
+        async with self._mutation():
+            old = self._by_id.get(tag_id)
+            if old is None:
+                return None
+            new = {**old, **fields}
+            if new["conversation_id"] != old["conversation_id"]:
+                self._unlink_conversation(old)
+                self._link_conversation(new)
+            if new["conversation_id"] != old["conversation_id"] or new["tag"] != old["tag"]:
+                self._unlink_tag(old)
+                self._link_tag(new)
+            old.update(fields)
+            self._changed()
+            return dict(old)
+
+    async def delete(self, tag_id: str) -> bool:
+        async with self._mutation():
+            old = self._by_id.get(tag_id)
+            if old is None:
+                return False
+            self._unindex(old)
+            del self._by_id[tag_id]
+            self._changed()
+            return True
+
+    async def list_by_conversation(self, conversation_id: str) -> List[dict]:
+        self._ensure_loaded()
+        return [dict(self._by_id[i]) for i in self._by_conversation.get(conversation_id, ())]
+
+    async def list_all(self) -> List[dict]:
+        self._ensure_loaded()
+        return [dict(t) for t in self._by_id.values()]
+
+    async def list_conversations(self, tag: str) -> List[str]:
+        self._ensure_loaded()
+        return list(self._by_tag.get(tag, ()))
+
+    async def counts(self) -> Dict[str, int]:
+        self._ensure_loaded()
+        return {tag: len(convs) for tag, convs in self._by_tag.items()}
+
+
+class FileStorage(Storage):
+    def __init__(self, data_dir: Path, flush_delay: float = 0.5, storage_format: str = "json", multiprocess: bool = False):
+        data_dir = Path(data_dir)
+        system_dir(data_dir).mkdir(parents=True, exist_ok=True)
+        codec = get_codec(storage_format)
+        # 所有仓库共用同一个锁目录，与系统文件位于新位置还是旧版平铺位置无关
+        lock_dir = system_dir(data_dir) / LOCKS_DIR
+        super().__init__(
+            conversations=FileConversationRepository(data_dir, lock_dir),
+            folders=FileFolderRepository(system_path(data_dir, "folders.json"), flush_delay, codec, multiprocess, lock_dir),
+            tags=FileTagRepository(system_path(data_dir, "tags.json"), flush_delay, codec, multiprocess, lock_dir),
+        )
+
+    async def close(self):
+        # 写回尚未落盘的延迟写入
+        await self.folders.flush()
+        await self.tags.flush()
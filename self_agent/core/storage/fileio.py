@@ -0,0 +1,26 @@
+# 文件读写工具
+import os
+import uuid
+from pathlib import Path
+from typing import Optional, Tuple, Union
+import aiofiles
+
+
+async def atomic_write(path: Path, content: Union[str, bytes]):
+    """先写同目录临时文件再 rename，读者只会看到旧文件或完整新文件；临时文件名唯一，并发写互不覆盖"""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    async with aiofiles.open(tmp_path, "wb") as f:
+        await f.write(content)
+    os.replace(tmp_path, path)
+
+
+def file_stamp(path: Path) -> Optional[Tuple[int, int, int]]:
+    """文件的 (inode, 修改时间 ns, 大小)，用于发现文件被其他进程改写或替换；不存在返回 None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
@@ -0,0 +1,147 @@
+# 跨进程文件锁（fcntl.flock）
+# 多个 worker 进程（uvicorn --workers N）共用同一 data 目录时，进程内的 asyncio / threading 锁互相不可见，
+# 写路径需在锁文件（data/system/locks/*.lock）上再取一把 flock 排他锁：
+#   FileLock      同步可重入锁，进程内由 RLock 串行、进程间由 flock 互斥；用于短小的同步临界区（索引 journal、偏移索引）。
+#                 阻塞获取只能在线程中进行；事件循环中用 hold() 轮询获取，锁内的同步调用可重入
+#   ProcessLocks  异步按键锁，进程内按锁文件排队（KeyedLocks），再以非阻塞方式轮询 flock，等待期间不占用线程
+# flock 随文件描述符释放，持锁进程崩溃后锁自动解除，不会残留死锁。
+# 没有 fcntl 的平台（Windows）上退化为仅进程内有效。
+import os
+import asyncio
+import threading
+import zlib
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
+
+from core.storage.locks import KeyedLocks
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+LOCKS_DIR = "locks"
+# 轮询 flock 的退避间隔（秒）
+POLL_MIN = 0.001
+POLL_MAX = 0.02
+
+
+def open_lock_file(path: Path) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+
+def try_lock(fd: int) -> bool:
+    """非阻塞地取排他锁，被其他进程持有时返回 False"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def unlock(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def stripe(key: str, stripes: int) -> int:
+    # 用稳定哈希（crc32）分段：各进程中同一个键必须落到同一段（内置 hash 对字符串按进程随机化）
+    return zlib.crc32(key.encode("utf-8")) % stripes
+
+
+class FileLock:
+    """同步可重入的跨进程排他锁"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+        self._pid = None
+
+    def _descriptor(self) -> int:
+        # fork 出的子进程与父进程共享打开的文件描述，flock 互不排斥，需重新打开
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = open_lock_file(self.path)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self._rlock.acquire(blocking):
+            return False
+        try:
+            if self._depth == 0 and fcntl is not None:
+                if blocking:
+                    fcntl.flock(self._descriptor(), fcntl.LOCK_EX)
+                elif not try_lock(self._descriptor()):
+                    self._rlock.release()
+                    return False
+        except BaseException:
+            self._rlock.release()
+            raise
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            unlock(self._fd)
+        self._rlock.release()
+
+    @asynccontextmanager
+    async def hold(self):
+        """在事件循环中获取：被其他进程或线程持有时按退避间隔轮询，等待期间不阻塞事件循环；块内不要 await"""
+        delay = POLL_MIN
+        while not self.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLL_MAX)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ProcessLocks:
+    """
+    按键的异步跨进程锁；stripes 不为 0 时按键哈希分段到固定数量的锁文件（会话数再多锁文件数也不变），
+    否则每个键一个锁文件。不可重入，同一协程不要嵌套获取同一把锁。
+    """
+
+    def __init__(self, lock_dir: Path, prefix: str = "lock", stripes: int = 0):
+        self.lock_dir = Path(lock_dir)
+        self.prefix = prefix
+        self.stripes = stripes
+        self._local = KeyedLocks()
+
+    def path_for(self, key: str) -> Path:
+        name = f"{stripe(key, self.stripes):03d}" if self.stripes else key
+        return self.lock_dir / f"{self.prefix}-{name}.lock"
+
+    @asynccontextmanager
+    async def lock(self, key: str):
+        path = self.path_for(key)
+        # 进程内先按锁文件排队，同一锁文件同时只有一个协程去竞争 flock
+        async with self._local.lock(path.name):
+            fd = open_lock_file(path)
+            try:
+                delay = POLL_MIN
+                while not try_lock(fd):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, POLL_MAX)
+                try:
+                    yield
+                finally:
+                    unlock(fd)
+            finally:
+                os.close(fd)
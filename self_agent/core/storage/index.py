@@ -0,0 +1,258 @@
+# 会话元数据索引
+# 内存中维护 id -> 元数据 的字典，以及按 (created_at, id) 排序的列表，
+# 列表分页只需切片，不再逐个读取会话文件。
+# 变更以追加方式写入 journal（index.jsonl），启动时重放，条目过多时压缩为快照。
+# 多个进程共用 journal 时：写入（追加、压缩、重建）在跨进程文件锁内进行；每次读写前 stat 一次 journal，
+# 只读入其他进程新追加的尾部，文件被替换（其他进程压缩）时整体重新载入，各进程的内存索引保持一致。
+# 事件循环中的调用方先 async with index.hold() 取锁（不阻塞事件循环），再调用同步方法（锁可重入）。
+import os
+import bisect
+import threading
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from core.storage.codec import encode_line, loads_json
+from core.storage.filelock import FileLock
+
+INDEX_FIELDS = ("conversation_id", "name", "summary", "created_at", "updated_at", "message_count", "model", "revision")
+
+# journal 行数超过 存活条目*倍数 + 常量 时触发压缩
+COMPACT_FACTOR = 2
+COMPACT_SLACK = 1000
+
+
+def build_index_entry(conv_obj: dict) -> dict:
+    """从完整会话对象提取索引字段"""
+    config = conv_obj.get("config") or {}
+    return {
+        "conversation_id": conv_obj.get("conversation_id"),
+        "name": conv_obj.get("name"),
+        "summary": conv_obj.get("summary"),
+        "created_at": conv_obj.get("created_at") or "1970-01-01T00:00:00Z",
+        "updated_at": conv_obj.get("updated_at"),
+        "message_count": conv_obj.get("message_count", len(conv_obj.get("messages") or [])),
+        "model": config.get("model") if isinstance(config, dict) else None,
+        "revision": conv_obj.get("revision") or 0,
+    }
+
+
+class ConversationIndex:
+    def __init__(self, journal_path: Path, scan: Optional[Callable[[], Iterable[dict]]] = None,
+                 lock_path: Optional[Path] = None):
+        self.journal_path = Path(journal_path)
+        # 索引缺失时用于从磁盘重建的扫描函数
+        self._scan = scan
+        self._entries: dict = {}
+        # 升序排列的 (created_at, conversation_id)，分页时从尾部倒序切片
+        self._order: List[Tuple[str, str]] = []
+        self._journal_lines = 0
+        # 已读入的 journal 文件（inode）与字节数，用于发现其他进程的追加与替换
+        self._ino = None
+        self._offset = 0
+        self._loaded = False
+        # 指定锁文件时写入在跨进程锁内进行，否则只在进程内串行
+        self._lock = FileLock(lock_path) if lock_path is not None else threading.RLock()
+
+    @asynccontextmanager
+    async def hold(self):
+        """事件循环中取索引锁：跨进程锁被占用时轮询等待；进程内锁只在线程中短暂持有，直接获取"""
+        if isinstance(self._lock, FileLock):
+            async with self._lock.hold():
+                yield
+        else:
+            with self._lock:
+                yield
+
+    # ---------- 加载 / 持久化 ----------
+    @property
+    def exists(self) -> bool:
+        return self.journal_path.exists()
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if not self.journal_path.exists() and self._scan is not None:
+                self.rebuild(self._scan())
+                return
+            self._load_journal()
+            self._loaded = True
+
+    def _load_journal(self):
+        self._entries = {}
+        self._order = []
+        self._journal_lines = 0
+        self._ino = None
+        self._offset = 0
+        try:
+            f = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            self._ino = os.fstat(f.fileno()).st_ino
+            self._read_tail(f)
+
+    def _read_tail(self, f):
+        """从已读位置读到文件末尾；末尾没有换行的行（其他进程正在写入）留待下次读取"""
+        f.seek(self._offset)
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = loads_json(line)
+            except ValueError:
+                # 进程中断留下的半行，忽略
+                continue
+            self._apply(record)
+            self._journal_lines += 1
+        self._offset += end
+
+    def refresh(self):
+        """读入其他进程追加的记录；journal 被替换（压缩、重建）时整体重新载入"""
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return
+        if st.st_ino == self._ino and st.st_size == self._offset:
+            return
+        with self._lock:
+            try:
+                f = open(self.journal_path, "rb")
+            except FileNotFoundError:
+                return
+            with f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self._ino or st.st_size < self._offset:
+                    self._entries = {}
+                    self._order = []
+                    self._journal_lines = 0
+                    self._ino = st.st_ino
+                    self._offset = 0
+                self._read_tail(f)
+
+    def _apply(self, record: dict):
+        op = record.get("op")
+        if op == "put":
+            self._put(record["data"])
+        elif op == "del":
+            self._remove(record["id"])
+
+    def _append(self, record: dict):
+        """调用方需持有 self._lock 并已 refresh"""
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        chunk = encode_line(record)
+        with open(self.journal_path, "ab") as f:
+            st = os.fstat(f.fileno())
+            if st.st_ino != self._ino:
+                # journal 刚被创建
+                self._ino, self._offset = st.st_ino, 0
+            if st.st_size > self._offset:
+                # 末尾是中断留下的半行，补换行以免与新记录粘连
+                chunk = b"\n" + chunk
+            f.write(chunk)
+            self._offset = f.tell()
+        self._journal_lines += 1
+        if self._journal_lines > len(self._entries) * COMPACT_FACTOR + COMPACT_SLACK:
+            self.compact()
+
+    def compact(self):
+        """将 journal 重写为当前快照（先写临时文件再原子替换）"""
+        with self._lock:
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.journal_path.with_name(f"{self.journal_path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                for _, cid in self._order:
+                    f.write(encode_line({"op": "put", "data": self._entries[cid]}))
+            os.replace(tmp_path, self.journal_path)
+            st = os.stat(self.journal_path)
+            self._ino, self._offset = st.st_ino, st.st_size
+            self._journal_lines = len(self._entries)
+
+    def rebuild(self, entries: Iterable[dict]):
+        """用磁盘扫描结果整体重建索引"""
+        with self._lock:
+            self._entries = {}
+            self._order = []
+            for entry in entries:
+                self._put(entry)
+            self._loaded = True
+            self.compact()
+
+    # ---------- 内存结构维护 ----------
+    def _put(self, entry: dict):
+        entry = {k: entry.get(k) for k in INDEX_FIELDS}
+        entry["created_at"] = entry["created_at"] or "1970-01-01T00:00:00Z"
+        entry["revision"] = entry["revision"] or 0
+        cid = entry["conversation_id"]
+        old = self._entries.get(cid)
+        if old is not None and old["created_at"] != entry["created_at"]:
+            self._remove_order(old)
+        if old is None or old["created_at"] != entry["created_at"]:
+            bisect.insort(self._order, (entry["created_at"], cid))
+        self._entries[cid] = entry
+
+    def _remove(self, conversation_id: str) -> bool:
+        old = self._entries.pop(conversation_id, None)
+        if old is None:
+            return False
+        self._remove_order(old)
+        return True
+
+    def _remove_order(self, entry: dict):
+        key = (entry["created_at"], entry["conversation_id"])
+        i = bisect.bisect_left(self._order, key)
+        if i < len(self._order) and self._order[i] == key:
+            del self._order[i]
+
+    # ---------- 对外接口 ----------
+    def upsert(self, conv_obj: dict):
+        """send_message / set_config 后调用，增量更新单个会话"""
+        self.ensure_loaded()
+        entry = build_index_entry(conv_obj)
+        with self._lock:
+            self.refresh()
+            if self._entries.get(entry["conversation_id"]) == entry:
+                return
+            self._put(entry)
+            self._append({"op": "put", "data": entry})
+
+    def remove(self, conversation_id: str):
+        self.ensure_loaded()
+        with self._lock:
+            self.refresh()
+            if self._remove(conversation_id):
+                self._append({"op": "del", "id": conversation_id})
+
+    def _current(self):
+        self.ensure_loaded()
+        self.refresh()
+
+    def get(self, conversation_id: str) -> Optional[dict]:
+        self._current()
+        return self._entries.get(conversation_id)
+
+    def __contains__(self, conversation_id: str) -> bool:
+        self._current()
+        return conversation_id in self._entries
+
+    @property
+    def total(self) -> int:
+        self._current()
+        return len(self._entries)
+
+    def page(self, offset: int, limit: int) -> List[dict]:
+        """按 created_at 降序分页，代价 O(limit)"""
+        self._current()
+        with self._lock:
+            n = len(self._order)
+            hi = n - offset
+            lo = max(hi - limit, 0)
+            if hi <= 0:
+                return []
+            return [self._entries[cid] for _, cid in reversed(self._order[lo:hi])]
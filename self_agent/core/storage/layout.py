@@ -0,0 +1,33 @@
+# data 目录布局
+#   data/conversations/ab/cd/{id}.jsonl、{id}.idx   会话日志与偏移索引，按 sha1(id) 的前两级十六进制前缀分片
+#   data/cold/ab/cd/{id}.jsonl.gz                   归档的冷文件，同样分片
+#   data/system/                                    folders.json、tags.json、index.jsonl、pending_turns.jsonl 与各 SQLite 数据库
+# 每级 256 个目录，10 万个会话时每个叶子目录平均只有一两个文件，目录查找与列举不随会话数变慢；
+# 系统文件独立存放，扫描会话时无需再按文件名排除。
+# 早期版本把全部文件平铺在 data/ 下：平铺的会话文件在首次访问时移动到分片目录（见 conv_log），
+# 系统文件在新位置不存在时继续使用旧位置；python manage.py migrate-layout 一次性迁移全部文件。
+import hashlib
+from pathlib import Path
+
+CONVERSATIONS_DIR = "conversations"
+COLD_DIR = "cold"
+SYSTEM_DIR = "system"
+
+
+def shard(conversation_id: str) -> Path:
+    """会话所在的分片子目录（相对路径），如 ab/cd"""
+    digest = hashlib.sha1(conversation_id.encode("utf-8")).hexdigest()
+    return Path(digest[:2]) / digest[2:4]
+
+
+def system_dir(data_dir: Path) -> Path:
+    return Path(data_dir) / SYSTEM_DIR
+
+
+def system_path(data_dir: Path, name: str) -> Path:
+    """系统文件路径；新位置不存在而旧版平铺位置存在时返回旧位置"""
+    path = system_dir(data_dir) / name
+    legacy = Path(data_dir) / name
+    if not path.exists() and legacy.exists():
+        return legacy
+    return path
@@ -0,0 +1,38 @@
+# 按键（会话ID）划分的异步锁
+# 同一会话的写操作排队串行（asyncio.Lock 按先来先得唤醒），不同会话互不影响；
+# 没有持有者和等待者的锁会被回收，锁表大小只与当前活跃会话数有关。
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class KeyedLocks:
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    @asynccontextmanager
+    async def lock(self, key: str):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[key] -= 1
+            if self._users[key] == 0:
+                del self._users[key]
+                del self._locks[key]
+
+    def locked(self, key: str) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    def __len__(self):
+        return len(self._locks)
+
+
+# 会话级写锁：send_message / set_config 等读-改-写操作在此串行
+# 只在本进程内有效；多个 worker 进程之间由存储层的跨进程文件锁与版本检查（冲突时基于最新版本重放）保证不丢写入
+conversation_locks = KeyedLocks()
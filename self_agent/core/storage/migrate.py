@@ -0,0 +1,109 @@
+# 在两个存储后端之间复制全部数据（如 data 目录 -> SQLite），以及文件后端的格式转换与目录布局迁移
+import os
+from pathlib import Path
+
+from core.storage.base import Storage
+from core.storage.codec import get_codec, read_document
+from core.storage.fileio import atomic_write
+from core.storage.layout import shard, system_dir, system_path
+
+# 旧版平铺在 data 目录下的系统文件
+SYSTEM_NAMES = ("folders.json", "tags.json", "index.jsonl", "pending_turns.jsonl",
+                "self_agent.db", "search.db", "llm_cache.db")
+
+
+async def copy_storage(src: Storage, dst: Storage) -> dict:
+    """复制会话、收藏夹、标签，目标中同 id 的记录会被覆盖；返回各类数量"""
+    counts = {"conversations": 0, "messages": 0, "folders": 0, "tags": 0}
+    async for conv_obj in src.conversations.iter_conversations():
+        messages = conv_obj.pop("messages", None) or []
+        await dst.conversations.put(conv_obj["conversation_id"], conv_obj, messages)
+        counts["conversations"] += 1
+        counts["messages"] += len(messages)
+    for folder in await src.folders.list():
+        await dst.folders.save(folder)
+        counts["folders"] += 1
+    for tag in await src.tags.list_all():
+        await dst.tags.add(tag)
+        counts["tags"] += 1
+    return counts
+
+
+def _data_bytes(data_dir: Path) -> int:
+    # 只统计文件后端自身的文件，不含 SQLite 数据库
+    return sum(p.stat().st_size for p in data_dir.rglob("*")
+               if p.is_file() and p.suffix not in (".db", ".db-wal", ".db-shm"))
+
+
+async def convert_format(data_dir: Path, storage_format: str) -> dict:
+    """
+    原地转换 data 目录：
+    folders.json、tags.json 按 storage_format 重新编码（读取时自动识别原格式）；
+    旧版 .json 会话迁移为日志格式，全部会话日志压缩为一条元数据 + 全部消息的紧凑 JSON 行，并重建偏移与元数据索引。
+    """
+    from core.storage.file_backend import FileStorage
+
+    data_dir = Path(data_dir)
+    codec = get_codec(storage_format)
+    counts = {"documents": 0, "conversations": 0, "bytes_before": _data_bytes(data_dir)}
+    for name in ("folders.json", "tags.json"):
+        path = system_path(data_dir, name)
+        doc = read_document(path)
+        if doc is None:
+            continue
+        await atomic_write(path, codec.dumps(doc))
+        counts["documents"] += 1
+
+    storage = FileStorage(data_dir, storage_format=storage_format)
+    repo = storage.conversations
+    try:
+        for conversation_id in repo.store.conversation_ids():
+            # 已归档的会话保持压缩状态，不解压回热目录
+            if repo.store.is_archived(conversation_id):
+                continue
+            await repo.compact(conversation_id)
+            counts["conversations"] += 1
+        await repo.rebuild_index()
+    finally:
+        await storage.close()
+    counts["bytes_after"] = _data_bytes(data_dir)
+    return counts
+
+
+async def migrate_layout(data_dir: Path) -> dict:
+    """
+    将旧版平铺布局的 data 目录原地迁移为分片布局（见 layout），可重复执行，执行前需停止服务：
+    系统文件（含 SQLite 的 -wal、-shm）移入 system/，新位置已有同名文件时保留两者、不覆盖；
+    会话日志与偏移索引、冷文件移入分片目录，旧版 .json 会话转为日志格式。
+    """
+    from core.storage.conv_log import ConversationLogStore
+    from core.storage.file_backend import SYSTEM_FILES
+
+    data_dir = Path(data_dir)
+    counts = {"system": 0, "conversations": 0, "cold": 0, "skipped": []}
+    target = system_dir(data_dir)
+    target.mkdir(parents=True, exist_ok=True)
+    for name in SYSTEM_NAMES:
+        if not (data_dir / name).exists():
+            continue
+        if (target / name).exists():
+            counts["skipped"].append(name)
+            continue
+        suffixes = ("", "-wal", "-shm") if name.endswith(".db") else ("",)
+        for suffix in suffixes:
+            src = data_dir / f"{name}{suffix}"
+            if src.exists():
+                os.replace(src, target / src.name)
+        counts["system"] += 1
+
+    store = ConversationLogStore(data_dir, system_files=SYSTEM_FILES)
+    for conversation_id in store.conversation_ids():
+        if store.migrate_flat(conversation_id) or await store.migrate_legacy(conversation_id):
+            counts["conversations"] += 1
+        cold = store.cold_path(conversation_id)
+        if cold is not None and cold.parent == store.cold_dir:
+            dest = store.cold_dir / shard(conversation_id) / cold.name
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(cold, dest)
+            counts["cold"] += 1
+    return counts
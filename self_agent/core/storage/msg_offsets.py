@@ -0,0 +1,159 @@
+# 会话消息偏移索引
+# 每个会话日志 {id}.jsonl 旁有一个 {id}.idx（小端 uint64）：
+#   头部 24 字节：最新 meta 记录的字节偏移、索引已覆盖的日志字节数、消息条数
+#   之后每条 msg 记录的起始偏移各占 8 字节
+# 分页时只读出索引中对应的几项偏移，再按字节范围读取日志，代价与页大小成正比，与会话总长度无关。
+# 日志比索引覆盖的更长（索引懒更新、写索引前中断）时只补扫新增的尾部；日志变短或索引缺失时整体重建。
+# 指定锁目录时每段锁同时是跨进程文件锁：多个进程补扫、重写同一索引，或一个进程压缩日志时另一个进程分页读取，都不会交错。
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from core.storage.codec import loads_json
+from core.storage.filelock import FileLock, stripe
+
+HEADER = struct.Struct("<QQQ")
+OFFSET = struct.Struct("<Q")
+NO_META = 2 ** 64 - 1
+
+
+def _record_type(line: bytes) -> Optional[str]:
+    try:
+        return loads_json(line).get("type")
+    except ValueError:
+        # 中断留下的半行
+        return None
+
+
+def _parse(line: bytes) -> Optional[dict]:
+    try:
+        return loads_json(line)
+    except ValueError:
+        return None
+
+
+class MessageOffsets:
+    def __init__(self, stripes: int = 64, lock_dir: Optional[Path] = None):
+        # 按文件名分段加锁：同一会话的索引维护与读取串行，不同会话基本互不影响
+        self.stripes = stripes
+        if lock_dir is None:
+            self._locks = [threading.Lock() for _ in range(stripes)]
+        else:
+            self._locks = [FileLock(Path(lock_dir) / f"offsets-{i:03d}.lock") for i in range(stripes)]
+
+    def lock_for(self, log_path: Path):
+        return self._locks[stripe(log_path.name, self.stripes)]
+
+    @staticmethod
+    def idx_path(log_path: Path) -> Path:
+        return log_path.with_suffix(".idx")
+
+    # ---------- 维护 ----------
+    def write(self, log_path: Path, meta_offset: int, offsets: List[int], covered: int):
+        """写入完整索引（调用方需持有 lock_for(log_path)）"""
+        idx = self.idx_path(log_path)
+        tmp = idx.with_name(f"{idx.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(meta_offset, covered, len(offsets)))
+            f.write(b"".join(OFFSET.pack(o) for o in offsets))
+        os.replace(tmp, idx)
+
+    def remove(self, log_path: Path):
+        with self.lock_for(log_path):
+            try:
+                self.idx_path(log_path).unlink()
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _scan(log_path: Path, start: int, meta_offset: int) -> Tuple[List[int], int, int]:
+        """从 start 扫描日志，返回 (msg 偏移列表, 最新 meta 偏移, 扫描截止位置)"""
+        offsets = []
+        pos = start
+        with open(log_path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 末尾尚未写完的行，留待下次补扫
+                    break
+                record_type = _record_type(line)
+                if record_type == "msg":
+                    offsets.append(pos)
+                elif record_type == "meta":
+                    meta_offset = pos
+                pos += len(line)
+        return offsets, meta_offset, pos
+
+    def _ensure(self, log_path: Path) -> Optional[Tuple[int, int, int]]:
+        """保证索引覆盖整个日志，返回 (meta 偏移, 覆盖字节数, 消息条数)；日志不存在返回 None"""
+        try:
+            size = log_path.stat().st_size
+        except FileNotFoundError:
+            return None
+        idx = self.idx_path(log_path)
+        header = None
+        if idx.exists():
+            with open(idx, "rb") as f:
+                raw = f.read(HEADER.size)
+            if len(raw) == HEADER.size:
+                header = HEADER.unpack(raw)
+        if header is None or header[1] > size:
+            offsets, meta_offset, covered = self._scan(log_path, 0, NO_META)
+            self.write(log_path, meta_offset, offsets, covered)
+            return meta_offset, covered, len(offsets)
+        meta_offset, covered, count = header
+        if covered == size:
+            return header
+        # 只补扫新增部分：先截掉可能残留的多余偏移，再追加并更新头部
+        offsets, meta_offset, new_covered = self._scan(log_path, covered, meta_offset)
+        count += len(offsets)
+        with open(idx, "r+b") as f:
+            f.truncate(HEADER.size + (count - len(offsets)) * OFFSET.size)
+            f.seek(0, os.SEEK_END)
+            f.write(b"".join(OFFSET.pack(o) for o in offsets))
+            f.seek(0)
+            f.write(HEADER.pack(meta_offset, new_covered, count))
+        return meta_offset, new_covered, count
+
+    # ---------- 读 ----------
+    def read_page(self, log_path: Path, offset: int, limit: int, reverse: bool = False) -> Optional[Tuple[dict, List[dict], int]]:
+        """
+        返回 (元数据, 本页消息, 消息总数)，日志不存在返回 None
+        reverse=True 时 offset 从最新一条往前数，本页消息仍按时间正序排列
+        """
+        with self.lock_for(log_path):
+            state = self._ensure(log_path)
+            if state is None:
+                return None
+            meta_offset, covered, total = state
+            if reverse:
+                end = max(total - offset, 0)
+                start = max(end - limit, 0)
+            else:
+                start = min(offset, total)
+                end = min(start + limit, total)
+
+            with open(self.idx_path(log_path), "rb") as f:
+                # 多读一项作为本页字节范围的右边界
+                f.seek(HEADER.size + start * OFFSET.size)
+                n = min(end + 1, total) - start
+                offsets = [o for (o,) in OFFSET.iter_unpack(f.read(n * OFFSET.size))] if n > 0 else []
+            messages = []
+            meta = {}
+            with open(log_path, "rb") as f:
+                if start < end:
+                    lo = offsets[0]
+                    hi = offsets[end - start] if end < total else covered
+                    f.seek(lo)
+                    for line in f.read(hi - lo).splitlines():
+                        record = _parse(line)
+                        if record and record.get("type") == "msg":
+                            messages.append(record["data"])
+                if meta_offset != NO_META:
+                    f.seek(meta_offset)
+                    record = _parse(f.readline())
+                    if record:
+                        meta = record["data"]
+        return meta, messages, total
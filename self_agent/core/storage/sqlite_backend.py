@@ -0,0 +1,529 @@
+# SQLite 存储后端（WAL 模式）
+# 单文件嵌入式数据库，读写互不阻塞，写入走事务；每个线程持有独立连接，
+# 所有数据库操作通过 asyncio.to_thread 执行，不阻塞事件循环。
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from core.metrics import STORAGE_SECONDS, timed_methods
+from core.storage.base import ConflictError, ConversationRepository, FolderRepository, TagRepository, Storage
+from core.storage.codec import dumps_json, loads_json
+from core.storage.index import build_index_entry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id TEXT PRIMARY KEY,
+    name TEXT,
+    summary TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    model TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    revision INTEGER NOT NULL DEFAULT 0,
+    meta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_created_at ON conversations (created_at, conversation_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT,
+    extra TEXT,
+    PRIMARY KEY (conversation_id, seq)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS folders (
+    folder_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT,
+    is_default INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS folder_conversations (
+    folder_id TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (folder_id, conversation_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_folder_conversations_conversation ON folder_conversations (conversation_id);
+
+CREATE TABLE IF NOT EXISTS tags (
+    id TEXT PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tags_conversation ON tags (conversation_id);
+CREATE INDEX IF NOT EXISTS idx_tags_tag ON tags (tag);
+
+-- 收藏夹、标签的版本号，每个写事务加一，用于 ETag
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+MESSAGE_COLUMNS = ("role", "content", "timestamp")
+
+
+class SQLiteDatabase:
+    """按线程复用连接；写操作使用 IMMEDIATE 事务，避免读后写升级锁时死锁"""
+
+    def __init__(self, db_path: Path, schema: str = SCHEMA):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        conn = self.connect()
+        conn.executescript(schema)
+        self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn):
+        """为旧库补齐后续新增的列"""
+        columns = {r["name"] for r in conn.execute("PRAGMA table_info(conversations)")}
+        if columns and "revision" not in columns:
+            conn.execute("ALTER TABLE conversations ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def read(self, fn, *args):
+        # 显式读事务，保证多条查询看到同一快照
+        conn = self.connect()
+        conn.execute("BEGIN")
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.execute("COMMIT")
+
+    def write(self, fn, *args):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    async def aread(self, fn, *args):
+        return await asyncio.to_thread(self.read, fn, *args)
+
+    async def awrite(self, fn, *args):
+        return await asyncio.to_thread(self.write, fn, *args)
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def _message_row(conversation_id: str, seq: int, message: dict):
+    extra = {k: v for k, v in message.items() if k not in MESSAGE_COLUMNS}
+    return (
+        conversation_id,
+        seq,
+        message.get("role", ""),
+        message.get("content", ""),
+        message.get("timestamp"),
+        dumps_json(extra).decode("utf-8") if extra else None,
+    )
+
+
+def _row_message(row) -> dict:
+    message = {"role": row["role"], "content": row["content"], "timestamp": row["timestamp"]}
+    if row["extra"]:
+        message.update(loads_json(row["extra"]))
+    return message
+
+
+def _bump_version(conn, name: str):
+    conn.execute(
+        "INSERT INTO versions (name, version) VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET version = version + 1",
+        (name,),
+    )
+
+
+def _read_version(conn, name: str) -> str:
+    row = conn.execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()
+    return str(row[0] if row else 0)
+
+
+def _meta_entry(row) -> dict:
+    return {
+        "conversation_id": row["conversation_id"],
+        "name": row["name"],
+        "summary": row["summary"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "message_count": row["message_count"],
+        "model": row["model"],
+        "revision": row["revision"],
+    }
+
+
+@timed_methods(STORAGE_SECONDS, backend="sqlite", repo="conversations")
+class SQLiteConversationRepository(ConversationRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    async def exists(self, conversation_id: str) -> bool:
+        def q(conn):
+            return conn.execute(
+                "SELECT 1 FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone() is not None
+        return await self.db.aread(q)
+
+    async def load(self, conversation_id: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute(
+                "SELECT meta FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conv_obj = loads_json(row["meta"])
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+            ).fetchall()
+            conv_obj["messages"] = [_row_message(r) for r in rows]
+            return conv_obj
+        return await self.db.aread(q)
+
+    async def load_page(self, conversation_id: str, offset: int, limit: int, reverse: bool = False):
+        def q(conn):
+            row = conn.execute(
+                "SELECT meta, message_count FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            total = row["message_count"]
+            if reverse:
+                end = max(total - offset, 0)
+                start = max(end - limit, 0)
+            else:
+                start = offset
+                end = offset + limit
+            # 主键 (conversation_id, seq) 上的范围查询
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE conversation_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (conversation_id, start, end),
+            ).fetchall()
+            return loads_json(row["meta"]), [_row_message(r) for r in rows], total
+        return await self.db.aread(q)
+
+    @staticmethod
+    def _upsert_meta(conn, conversation_id: str, meta: dict, message_count: int):
+        meta = {k: v for k, v in meta.items() if k != "messages"}
+        meta["conversation_id"] = conversation_id
+        entry = build_index_entry({**meta, "message_count": message_count})
+        conn.execute(
+            """
+            INSERT INTO conversations (conversation_id, name, summary, created_at, updated_at, model, message_count, revision, meta)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                name = excluded.name, summary = excluded.summary, created_at = excluded.created_at,
+                updated_at = excluded.updated_at, model = excluded.model,
+                message_count = excluded.message_count, revision = excluded.revision, meta = excluded.meta
+            """,
+            (
+                conversation_id, entry["name"], entry["summary"], entry["created_at"],
+                entry["updated_at"], entry["model"], message_count, entry["revision"],
+                dumps_json(meta).decode("utf-8"),
+            ),
+        )
+
+    async def append(self, conversation_id: str, messages: List[dict], meta: Optional[dict] = None,
+                     expected_revision: Optional[int] = None) -> int:
+        def w(conn):
+            row = conn.execute(
+                "SELECT message_count, revision, meta FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            count = row["message_count"] if row else 0
+            revision = row["revision"] if row else 0
+            if expected_revision is not None and expected_revision != revision:
+                raise ConflictError(conversation_id, expected_revision, revision)
+            conn.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                [_message_row(conversation_id, count + i, m) for i, m in enumerate(messages)],
+            )
+            if meta is not None:
+                revision += 1
+                current = {**meta, "revision": revision}
+            else:
+                current = loads_json(row["meta"]) if row else {}
+            self._upsert_meta(conn, conversation_id, current, count + len(messages))
+            return revision
+        return await self.db.awrite(w)
+
+    async def put(self, conversation_id: str, meta: dict, messages: List[dict]):
+        def w(conn):
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            conn.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                [_message_row(conversation_id, i, m) for i, m in enumerate(messages)],
+            )
+            self._upsert_meta(conn, conversation_id, meta, len(messages))
+        await self.db.awrite(w)
+
+    async def delete(self, conversation_id: str) -> bool:
+        def w(conn):
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            return conn.execute(
+                "DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).rowcount > 0
+        return await self.db.awrite(w)
+
+    async def list_page(self, offset: int, limit: int) -> Tuple[List[dict], int]:
+        def q(conn):
+            rows = conn.execute(
+                "SELECT * FROM conversations ORDER BY created_at DESC, conversation_id DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+            total = conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+            return [_meta_entry(r) for r in rows], total
+        return await self.db.aread(q)
+
+    async def get_meta(self, conversation_id: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute(
+                "SELECT * FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            return _meta_entry(row) if row else None
+        return await self.db.aread(q)
+
+    async def iter_conversations(self):
+        ids = await self.db.aread(
+            lambda conn: [r[0] for r in conn.execute("SELECT conversation_id FROM conversations ORDER BY conversation_id")]
+        )
+        for cid in ids:
+            conv_obj = await self.load(cid)
+            if conv_obj is not None:
+                conv_obj["conversation_id"] = cid
+                yield conv_obj
+
+    async def rebuild_index(self) -> int:
+        # 列表字段与会话行同事务写入，只需校正消息计数
+        def w(conn):
+            conn.execute(
+                """
+                UPDATE conversations SET message_count = (
+                    SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.conversation_id
+                )
+                """
+            )
+            return conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+        return await self.db.awrite(w)
+
+
+@timed_methods(STORAGE_SECONDS, backend="sqlite", repo="folders")
+class SQLiteFolderRepository(FolderRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    @staticmethod
+    def _folders(conn, where: str = "", args: tuple = ()) -> List[dict]:
+        rows = conn.execute(f"SELECT * FROM folders {where} ORDER BY rowid", args).fetchall()
+        # 全部成员一次查出再按收藏夹分组，查询次数与收藏夹数无关
+        members = {}
+        for folder_id, conversation_id in conn.execute(
+            f"""
+            SELECT folder_id, conversation_id FROM folder_conversations
+            WHERE folder_id IN (SELECT folder_id FROM folders {where})
+            ORDER BY folder_id, position
+            """,
+            args,
+        ):
+            members.setdefault(folder_id, []).append(conversation_id)
+        folders = []
+        for r in rows:
+            folders.append({
+                "folder_id": r["folder_id"],
+                "name": r["name"],
+                "conversation_ids": members.get(r["folder_id"], []),
+                "created_at": r["created_at"],
+                "updated_at": r["updated_at"],
+                "is_default": bool(r["is_default"]),
+            })
+        return folders
+
+    async def list(self) -> List[dict]:
+        return await self.db.aread(self._folders)
+
+    async def get(self, folder_id: str) -> Optional[dict]:
+        folders = await self.db.aread(self._folders, "WHERE folder_id = ?", (folder_id,))
+        return folders[0] if folders else None
+
+    async def save(self, folder: dict):
+        def w(conn):
+            conn.execute(
+                """
+                INSERT INTO folders (folder_id, name, created_at, updated_at, is_default) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (folder_id) DO UPDATE SET
+                    name = excluded.name, updated_at = excluded.updated_at, is_default = excluded.is_default
+                """,
+                (folder["folder_id"], folder["name"], folder.get("created_at"), folder.get("updated_at"),
+                 int(bool(folder.get("is_default")))),
+            )
+            conn.execute("DELETE FROM folder_conversations WHERE folder_id = ?", (folder["folder_id"],))
+            conn.executemany(
+                "INSERT OR IGNORE INTO folder_conversations VALUES (?, ?, ?)",
+                [(folder["folder_id"], cid, i) for i, cid in enumerate(folder.get("conversation_ids") or [])],
+            )
+            _bump_version(conn, "folders")
+        await self.db.awrite(w)
+
+    async def delete(self, folder_id: str) -> bool:
+        def w(conn):
+            conn.execute("DELETE FROM folder_conversations WHERE folder_id = ?", (folder_id,))
+            deleted = conn.execute("DELETE FROM folders WHERE folder_id = ?", (folder_id,)).rowcount > 0
+            if deleted:
+                _bump_version(conn, "folders")
+            return deleted
+        return await self.db.awrite(w)
+
+    async def rename(self, folder_id: str, name: str, updated_at: str) -> Optional[dict]:
+        def w(conn):
+            if conn.execute("UPDATE folders SET name = ?, updated_at = ? WHERE folder_id = ?",
+                            (name, updated_at, folder_id)).rowcount == 0:
+                return None
+            _bump_version(conn, "folders")
+            return self._folders(conn, "WHERE folder_id = ?", (folder_id,))[0]
+        return await self.db.awrite(w)
+
+    async def add_conversation(self, folder_id: str, conversation_id: str, updated_at: str) -> Optional[dict]:
+        def w(conn):
+            if conn.execute("SELECT 1 FROM folders WHERE folder_id = ?", (folder_id,)).fetchone() is None:
+                return None
+            added = conn.execute(
+                """
+                INSERT OR IGNORE INTO folder_conversations
+                SELECT ?, ?, COALESCE(MAX(position), -1) + 1 FROM folder_conversations WHERE folder_id = ?
+                """,
+                (folder_id, conversation_id, folder_id),
+            ).rowcount
+            if added:
+                conn.execute("UPDATE folders SET updated_at = ? WHERE folder_id = ?", (updated_at, folder_id))
+                _bump_version(conn, "folders")
+            return self._folders(conn, "WHERE folder_id = ?", (folder_id,))[0]
+        return await self.db.awrite(w)
+
+    async def remove_conversation(self, folder_id: str, conversation_id: str, updated_at: str) -> Optional[dict]:
+        def w(conn):
+            if conn.execute("SELECT 1 FROM folders WHERE folder_id = ?", (folder_id,)).fetchone() is None:
+                return None
+            removed = conn.execute(
+                "DELETE FROM folder_conversations WHERE folder_id = ? AND conversation_id = ?",
+                (folder_id, conversation_id),
+            ).rowcount
+            if removed:
+                conn.execute("UPDATE folders SET updated_at = ? WHERE folder_id = ?", (updated_at, folder_id))
+                _bump_version(conn, "folders")
+            return self._folders(conn, "WHERE folder_id = ?", (folder_id,))[0]
+        return await self.db.awrite(w)
+
+    async def version(self) -> str:
+        return await self.db.aread(_read_version, "folders")
+
+
+@timed_methods(STORAGE_SECONDS, backend="sqlite", repo="tags")
+class SQLiteTagRepository(TagRepository):
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    async def add(self, tag: dict):
+        def w(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO tags (id, conversation_id, tag, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (tag["id"], tag["conversation_id"], tag["tag"], tag.get("created_at"), tag.get("updated_at")),
+            )
+            _bump_version(conn, "tags")
+        await self.db.awrite(w)
+
+    async def get(self, tag_id: str) -> Optional[dict]:
+        def q(conn):
+            row = conn.execute("SELECT * FROM tags WHERE id = ?", (tag_id,)).fetchone()
+            return dict(row) if row else None
+        return await self.db.aread(q)
+
+    async def update(self, tag_id: str, fields: dict) -> Optional[dict]:
+        columns = [k for k in ("conversation_id", "tag", "created_at", "updated_at") if k in fields]
+
+        def w(conn):
+            if columns and conn.execute(
+                f"UPDATE tags SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                (*[fields[c] for c in columns], tag_id),
+            ).rowcount:
+                _bump_version(conn, "tags")
+            row = conn.execute("SELECT * FROM tags WHERE id = ?", (tag_id,)).fetchone()
+            return dict(row) if row else None
+        return await self.db.awrite(w)
+
+    async def delete(self, tag_id: str) -> bool:
+        def w(conn):
+            deleted = conn.execute("DELETE FROM tags WHERE id = ?", (tag_id,)).rowcount > 0
+            if deleted:
+                _bump_version(conn, "tags")
+            return deleted
+        return await self.db.awrite(w)
+
+    async def list_by_conversation(self, conversation_id: str) -> List[dict]:
+        def q(conn):
+            rows = conn.execute(
+                "SELECT * FROM tags WHERE conversation_id = ? ORDER BY rowid", (conversation_id,)
+            ).fetchall()
+            return [dict(r) for r in rows]
+        return await self.db.aread(q)
+
+    async def list_all(self) -> List[dict]:
+        return await self.db.aread(lambda conn: [dict(r) for r in conn.execute("SELECT * FROM tags ORDER BY rowid")])
+
+    async def list_conversations(self, tag: str) -> List[str]:
+        def q(conn):
+            rows = conn.execute(
+                "SELECT conversation_id FROM tags WHERE tag = ? GROUP BY conversation_id ORDER BY MIN(rowid)", (tag,)
+            ).fetchall()
+            return [r[0] for r in rows]
+        return await self.db.aread(q)
+
+    async def counts(self) -> Dict[str, int]:
+        def q(conn):
+            rows = conn.execute("SELECT tag, COUNT(DISTINCT conversation_id) FROM tags GROUP BY tag").fetchall()
+            return {r[0]: r[1] for r in rows}
+        return await self.db.aread(q)
+
+    async def version(self) -> str:
+        return await self.db.aread(_read_version, "tags")
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, db_path: Path):
+        self.db = SQLiteDatabase(db_path)
+        super().__init__(
+            conversations=SQLiteConversationRepository(self.db),
+            folders=SQLiteFolderRepository(self.db),
+            tags=SQLiteTagRepository(self.db),
+        )
+
+    async def close(self):
+        self.db.close()
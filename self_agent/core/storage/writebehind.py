@@ -0,0 +1,62 @@
+# 延迟合并写入（write-behind）
+# 内存中的数据变更后只标记为脏并安排一次延迟写入，延迟期内的多次变更合并为一次整体写盘；
+# 写入在事件循环中异步完成，不占用请求处理时间。关闭服务时调用 flush 立即写入剩余变更。
+import asyncio
+from typing import Awaitable, Callable
+
+from core.logger import logger
+
+
+class DebouncedWriter:
+    def __init__(self, write: Callable[[], Awaitable[None]], delay: float = 0.5, name: str = ""):
+        # write 负责把当前内存快照完整写盘
+        self._write = write
+        self.delay = delay
+        self.name = name
+        self._dirty = False
+        self._task = None
+        self._loop = None
+        self._lock = None
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def schedule(self):
+        """标记有未写入的变更；延迟期内已有待执行的写入时不再重复安排"""
+        self._dirty = True
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._bind(loop)
+            self._task = loop.create_task(self._delayed())
+
+    def _bind(self, loop):
+        # asyncio.Lock 绑定事件循环，换循环（如测试中多次 asyncio.run）时重建
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+
+    async def _delayed(self):
+        await asyncio.sleep(self.delay)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        # 写入串行执行，保证后写的快照不会被先开始的写入覆盖
+        async with self._lock:
+            while self._dirty:
+                self._dirty = False
+                try:
+                    await self._write()
+                except asyncio.CancelledError:
+                    self._dirty = True
+                    raise
+                except Exception as e:
+                    self._dirty = True
+                    logger.error(f"[{self.name}] 写入失败: {e}")
+                    return
+
+    async def flush(self):
+        """立即写入所有未写入的变更（关闭服务、迁移前调用）"""
+        self._bind(asyncio.get_running_loop())
+        # 仍在等待中的延迟写入之后会发现没有脏数据而直接结束
+        await self._write_pending()
@@ -0,0 +1,149 @@
+# 运维命令行工具
+# 用法（在 self_agent 目录下）：python manage.py <command>
+import argparse
+import asyncio
+import sys
+
+
+def cmd_rebuild_index(args):
+    from core.storage import storage
+    total = asyncio.run(storage.conversations.rebuild_index())
+    print(f"索引重建完成，共 {total} 个会话")
+
+
+def cmd_rebuild_search(args):
+    from core.storage import storage
+    from modules.search import search_index
+
+    total = asyncio.run(search_index.rebuild(storage.conversations.iter_conversations()))
+    search_index.close()
+    print(f"搜索索引重建完成，共 {total} 个会话")
+
+
+def cmd_migrate_sqlite(args):
+    from core.storage import DATA_DIR, create_storage, default_sqlite_path
+    from core.storage.migrate import copy_storage
+    data_dir = args.data_dir or DATA_DIR
+    db_path = args.db or default_sqlite_path(data_dir)
+
+    async def run():
+        src = create_storage("file", data_dir=data_dir)
+        dst = create_storage("sqlite", sqlite_path=db_path)
+        try:
+            return await copy_storage(src, dst)
+        finally:
+            await src.close()
+            await dst.close()
+
+    counts = asyncio.run(run())
+    print(
+        f"已迁移到 {db_path}：会话 {counts['conversations']} 个，消息 {counts['messages']} 条，"
+        f"收藏夹 {counts['folders']} 个，标签 {counts['tags']} 个"
+    )
+
+
+def cmd_convert_format(args):
+    from core.storage import DATA_DIR
+    from core.storage.migrate import convert_format
+    data_dir = args.data_dir or DATA_DIR
+
+    counts = asyncio.run(convert_format(data_dir, args.to))
+    print(
+        f"已转换 {data_dir}：收藏夹/标签文件 {counts['documents']} 个，会话 {counts['conversations']} 个，"
+        f"数据 {counts['bytes_before']} -> {counts['bytes_after']} 字节"
+    )
+    print(f"请设置 STORAGE_FORMAT={args.to}，之后写入的收藏夹、标签沿用该格式")
+
+
+def cmd_migrate_layout(args):
+    from core.storage import DATA_DIR
+    from core.storage.migrate import migrate_layout
+    data_dir = args.data_dir or DATA_DIR
+
+    counts = asyncio.run(migrate_layout(data_dir))
+    print(
+        f"已迁移 {data_dir}：系统文件 {counts['system']} 个，会话 {counts['conversations']} 个，"
+        f"冷文件 {counts['cold']} 个"
+    )
+    if counts["skipped"]:
+        print(f"system/ 下已存在、未移动：{', '.join(counts['skipped'])}，请确认后手动处理")
+
+
+def _file_repo():
+    from core.config import settings
+    from core.storage import storage
+    if settings.STORAGE_BACKEND != "file":
+        print("冷存储仅适用于文件存储后端（STORAGE_BACKEND=file）")
+        sys.exit(1)
+    return storage.conversations
+
+
+def _mb(size: int) -> str:
+    return f"{size / 1024 / 1024:.2f} MB"
+
+
+def cmd_storage_report(args):
+    from core.config import settings
+    from core.storage.archive import storage_report
+    days = args.days if args.days is not None else settings.ARCHIVE_AFTER_DAYS
+    report = storage_report(_file_repo(), days)
+    for tier in ("hot", "cold"):
+        print(f"{tier:>8}: {report[tier]['conversations']} 个会话，{_mb(report[tier]['bytes'])}")
+    print("按最后更新时间：")
+    for name, bucket in report["age"].items():
+        print(f"{name:>8}: {bucket['conversations']} 个会话，{_mb(bucket['bytes'])}")
+    print(f"空闲 {days} 天以上、可归档：{report['archivable']['conversations']} 个会话，{_mb(report['archivable']['bytes'])}")
+
+
+def cmd_archive(args):
+    from core.config import settings
+    from core.storage.archive import archive_idle
+    days = args.days if args.days is not None else settings.ARCHIVE_AFTER_DAYS
+    compression = args.compression or settings.ARCHIVE_COMPRESSION
+    result = asyncio.run(archive_idle(_file_repo(), days, compression, dry_run=args.dry_run))
+    if args.dry_run:
+        print(f"将归档 {result['conversations']} 个会话，共 {_mb(result['bytes_before'])}")
+    else:
+        print(f"已归档 {result['conversations']} 个会话：{_mb(result['bytes_before'])} -> {_mb(result['bytes_after'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="self_agent 运维工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rebuild-index", help="从磁盘重建会话元数据索引")
+    p.set_defaults(func=cmd_rebuild_index)
+
+    p = sub.add_parser("rebuild-search", help="从存储中的全部会话重建全文搜索索引")
+    p.set_defaults(func=cmd_rebuild_search)
+
+    p = sub.add_parser("migrate-sqlite", help="将 data 目录中的会话、收藏夹、标签复制到 SQLite 数据库")
+    p.add_argument("--data-dir", help="源数据目录，默认 DATA_PATH")
+    p.add_argument("--db", help="目标数据库文件，默认 SQLITE_PATH 或 DATA_PATH/system/self_agent.db")
+    p.set_defaults(func=cmd_migrate_sqlite)
+
+    p = sub.add_parser("convert-format", help="将 data 目录原地转换为指定格式并压缩会话日志")
+    p.add_argument("--to", choices=["json", "msgpack"], required=True, help="收藏夹、标签文件的目标格式")
+    p.add_argument("--data-dir", help="数据目录，默认 DATA_PATH")
+    p.set_defaults(func=cmd_convert_format)
+
+    p = sub.add_parser("migrate-layout", help="将平铺的 data 目录迁移为分片布局，系统文件移入 data/system（需先停止服务）")
+    p.add_argument("--data-dir", help="数据目录，默认 DATA_PATH")
+    p.set_defaults(func=cmd_migrate_layout)
+
+    p = sub.add_parser("storage-report", help="统计热/冷存储的会话数与占用空间")
+    p.add_argument("--days", type=float, help="可归档的空闲天数，默认 ARCHIVE_AFTER_DAYS")
+    p.set_defaults(func=cmd_storage_report)
+
+    p = sub.add_parser("archive", help="压缩归档长期未更新的会话到 data/cold")
+    p.add_argument("--days", type=float, help="归档空闲多少天以上的会话，默认 ARCHIVE_AFTER_DAYS")
+    p.add_argument("--compression", choices=["gzip", "zstd"], help="压缩算法，默认 ARCHIVE_COMPRESSION")
+    p.add_argument("--dry-run", action="store_true", help="只统计，不归档")
+    p.set_defaults(func=cmd_archive)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
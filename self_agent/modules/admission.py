@@ -0,0 +1,325 @@
+# 大模型调用准入控制
+# 上游（Azure）对每个部署有 RPM/TPM 配额，突发流量全部直接打到上游会引发大量 429 与重试。
+# 每个模型一个限流器：
+#   - 并发上限：同时进行的上游调用数
+#   - 令牌桶：每分钟请求数（RPM）与每分钟 token 数（TPM，按预估 prompt token 预扣，结束后按实际用量多退少补）
+#   - 公平队列：超出限制的请求排队，优先级高（数值小）的先出队；同一优先级内按会话轮转，同一会话内先进先出
+#   - 队列已满立即拒绝，排队超时也拒绝，均返回 429 与 Retry-After
+import time
+import math
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from core.config import settings
+from core.errors import APIException
+from core.logger import logger
+from modules.context import MESSAGE_OVERHEAD, estimate_tokens
+
+# 排队等待时间分布的统计区间（秒）
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+def prompt_tokens(messages: List[dict]) -> int:
+    """预估 prompt token 数：优先用消息写入时保存的 tokens 字段，没有时按字符估算"""
+    total = 0
+    for m in messages:
+        tokens = m.get("tokens")
+        total += (tokens if tokens is not None else estimate_tokens(m.get("content", ""))) + MESSAGE_OVERHEAD
+    return total
+
+
+class AdmissionRejected(APIException):
+    def __init__(self, model: str, reason: str, retry_after: float):
+        self.model = model
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(
+            429001,
+            "模型请求过多，请稍后重试",
+            details={"model": model, "reason": reason, "retry_after": self.retry_after},
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+
+class TokenBucket:
+    """容量为每分钟额度、按秒连续补充的令牌桶；实际用量超过预扣时允许透支，由后续补充偿还"""
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.clock = clock
+        self._updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """还需等待多少秒才能扣除 cost；超过桶容量的请求在桶满时放行，避免永远排不上"""
+        self._refill()
+        cost = min(cost, self.capacity)
+        if self.level >= cost:
+            return 0.0
+        return (cost - self.level) / self.rate
+
+    def consume(self, cost: float):
+        self._refill()
+        self.level = min(self.capacity, self.level - cost)
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    conversation_id: str
+    tokens: int
+    priority: int
+    enqueued_at: float
+
+
+@dataclass
+class Ticket:
+    """一次已准入的调用；调用方结束前可填入实际 token 用量，用于修正 TPM 预扣"""
+    model: str
+    estimated_tokens: int
+    wait_seconds: float = 0.0
+    actual_tokens: Optional[int] = None
+
+
+@dataclass
+class ModelLimits:
+    max_concurrency: int = 16
+    rpm: int = 0
+    tpm: int = 0
+
+
+class ModelLimiter:
+    def __init__(self, model: str, limits: ModelLimits, max_queue: int = 100, clock=time.monotonic):
+        self.model = model
+        self.max_concurrency = max(limits.max_concurrency, 1)
+        self.max_queue = max_queue
+        self.clock = clock
+        # 0 表示不限制
+        self.rpm = TokenBucket(limits.rpm, clock) if limits.rpm > 0 else None
+        self.tpm = TokenBucket(limits.tpm, clock) if limits.tpm > 0 else None
+        self.in_flight = 0
+        self.queued = 0
+        # 优先级 -> 会话ID -> 等待队列
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._timer = None
+        # 单次调用耗时的指数滑动平均，用于估算 Retry-After
+        self._avg_latency = 1.0
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    # ---------- 预算 ----------
+    def _budget_wait(self, tokens: int) -> float:
+        wait = 0.0
+        if self.rpm is not None:
+            wait = max(wait, self.rpm.wait_time(1))
+        if self.tpm is not None:
+            wait = max(wait, self.tpm.wait_time(tokens))
+        return wait
+
+    def retry_after(self) -> float:
+        """按当前队列长度粗略估算多久之后可能有空位"""
+        rounds = (self.queued + 1) / self.max_concurrency
+        budget = 0.0
+        head = self._head()
+        if head is not None:
+            budget = self._budget_wait(head[2].tokens)
+        return max(rounds * self._avg_latency, budget, 1.0)
+
+    # ---------- 队列 ----------
+    def _head(self):
+        """下一个应出队的等待者：(会话队列表, 会话ID, 等待者)"""
+        for priority in sorted(self._queues):
+            ring = self._queues[priority]
+            if ring:
+                conversation_id, waiters = next(iter(ring.items()))
+                return ring, conversation_id, waiters[0]
+        return None
+
+    def _pop(self, ring, conversation_id):
+        waiters = ring[conversation_id]
+        waiters.popleft()
+        self.queued -= 1
+        # 出队后该会话移到队尾，其他会话先轮到
+        if waiters:
+            ring.move_to_end(conversation_id)
+        else:
+            del ring[conversation_id]
+
+    def _discard(self, waiter: _Waiter):
+        ring = self._queues.get(waiter.priority) or {}
+        waiters = ring.get(waiter.conversation_id)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        self.queued -= 1
+        if not waiters:
+            del ring[waiter.conversation_id]
+
+    def _admit(self, tokens: int, enqueued_at: float) -> float:
+        if self.rpm is not None:
+            self.rpm.consume(1)
+        if self.tpm is not None:
+            self.tpm.consume(tokens)
+        self.in_flight += 1
+        wait = self.clock() - enqueued_at
+        self.stats["admitted"] += 1
+        self.stats["wait_seconds_total"] += wait
+        self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], wait)
+        self.wait_buckets[next((i for i, b in enumerate(WAIT_BUCKETS) if wait <= b), len(WAIT_BUCKETS))] += 1
+        return wait
+
+    def _dispatch(self):
+        """在并发与预算允许的范围内依次放行队首；预算不足时定时重试"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.queued and self.in_flight < self.max_concurrency:
+            ring, conversation_id, waiter = self._head()
+            if waiter.future.done():
+                # 已超时或被取消
+                self._pop(ring, conversation_id)
+                continue
+            wait = self._budget_wait(waiter.tokens)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            self._pop(ring, conversation_id)
+            waiter.future.set_result(self._admit(waiter.tokens, waiter.enqueued_at))
+
+    # ---------- 对外接口 ----------
+    def check(self):
+        """队列已满时立即拒绝（流式接口在开始推送前调用）"""
+        if self.queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise AdmissionRejected(self.model, "queue_full", self.retry_after())
+
+    async def acquire(self, tokens: int = 0, conversation_id: Optional[str] = None,
+                      priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> float:
+        """等待准入，返回排队时间（秒）；队列已满或等待超时抛出 AdmissionRejected"""
+        now = self.clock()
+        if not self.queued and self.in_flight < self.max_concurrency and self._budget_wait(tokens) == 0:
+            return self._admit(tokens, now)
+        self.check()
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), conversation_id or "", tokens, priority, now)
+        ring = self._queues.setdefault(priority, OrderedDict())
+        ring.setdefault(waiter.conversation_id, deque()).append(waiter)
+        self.queued += 1
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self.stats["timeouts"] += 1
+            self.stats["rejected"] += 1
+            self._dispatch()
+            raise AdmissionRejected(self.model, "queue_timeout", self.retry_after()) from None
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 刚被放行就取消了，归还名额
+                self.release(tokens, 0, 0.0)
+            else:
+                self._discard(waiter)
+                self._dispatch()
+            raise
+
+    def release(self, estimated_tokens: int, actual_tokens: Optional[int], elapsed: float):
+        self.in_flight -= 1
+        if self.tpm is not None and actual_tokens is not None:
+            self.tpm.consume(actual_tokens - estimated_tokens)
+        if elapsed > 0:
+            self._avg_latency = 0.8 * self._avg_latency + 0.2 * elapsed
+        self._dispatch()
+
+    def snapshot(self) -> dict:
+        admitted = self.stats["admitted"]
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "wait_seconds_avg": round(self.stats["wait_seconds_total"] / admitted, 4) if admitted else 0.0,
+            "rpm_available": round(self.rpm.level, 2) if self.rpm is not None else None,
+            "tpm_available": round(self.tpm.level, 2) if self.tpm is not None else None,
+            "wait_buckets": dict(zip([str(b) for b in WAIT_BUCKETS] + ["+Inf"], self.wait_buckets)),
+        }
+
+
+class AdmissionController:
+    def __init__(self, limits: Optional[Dict[str, ModelLimits]] = None, default: Optional[ModelLimits] = None,
+                 max_queue: int = 100, queue_timeout: Optional[float] = 30.0, clock=time.monotonic):
+        self.limits = limits or {}
+        self.default = default or ModelLimits()
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def limiter(self, model: str) -> ModelLimiter:
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = ModelLimiter(model, self.limits.get(model, self.default), self.max_queue, self.clock)
+            self._limiters[model] = limiter
+        return limiter
+
+    def check(self, model: str):
+        self.limiter(model).check()
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int = 0, conversation_id: Optional[str] = None,
+                   priority: int = PRIORITY_INTERACTIVE):
+        """占用一个上游调用名额，退出时归还"""
+        limiter = self.limiter(model)
+        wait = await limiter.acquire(tokens, conversation_id, priority, self.queue_timeout)
+        if wait > 1:
+            logger.info(f"[会话ID:{conversation_id}] 模型 {model} 排队 {wait:.2f} 秒")
+        ticket = Ticket(model=model, estimated_tokens=tokens, wait_seconds=wait)
+        start = self.clock()
+        try:
+            yield ticket
+        finally:
+            limiter.release(tokens, ticket.actual_tokens, self.clock() - start)
+
+    def snapshot(self) -> dict:
+        return {model: limiter.snapshot() for model, limiter in self._limiters.items()}
+
+
+def _model_limits(model: Optional[str]) -> ModelLimits:
+    def pick(per_model: Dict[str, int], default: int) -> int:
+        return per_model.get(model, default) if model is not None else default
+    return ModelLimits(
+        max_concurrency=pick(settings.LLM_MAX_CONCURRENCY, settings.LLM_DEFAULT_MAX_CONCURRENCY),
+        rpm=pick(settings.LLM_RPM_LIMITS, settings.LLM_DEFAULT_RPM),
+        tpm=pick(settings.LLM_TPM_LIMITS, settings.LLM_DEFAULT_TPM),
+    )
+
+
+def create_admission_controller() -> Optional[AdmissionController]:
+    """按配置创建准入控制，未开启时返回 None"""
+    if not settings.LLM_ADMISSION_ENABLED:
+        return None
+    models = set(settings.LLM_MAX_CONCURRENCY) | set(settings.LLM_RPM_LIMITS) | set(settings.LLM_TPM_LIMITS)
+    return AdmissionController(
+        limits={m: _model_limits(m) for m in models},
+        default=_model_limits(None),
+        max_queue=settings.LLM_QUEUE_SIZE,
+        queue_timeout=settings.LLM_QUEUE_TIMEOUT or None,
+    )
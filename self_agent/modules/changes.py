@@ -0,0 +1,135 @@
+# 变更流：会话、收藏夹、标签的增量同步
+# 每次创建、修改、删除写入一条变更记录，序号 seq 全局单调递增（AUTOINCREMENT，删除后也不会复用）。
+# 同一对象只保留最新一条：写入新记录时删除旧记录，变更流的大小与对象总数成正比。
+# 客户端保存上次返回的 cursor，下次只取其后的变更，同步代价与变更数成正比；cursor=0 即全量同步。
+# 记录中带对象的当前数据（会话为列表元数据，收藏夹、标签为完整对象），删除记录不带数据。
+# 会话内的消息按序号（seq，即消息在会话中的位置）增量读取，见 GET /api/v1/conversations/{id}/messages。
+# 变更流为独立的 SQLite 数据库（data/system/changes.db），与存储后端无关。
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, Query
+
+from core.config import settings
+from core.logger import logger
+from core.storage import DATA_DIR
+from core.storage.codec import dumps_json, loads_json
+from core.storage.index import build_index_entry
+from core.storage.layout import system_path
+from core.storage.sqlite_backend import SQLiteDatabase
+
+router = APIRouter()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    object_id TEXT NOT NULL,
+    action TEXT NOT NULL,
+    data TEXT,
+    at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_changes_object ON changes (kind, object_id);
+"""
+
+CREATED, UPDATED, DELETED = "created", "updated", "deleted"
+
+
+def now_iso():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+class ChangeFeed:
+    def __init__(self, db_path: Path, enabled: bool = True):
+        self.db_path = Path(db_path)
+        self.enabled = enabled
+        self._db = None
+
+    @property
+    def db(self) -> SQLiteDatabase:
+        # 首次使用时才创建数据库文件
+        if self._db is None:
+            self._db = SQLiteDatabase(self.db_path, schema=SCHEMA)
+        return self._db
+
+    # ---------- 写 ----------
+    async def record(self, kind: str, object_id: str, action: str, data: Optional[dict] = None):
+        """记录一次变更；失败只记日志，不影响调用方"""
+        if not self.enabled:
+            return
+        def w(conn):
+            conn.execute("DELETE FROM changes WHERE kind = ? AND object_id = ?", (kind, object_id))
+            conn.execute(
+                "INSERT INTO changes (kind, object_id, action, data, at) VALUES (?, ?, ?, ?, ?)",
+                (kind, object_id, action, dumps_json(data).decode("utf-8") if data is not None else None, now_iso()),
+            )
+        try:
+            await self.db.awrite(w)
+        except Exception as e:
+            logger.error(f"记录变更失败 {kind}/{object_id}: {e}")
+
+    async def conversation_changed(self, conversation_id: str, conv_obj: dict, action: str = UPDATED):
+        """会话创建或修改：记录列表元数据（名称、摘要、时间、消息数、修订号）"""
+        obj = {**conv_obj, "conversation_id": conversation_id}
+        if "messages" in conv_obj:
+            obj["message_count"] = len(conv_obj["messages"])
+        await self.record("conversation", conversation_id, action, build_index_entry(obj))
+
+    async def conversation_deleted(self, conversation_id: str):
+        await self.record("conversation", conversation_id, DELETED)
+
+    # ---------- 读 ----------
+    async def since(self, cursor: int, limit: int = 500) -> Tuple[List[dict], int, bool, bool]:
+        """
+        返回 cursor 之后的变更 (变更列表, 新 cursor, 是否还有更多, 是否需要重置)
+        cursor 大于已分配过的最大序号（变更库被删除重建）时视为 0 重新全量同步，并返回重置标记
+        """
+        def q(conn):
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+            latest = row[0] if row else 0
+            reset = cursor > latest
+            start = 0 if reset else cursor
+            rows = conn.execute(
+                "SELECT * FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (start, limit + 1)
+            ).fetchall()
+            return rows, start, reset
+        rows, start, reset = await self.db.aread(q)
+        changes = [
+            {
+                "seq": r["seq"],
+                "type": r["kind"],
+                "id": r["object_id"],
+                "action": r["action"],
+                "data": loads_json(r["data"]) if r["data"] is not None else None,
+                "at": r["at"],
+            }
+            for r in rows[:limit]
+        ]
+        next_cursor = changes[-1]["seq"] if changes else start
+        return changes, next_cursor, len(rows) > limit, reset
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def default_changes_path() -> Path:
+    return Path(settings.CHANGES_PATH) if settings.CHANGES_PATH else system_path(DATA_DIR, "changes.db")
+
+
+change_feed = ChangeFeed(default_changes_path(), enabled=settings.CHANGES_ENABLED)
+
+
+@router.get("/", summary="增量同步：获取游标之后的会话、收藏夹、标签变更")
+async def list_changes(
+    cursor: int = Query(0, ge=0, description="上次返回的 cursor，0 表示全量同步"),
+    limit: int = Query(500, ge=1, le=1000),
+):
+    if not change_feed.enabled:
+        return {"data": {"error": "变更流未开启"}}
+    changes, next_cursor, has_more, reset = await change_feed.since(cursor, limit)
+    return {
+        "data": {"changes": changes, "cursor": next_cursor, "has_more": has_more, "reset": reset}
+    }
@@ -0,0 +1,155 @@
+# 上下文构建：在 send_message 与 LLMEngine.chat 之间按 token 预算挑选历史消息
+# 规则：system 消息、置顶消息与本轮用户输入必选，其余从最近往前补齐直至预算用完。
+# 会话带滚动摘要（rolling_summary）时，水位线之前的普通消息由一条摘要消息代替，只从水位线之后补齐。
+# 每条消息的 token 数在写入时计算并随消息保存（tokens 字段），之后每轮不再重复分词。
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from core.config import settings
+from core.logger import logger
+
+# 每条消息在对话格式中的额外开销（role、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PREFIX = "以下是此前对话的摘要：\n"
+
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+
+_encoder = None
+_encoder_failed = False
+
+# 未带 tokens 字段的旧消息在进程内缓存计数，键为 (会话ID, 序号, 时间戳)
+_legacy_counts: "OrderedDict[tuple, int]" = OrderedDict()
+LEGACY_CACHE_SIZE = 100000
+
+
+def _get_encoder():
+    """tiktoken 编码器只尝试加载一次（离线环境下加载失败则改用估算）"""
+    global _encoder, _encoder_failed
+    if _encoder is None and not _encoder_failed:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(settings.TOKENIZER_ENCODING)
+        except Exception as e:
+            _encoder_failed = True
+            logger.warning(f"tiktoken 编码器不可用，改用字符数估算 token: {e}")
+    return _encoder
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算：中日韩字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def message_tokens(message: dict, conversation_id: str = "", position: int = -1) -> int:
+    tokens = message.get("tokens")
+    if tokens is None:
+        key = (conversation_id, position, message.get("timestamp"))
+        tokens = _legacy_counts.get(key)
+        if tokens is None:
+            tokens = count_tokens(message.get("content", ""))
+            _legacy_counts[key] = tokens
+            if len(_legacy_counts) > LEGACY_CACHE_SIZE:
+                _legacy_counts.popitem(last=False)
+    return tokens + MESSAGE_OVERHEAD
+
+
+def token_budget(model: Optional[str]) -> int:
+    return settings.CONTEXT_TOKEN_BUDGETS.get(model or "", settings.CONTEXT_DEFAULT_TOKEN_BUDGET)
+
+
+@dataclass
+class ContextPack:
+    messages: List[dict] = field(default_factory=list)
+    tokens: int = 0
+    budget: int = 0
+    total_messages: int = 0
+    # 由摘要代替的历史消息条数（摘要水位线）
+    summarized: int = 0
+
+    @property
+    def dropped(self) -> int:
+        # 摘要消息本身不算历史消息
+        return self.total_messages - len(self.messages) + (1 if self.summarized else 0)
+
+    def meta(self) -> dict:
+        meta = {
+            "tokens": self.tokens,
+            "messages": len(self.messages),
+            "dropped": self.dropped,
+            "budget": self.budget,
+        }
+        if self.summarized:
+            meta["summarized"] = self.summarized
+        return meta
+
+
+def summary_message(summary: Optional[dict]) -> Optional[dict]:
+    """滚动摘要 -> 发送给模型的 system 消息；tokens 为生成摘要时记录的计数"""
+    if not summary or not summary.get("text"):
+        return None
+    content = SUMMARY_PREFIX + summary["text"]
+    tokens = summary.get("tokens")
+    return {"role": "system", "content": content, "tokens": tokens if tokens is not None else count_tokens(content)}
+
+
+def build_context(messages: List[dict], model: Optional[str] = None, conversation_id: str = "",
+                  pinned: Optional[List[int]] = None, budget: Optional[int] = None,
+                  summary: Optional[dict] = None) -> ContextPack:
+    """
+    messages 为完整历史（最后一条为本轮用户输入），pinned 为置顶消息的序号
+    summary 为会话的滚动摘要 {"text", "upto", "tokens"}，upto 之前的消息由摘要代替
+    返回按原顺序排列的待发送消息及其 token 统计
+    """
+    budget = budget if budget is not None else token_budget(model)
+    pinned = set(pinned or ())
+    n = len(messages)
+    counts = [message_tokens(m, conversation_id, i) for i, m in enumerate(messages)]
+
+    # 水位线必须落在本轮输入之前，否则摘要与当前历史对不上，忽略摘要
+    summary_msg = summary_message(summary)
+    upto = summary.get("upto", 0) if summary_msg else 0
+    if not 0 < upto < n:
+        summary_msg, upto = None, 0
+
+    # 必选：system、置顶、本轮输入、摘要
+    selected = {i for i, m in enumerate(messages) if m.get("role") == "system" or m.get("pinned") or i in pinned}
+    if n:
+        selected.add(n - 1)
+    used = sum(counts[i] for i in selected)
+    if summary_msg:
+        used += summary_msg["tokens"] + MESSAGE_OVERHEAD
+
+    # 从最近往前补齐（不越过摘要水位线），遇到放不下的即停止，保证选中的历史是连续的一段
+    for i in range(n - 2, upto - 1, -1):
+        if i in selected:
+            continue
+        if used + counts[i] > budget:
+            break
+        selected.add(i)
+        used += counts[i]
+
+    order = sorted(selected)
+    chosen = [messages[i] for i in order if i < upto]
+    if summary_msg:
+        chosen.append(summary_msg)
+    chosen.extend(messages[i] for i in order if i >= upto)
+    return ContextPack(
+        messages=chosen,
+        tokens=used,
+        budget=budget,
+        total_messages=n,
+        summarized=upto,
+    )
@@ -1,18 +1,34 @@
 # 会话管理路由
 import os
 import json
+import asyncio
 from pathlib import Path
-from fastapi import APIRouter, Depends, Query, Path as FPath, Body
+from contextlib import aclosing
+import anyio
+from fastapi import APIRouter, Depends, Query, Path as FPath, Body, Request, Response
+from fastapi.responses import StreamingResponse
 from core.auth import jwt_auth
 from modules.llm import llm_engine
-from core.logger import logger
-import aiofiles
+from modules.context import build_context, count_tokens
+from modules.search import search_index
+from modules.changes import CREATED, UPDATED, change_feed
+from modules.summarizer import summarizer
+from modules.pipeline import TurnPipeline
+from core.logger import logger, brief, SAMPLED
+from core.config import settings
+from core.etag import check_etag
+from core.storage import DATA_DIR, storage
+from core.storage.layout import system_path
+from core.storage.base import ConflictError
+from core.storage.locks import conversation_locks
 from typing import List, Optional
 from datetime import datetime
 import uuid
 
 router = APIRouter()
 
+CONFLICT_ERROR = "会话已被其他请求修改，请重试"
+
 # Pydantic 数据结构定义
 from pydantic import BaseModel, Field
 
@@ -23,6 +39,7 @@ class Message(BaseModel):
     role: str
     content: str
     timestamp: str = Field(default_factory=now_iso)
+    tokens: Optional[int] = None  # 写入时计算的 token 数，构建上下文时直接使用
 
 class ConversationConfig(BaseModel):
     model: str = "gpt-4.1"
@@ -67,14 +84,15 @@ def build_conversation_obj(conversation_id: str, messages: Optional[List[dict]]
     ).dict()
 
 def build_message(role: str, content: str, timestamp: Optional[str] = None):
-    return Message(role=role, content=content, timestamp=timestamp or now_iso()).dict()
-
-# 路径与数据目录
-DATA_DIR = Path(__file__).parent.parent / "data"
-DATA_DIR.mkdir(exist_ok=True)
+    return Message(role=role, content=content, timestamp=timestamp or now_iso(), tokens=count_tokens(content)).dict()
 
-def get_conversation_path(conversation_id: str) -> Path:
-    return DATA_DIR / f"{conversation_id}.json"
+async def load_conversation(conversation_id: str) -> Optional[dict]:
+    """读取完整会话对象，读取失败按空会话处理"""
+    try:
+        return await storage.conversations.load(conversation_id)
+    except Exception as e:
+        logger.error(f"[会话ID:{conversation_id}] 读取历史消息失败: {e}")
+        return None
 
 
 @router.get("/", summary="会话列表")
@@ -83,92 +101,135 @@ async def list_conversations(
     size: int = Query(20, ge=1, le=100),
     # user=Depends(jwt_auth)
 ):
-    # 遍历 /data 目录，获取所有会话 id 及 created_at
-    # 过滤收藏夹和tags.json
-    exclude_files = {"folders", "tags"}
-    all_files = [p for p in DATA_DIR.glob("*.json") if p.stem not in exclude_files]
-    conversations = []
-    for p in all_files:
-        try:
-            async with aiofiles.open(p, "r", encoding="utf-8") as f:
-                content = await f.read()
-                obj = json.loads(content)
-                created_at = obj.get("created_at")
-                # 若无 created_at 字段，取文件创建时间
-                if not created_at:
-                    created_at = datetime.utcfromtimestamp(p.stat().st_ctime).isoformat() + "Z"
-                conversations.append({"id": p.stem, "created_at": created_at})
-        except Exception as e:
-            logger.error(f"[会话ID:{p.stem}] 读取 created_at 失败: {e}")
-            conversations.append({"id": p.stem, "created_at": "1970-01-01T00:00:00Z"})
-    # 按 created_at 降序排序
-    conversations.sort(key=lambda x: x["created_at"], reverse=True)
-    total = len(conversations)
+    # 由存储层的元数据索引按 created_at 降序分页，不读取会话内容
     start = (page - 1) * size
-    end = start + size
-    conversation_ids = [c["id"] for c in conversations[start:end]]
+    # 首次保存仍在后台队列中的新会话尚未进入索引：创建时间即当前时间，排在列表最前，不等待队列
+    # （旧数据没有修订号，已在索引中的会话不重复列出）
+    unsaved = [c["conversation_id"] for c in turn_pipeline.unsaved()
+               if await storage.conversations.get_meta(c["conversation_id"]) is None]
+    head = unsaved[start:start + size]
+    entries, total = await storage.conversations.list_page(max(start - len(unsaved), 0), size - len(head))
+    conversation_ids = head + [c["conversation_id"] for c in entries]
+    total += len(unsaved)
     return {
         "data": conversation_ids,
         "meta": {"page": page, "size": size, "total": total}
     }
 
+async def check_conversation_etag(request: Request, response: Response, conversation_id: str,
+                                  pending: Optional[dict], *params) -> Optional[Response]:
+    """
+    会话的 ETag 取创建时间、修订号、消息数与更新时间（覆盖层中的会话按保存后的预估修订号，落盘前后 ETag 不变）
+    以及分页参数；会话不存在时不设置 ETag
+    """
+    if pending is not None:
+        version = {**pending, "message_count": len(pending["messages"])}
+    else:
+        version = await storage.conversations.get_meta(conversation_id)
+    if version is None:
+        return None
+    return check_etag(request, response, conversation_id, version.get("created_at"), version.get("revision"),
+                      version.get("message_count"), version.get("updated_at"), *params)
+
 @router.get("/{conversation_id}", summary="获取会话历史")
 async def get_conversation(
     conversation_id: str,
+    request: Request,
+    response: Response,
     page: int = Query(1, ge=1),
     size: int = Query(100, ge=1, le=500),
+    reverse: bool = Query(False, description="为 true 时从最新消息往前分页（page=1 即最后 size 条），本页仍按时间正序"),
     # user=Depends(jwt_auth)
 ):
-    conv_path = get_conversation_path(conversation_id)
-    if not conv_path.exists():
-        return {
-            "data": build_conversation_obj(conversation_id, messages=[])
-        }
+    # 存储层只读取本页消息，不解析整个会话；有尚在后台保存的轮次时从覆盖层分页
     try:
-        async with aiofiles.open(conv_path, "r", encoding="utf-8") as f:
-            content = await f.read()
-            conv_obj = json.loads(content)
+        pending = turn_pipeline.view(conversation_id)
+        # 先按元数据（修订号、消息数）校验客户端缓存，未变化时不读取消息
+        not_modified = await check_conversation_etag(request, response, conversation_id, pending, page, size, reverse)
+        if not_modified is not None:
+            return not_modified
+        if pending is not None:
+            result = page_messages(pending, (page - 1) * size, size, reverse)
+        else:
+            result = await storage.conversations.load_page(conversation_id, (page - 1) * size, size, reverse)
     except Exception as e:
         logger.error(f"[会话ID:{conversation_id}] 读取历史消息失败: {e}")
-        conv_obj = build_conversation_obj(conversation_id, messages=[])
-    # 分页
-    messages = conv_obj.get("messages", [])
-    total = len(messages)
-    start = (page - 1) * size
-    end = start + size
-    paged_messages = messages[start:end]
-    conv_obj["messages"] = paged_messages
-    conv_obj["meta"] = {"page": page, "size": size, "total": total}
+        result = None
+    if result is None:
+        # 读取失败或会话不存在：不让客户端按 ETag 缓存空结果
+        if "etag" in response.headers:
+            del response.headers["etag"]
+        return {
+            "data": build_conversation_obj(conversation_id, messages=[])
+        }
+    meta, paged_messages, total = result
+    offset = (page - 1) * size
+    first = max(total - offset, 0) - len(paged_messages) if reverse else min(offset, total)
+    conv_obj = dict(meta)
+    conv_obj["messages"] = number_messages(paged_messages, first)
+    conv_obj["meta"] = {"page": page, "size": size, "total": total, "reverse": reverse}
     return {
         "data": conv_obj
     }
 
-
-
-@router.post("/{conversation_id}/messages", summary="发送消息")
-async def send_message(
+@router.get("/{conversation_id}/messages", summary="增量获取消息（cursor 之后的新消息）")
+async def get_messages_since(
     conversation_id: str,
-    body: dict = Body(...),
+    cursor: int = Query(0, ge=0, description="客户端已有的消息数，即上次返回的 cursor；只返回序号不小于它的消息"),
+    limit: int = Query(100, ge=1, le=500),
     # user=Depends(jwt_auth)
 ):
-    user_input = body.get("content", "")
-    model = body.get("model")
-    logger.info(f"[会话ID:{conversation_id}] 用户输入: {user_input}, 模型: {model}")
+    # 与 get_conversation 相同：存储层按偏移索引只读取所需消息，有尚在后台保存的轮次时从覆盖层读取
+    pending = turn_pipeline.view(conversation_id)
+    if pending is not None:
+        result = page_messages(pending, cursor, limit)
+    else:
+        result = await storage.conversations.load_page(conversation_id, cursor, limit)
+    if result is None:
+        return {"data": {"error": "会话不存在"}}
+    meta, messages, total = result
+    start = min(cursor, total)
+    return {
+        "data": {
+            "messages": number_messages(messages, start),
+            "cursor": start + len(messages),
+            "total": total,
+            "has_more": start + len(messages) < total,
+            "meta": meta,
+        }
+    }
 
-    # 读取历史会话对象
-    conv_path = get_conversation_path(conversation_id)
-    if conv_path.exists():
-        try:
-            async with aiofiles.open(conv_path, "r", encoding="utf-8") as f:
-                content = await f.read()
-                conv_obj = json.loads(content)
-        except Exception as e:
-            logger.error(f"[会话ID:{conversation_id}] 读取历史消息失败: {e}")
-            conv_obj = build_conversation_obj(conversation_id, messages=[])
+def number_messages(messages: List[dict], first: int) -> List[dict]:
+    """为消息加上会话内序号 seq（从 0 开始，与置顶、搜索结果中的 index 相同；消息只追加，序号不会改变）"""
+    return [{**m, "seq": first + i} for i, m in enumerate(messages)]
+
+def parse_cursor(value) -> Optional[int]:
+    return value if isinstance(value, int) and not isinstance(value, bool) and value >= 0 else None
+
+
+
+def page_messages(conv_obj: dict, offset: int, limit: int, reverse: bool = False):
+    """在内存中的完整会话上分页，返回值与 load_page 相同：(元数据, 本页消息, 消息总数)"""
+    messages = conv_obj.get("messages") or []
+    total = len(messages)
+    if reverse:
+        end = max(total - offset, 0)
+        start = max(end - limit, 0)
     else:
+        start = min(offset, total)
+        end = min(start + limit, total)
+    meta = {k: v for k, v in conv_obj.items() if k != "messages"}
+    return meta, messages[start:end], total
+
+async def prepare_turn(conversation_id: str, user_input: str, model: Optional[str] = None):
+    """读取会话并追加本次用户输入，返回 (会话对象, 用户消息, 本次使用的模型)"""
+    # 读取历史会话对象：上一轮尚在后台保存时从流水线覆盖层读取
+    conv_obj = turn_pipeline.view(conversation_id) or await load_conversation(conversation_id)
+    if conv_obj is None:
         conv_obj = build_conversation_obj(conversation_id, messages=[])
 
     messages = conv_obj.get("messages", [])
+    conv_obj["messages"] = messages
 
     # 处理模型参数，优先用本次传入的 model
     if model:
@@ -181,23 +242,30 @@ async def send_message(
     user_msg = build_message("user", user_input)
     messages.append(user_msg)
 
-    # 调用大模型，优先用本次模型参数
     chat_model = model or conv_obj.get("config", {}).get("model")
-    if chat_model:
-        reply = await llm_engine.chat(messages, model=chat_model)
-    else:
-        reply = await llm_engine.chat(messages)
-    logger.info(f"[会话ID:{conversation_id}] 模型输出: {reply}")
+    return conv_obj, user_msg, chat_model
+
+def pack_context(conversation_id: str, conv_obj: dict, chat_model: Optional[str]):
+    """按模型 token 预算挑选本轮发送的历史消息，已有滚动摘要时以摘要代替水位线之前的消息"""
+    return build_context(conv_obj["messages"], chat_model, conversation_id, pinned=conv_obj.get("pinned"),
+                         summary=conv_obj.get("rolling_summary"))
 
-    # 添加AI回复
-    ai_msg = build_message("assistant", reply)
-    messages.append(ai_msg)
+def finish_turn(conversation_id: str, conv_obj: dict, user_msg: dict, reply: Optional[str], **ai_fields) -> List[dict]:
+    """加入 AI 回复（reply 为 None 时不写回复）并更新会话元数据，返回本轮新增的消息"""
+    messages = conv_obj["messages"]
+    new_messages = [user_msg]
+    if reply is not None:
+        # 添加AI回复
+        ai_msg = build_message("assistant", reply)
+        ai_msg.update(ai_fields)
+        messages.append(ai_msg)
+        new_messages.append(ai_msg)
 
     # 更新会话元数据
-    conv_obj["messages"] = messages
+    conv_obj["conversation_id"] = conversation_id
     # summary 只在首次用户输入时赋值，后续保持不变
     if not conv_obj.get("summary"):
-        conv_obj["summary"] = user_input
+        conv_obj["summary"] = user_msg["content"]
     conv_obj["updated_at"] = now_iso()
     if not conv_obj.get("created_at"):
         conv_obj["created_at"] = now_iso()
@@ -205,41 +273,302 @@ async def send_message(
         # 默认取首条用户消息前10字
         first_user = next((m for m in messages if m.get("role") == "user"), None)
         conv_obj["name"] = first_user["content"][:10] if first_user and first_user.get("content") else conversation_id
+    return new_messages
 
-    # 保存到json
+async def save_turn(conversation_id: str, conv_obj: dict, new_messages: List[dict]) -> int:
+    """追加本轮消息及最新元数据（不重写历史），再更新搜索索引、调度滚动摘要；写入失败时抛出异常"""
     try:
-        async with aiofiles.open(conv_path, "w", encoding="utf-8") as f:
-            await f.write(json.dumps(conv_obj, ensure_ascii=False, indent=2))
+        revision = await storage.conversations.append(
+            conversation_id, new_messages, meta=conv_obj, expected_revision=conv_obj.get("revision", 0))
+    except ConflictError as e:
+        # 读取之后会话被其他写入者修改（如另一进程）：基于最新版本重放本轮消息，只重试一次
+        logger.warning(f"[会话ID:{conversation_id}] {e}，基于最新版本重新保存")
+        rebase_turn(conversation_id, conv_obj, await load_conversation(conversation_id), new_messages)
+        revision = await storage.conversations.append(
+            conversation_id, new_messages, meta=conv_obj, expected_revision=conv_obj.get("revision", 0))
+    conv_obj["revision"] = revision
+    # 增量更新搜索索引
+    start_seq = len(conv_obj["messages"]) - len(new_messages)
+    await search_index.index_messages(conversation_id, new_messages, start_seq, meta=conv_obj)
+    # 变更流：本轮之前没有消息即为新建的会话
+    await change_feed.conversation_changed(conversation_id, conv_obj, CREATED if start_seq == 0 else UPDATED)
+    # 历史过长时交给后台生成滚动摘要，不等待
+    summarizer.schedule(conversation_id, conv_obj)
+    return revision
+
+async def persist_turn(conversation_id: str, conv_obj: dict, user_msg: dict, reply: Optional[str], **ai_fields):
+    """在当前请求中保存本轮用户消息、AI回复（reply 为 None 时不写回复）及最新元数据"""
+    new_messages = finish_turn(conversation_id, conv_obj, user_msg, reply, **ai_fields)
+    try:
+        await save_turn(conversation_id, conv_obj, new_messages)
     except Exception as e:
         logger.error(f"[会话ID:{conversation_id}] 保存消息失败: {e}")
 
-    # 返回最近20条消息
+async def commit_turn(conversation_id: str, conv_obj: dict, user_msg: dict, reply: Optional[str], **ai_fields):
+    """结束一轮对话：开启后处理流水线时交给后台保存（立即返回），否则在当前请求中保存"""
+    if not settings.POSTPROCESS_ENABLED:
+        await persist_turn(conversation_id, conv_obj, user_msg, reply, **ai_fields)
+        return
+    new_messages = finish_turn(conversation_id, conv_obj, user_msg, reply, **ai_fields)
+    await turn_pipeline.submit(conversation_id, conv_obj, new_messages)
+    # 变更流在提交时即记录覆盖层快照（与读己之写一致），增量同步无需等待后台保存；保存完成时再记录一次最终修订号
+    snapshot = turn_pipeline.view(conversation_id) or conv_obj
+    await change_feed.conversation_changed(
+        conversation_id, snapshot, CREATED if len(conv_obj["messages"]) == len(new_messages) else UPDATED)
+
+# 回复后处理流水线：按提交顺序在后台执行 save_turn
+turn_pipeline = TurnPipeline(
+    save_turn, load_conversation,
+    journal_path=Path(settings.POSTPROCESS_JOURNAL_PATH) if settings.POSTPROCESS_JOURNAL_PATH else system_path(DATA_DIR, "pending_turns.jsonl"),
+    maxsize=settings.POSTPROCESS_QUEUE_SIZE,
+    retries=settings.POSTPROCESS_RETRIES,
+    retry_delay=settings.POSTPROCESS_RETRY_DELAY,
+    fsync=settings.POSTPROCESS_JOURNAL_FSYNC,
+)
+
+def rebase_turn(conversation_id: str, conv_obj: dict, latest: Optional[dict], new_messages: List[dict]):
+    """把本轮新增消息与本轮修改的字段叠加到最新的会话对象上（原地更新 conv_obj）"""
+    latest = latest or build_conversation_obj(conversation_id, messages=[])
+    turn_fields = {k: conv_obj[k] for k in ("config", "model", "updated_at") if k in conv_obj}
+    conv_obj.clear()
+    conv_obj.update(latest)
+    conv_obj.update(turn_fields)
+    conv_obj["conversation_id"] = conversation_id
+    conv_obj["messages"] = latest.get("messages", []) + new_messages
+    if not conv_obj.get("summary"):
+        conv_obj["summary"] = new_messages[0]["content"]
+
+def turn_result(conversation_id: str, conv_obj: dict, reply: str, context=None, cursor: Optional[int] = None) -> dict:
+    # 默认返回最近20条消息；请求带 cursor（客户端已有的消息数）时只返回其后的消息
+    messages = conv_obj["messages"]
+    first = max(len(messages) - 20, 0) if cursor is None else min(cursor, len(messages))
+    result = {
+        "reply": reply,
+        "messages": number_messages(messages[first:], first),
+        "cursor": len(messages),
+        "conversation_id": conversation_id,
+        "name": conv_obj.get("name"),
+        "summary": conv_obj.get("summary"),
+        "created_at": conv_obj.get("created_at"),
+        "updated_at": conv_obj.get("updated_at")
+    }
+    if context is not None:
+        # 本轮实际发送给模型的消息数与 token 数
+        result["context"] = context.meta()
+    return result
+
+def cache_policy(body: dict, conv_obj: dict) -> Optional[bool]:
+    """回复缓存开关：请求体 cache 优先，其次会话配置 config.cache，都未设置时按默认策略"""
+    if body.get("cache") is not None:
+        return bool(body["cache"])
+    config = conv_obj.get("config")
+    if isinstance(config, dict) and config.get("cache") is not None:
+        return bool(config["cache"])
+    return None
+
+@router.post("/{conversation_id}/messages", summary="发送消息")
+async def send_message(
+    conversation_id: str,
+    body: dict = Body(...),
+    # user=Depends(jwt_auth)
+):
+    user_input = body.get("content", "")
+    model = body.get("model")
+    logger.info(f"[会话ID:{conversation_id}] 用户输入: {brief(user_input)}, 模型: {model}", extra=SAMPLED)
     return {
-        "data": {
-            "reply": reply,
-            "messages": messages[-20:],
+        "data": await run_turn(conversation_id, user_input, model, body)
+    }
+
+async def run_turn(conversation_id: str, user_input: str, model: Optional[str], body: dict) -> dict:
+    """完成一轮非流式对话：读取会话、调用模型、保存，返回 turn_result"""
+    # 同一会话的多次发送按到达顺序排队，保证每轮都基于上一轮的结果；不同会话互不阻塞
+    async with conversation_locks.lock(conversation_id):
+        conv_obj, user_msg, chat_model = await prepare_turn(conversation_id, user_input, model)
+        context = pack_context(conversation_id, conv_obj, chat_model)
+        cache = cache_policy(body, conv_obj)
+
+        # 调用大模型，优先用本次模型参数
+        if chat_model:
+            reply = await llm_engine.chat(context.messages, model=chat_model, cache=cache, conversation_id=conversation_id)
+        else:
+            reply = await llm_engine.chat(context.messages, cache=cache, conversation_id=conversation_id)
+        logger.info(f"[会话ID:{conversation_id}] 模型输出: {brief(reply)}", extra=SAMPLED)
+
+        await commit_turn(conversation_id, conv_obj, user_msg, reply)
+    return turn_result(conversation_id, conv_obj, reply, context, parse_cursor(body.get("cursor")))
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_turn(conversation_id: str, conv_obj: dict, user_msg: dict, chat_model: Optional[str],
+                      cursor: Optional[int] = None):
+    """
+    逐 token 推送 SSE 事件，结束后保存整轮对话
+    客户端断开时生成器被取消/关闭：上游流随之关闭，已生成的部分回复仍会保存（finish_reason=cancelled）
+    """
+    parts = []
+    finish_reason = "cancelled"
+    kwargs = {"model": chat_model} if chat_model else {}
+    kwargs["conversation_id"] = conversation_id
+    context = pack_context(conversation_id, conv_obj, chat_model)
+    try:
+        async with aclosing(llm_engine.stream(context.messages, **kwargs)) as tokens:
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event("token", {"content": token})
+        finish_reason = "stop"
+    except Exception as e:
+        finish_reason = "error"
+        logger.error(f"[会话ID:{conversation_id}] 流式生成失败: {e!r}")
+        # 排队超时等 APIException 带有面向用户的 message
+        yield sse_event("error", {"message": getattr(e, "message", None) or str(e)})
+    finally:
+        # 一个 token 都没生成且未正常结束时只保存用户消息
+        reply = "".join(parts) if parts or finish_reason == "stop" else None
+        ai_fields = {} if finish_reason == "stop" else {"finish_reason": finish_reason}
+        # 连接已断开时所在作用域处于取消状态，保存操作需屏蔽取消
+        with anyio.CancelScope(shield=True):
+            await commit_turn(conversation_id, conv_obj, user_msg, reply, **ai_fields)
+        logger.info(f"[会话ID:{conversation_id}] 模型流式输出({finish_reason}): {brief(reply)}", extra=SAMPLED)
+    result = turn_result(conversation_id, conv_obj, reply or "", context, cursor)
+    result["finish_reason"] = finish_reason
+    yield sse_event("done", result)
+
+async def locked_stream_turn(conversation_id: str, user_input: str, model: Optional[str], cursor: Optional[int] = None):
+    """在会话锁内读取会话并流式生成，与 send_message 共用同一排队顺序"""
+    async with conversation_locks.lock(conversation_id):
+        conv_obj, user_msg, chat_model = await prepare_turn(conversation_id, user_input, model)
+        async with aclosing(stream_turn(conversation_id, conv_obj, user_msg, chat_model, cursor)) as events:
+            async for event in events:
+                yield event
+
+@router.post("/{conversation_id}/messages/stream", summary="发送消息（SSE 流式返回）")
+async def send_message_stream(
+    conversation_id: str,
+    body: dict = Body(...),
+    # user=Depends(jwt_auth)
+):
+    user_input = body.get("content", "")
+    model = body.get("model")
+    logger.info(f"[会话ID:{conversation_id}] 用户输入(流式): {brief(user_input)}, 模型: {model}", extra=SAMPLED)
+
+    # 开始推送后无法再返回 429，排队已满时在这里直接拒绝
+    if not model:
+        meta = await storage.conversations.get_meta(conversation_id)
+        llm_engine.check_admission(meta.get("model") if meta else None)
+    else:
+        llm_engine.check_admission(model)
+
+    return StreamingResponse(
+        locked_stream_turn(conversation_id, user_input, model, parse_cursor(body.get("cursor"))),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def batch_targets(body: dict):
+    """
+    展开批量请求，返回 (目标列表, 错误信息)；每个目标为 {"conversation_id", "model", "content"}
+    目标未给 content 时使用请求体顶层的 content，未给 conversation_id 时新建会话
+    """
+    targets = body.get("targets")
+    if not isinstance(targets, list) or not targets:
+        return [], "targets 不能为空"
+    if len(targets) > settings.BATCH_MAX_TARGETS:
+        return [], f"targets 最多 {settings.BATCH_MAX_TARGETS} 个"
+    expanded = []
+    for target in targets:
+        if not isinstance(target, dict):
+            return [], "targets 的每一项必须是对象"
+        content = target.get("content", body.get("content"))
+        if not content:
+            return [], "缺少 content"
+        expanded.append({
+            "conversation_id": target.get("conversation_id") or str(uuid.uuid4()),
+            "model": target.get("model") or body.get("model"),
+            "content": content,
+        })
+    return expanded, None
+
+async def run_batch_target(index: int, target: dict, body: dict) -> dict:
+    """执行一个批量目标，失败时返回错误而不影响其他目标"""
+    conversation_id = target["conversation_id"]
+    try:
+        result = await run_turn(conversation_id, target["content"], target["model"], body)
+        return {"index": index, "model": target["model"], **result}
+    except Exception as e:
+        logger.error(f"[会话ID:{conversation_id}] 批量发送失败: {e!r}")
+        return {
+            "index": index,
             "conversation_id": conversation_id,
-            "name": conv_obj.get("name"),
-            "summary": conv_obj.get("summary"),
-            "created_at": conv_obj.get("created_at"),
-            "updated_at": conv_obj.get("updated_at")
+            "model": target["model"],
+            "error": getattr(e, "message", None) or str(e),
+            "retry_after": getattr(e, "retry_after", None),
         }
+
+@router.post("/batch", summary="批量发送消息（多会话/多模型并发）")
+async def send_batch(
+    body: dict = Body(..., example={"content": "你好", "targets": [
+        {"conversation_id": "conv-a", "model": "gpt-4.1"}, {"conversation_id": "conv-b", "model": "o4-mini"}]}),
+    # user=Depends(jwt_auth)
+):
+    targets, error = batch_targets(body)
+    if error:
+        return {"data": {"error": error}}
+    logger.info(f"批量发送 {len(targets)} 个目标: {[(t['conversation_id'], t['model']) for t in targets]}")
+    # 各目标并发调用模型，总耗时取决于最慢的一个；结果按 targets 顺序返回
+    results = await asyncio.gather(*(run_batch_target(i, t, body) for i, t in enumerate(targets)))
+    return {
+        "data": results
     }
 
+async def stream_batch(targets: List[dict], body: dict):
+    """每个目标完成时推送一个 result 事件，全部完成后推送 done；客户端断开时取消未完成的目标"""
+    tasks = [asyncio.create_task(run_batch_target(i, t, body)) for i, t in enumerate(targets)]
+    errors = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            errors += "error" in result
+            yield sse_event("result", result)
+        yield sse_event("done", {"count": len(tasks), "errors": errors})
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@router.post("/batch/stream", summary="批量发送消息（SSE 按完成顺序返回）")
+async def send_batch_stream(
+    body: dict = Body(...),
+    # user=Depends(jwt_auth)
+):
+    targets, error = batch_targets(body)
+    if error:
+        return {"data": {"error": error}}
+    logger.info(f"批量发送(流式) {len(targets)} 个目标: {[(t['conversation_id'], t['model']) for t in targets]}")
+    return StreamingResponse(
+        stream_batch(targets, body),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.delete("/{conversation_id}", summary="删除会话")
 async def delete_conversation(
     conversation_id: str,
     # user=Depends(jwt_auth)
 ):
-    conv_path = get_conversation_path(conversation_id)
-    if conv_path.exists():
-        try:
-            conv_path.unlink()
-            logger.info(f"[会话ID:{conversation_id}] 会话已删除")
-            return {"data": {"success": True}}
-        except Exception as e:
-            logger.error(f"[会话ID:{conversation_id}] 删除会话失败: {e}")
-            return {"data": {"success": False, "error": str(e)}}
+    try:
+        async with conversation_locks.lock(conversation_id):
+            await turn_pipeline.wait(conversation_id)
+            turn_pipeline.discard(conversation_id)
+            deleted = await storage.conversations.delete(conversation_id)
+            await search_index.remove(conversation_id)
+            if deleted:
+                await change_feed.conversation_deleted(conversation_id)
+    except Exception as e:
+        logger.error(f"[会话ID:{conversation_id}] 删除会话失败: {e}")
+        return {"data": {"success": False, "error": str(e)}}
+    if deleted:
+        logger.info(f"[会话ID:{conversation_id}] 会话已删除")
+        return {"data": {"success": True}}
     else:
         logger.warning(f"[会话ID:{conversation_id}] 会话不存在，无法删除")
         return {"data": {"success": False, "error": "会话不存在"}}
@@ -251,26 +580,64 @@ async def set_conversation_config(
     body: dict = Body(...),
     # user=Depends(jwt_auth)
 ):
-    conv_path = get_conversation_path(conversation_id)
-    if not conv_path.exists():
-        return {"data": {"error": "会话不存在"}}
-    try:
-        async with aiofiles.open(conv_path, "r", encoding="utf-8") as f:
-            content = await f.read()
-            conv_obj = json.loads(content)
-    except Exception as e:
-        logger.error(f"[会话ID:{conversation_id}] 读取会话失败: {e}")
-        return {"data": {"error": "读取会话失败"}}
-    # 更新config字段
-    conv_obj["config"] = body
-    # 兼容老字段
-    if "model" in body:
-        conv_obj["model"] = body["model"]
-    conv_obj["updated_at"] = now_iso()
-    try:
-        async with aiofiles.open(conv_path, "w", encoding="utf-8") as f:
-            await f.write(json.dumps(conv_obj, ensure_ascii=False, indent=2))
-    except Exception as e:
-        logger.error(f"[会话ID:{conversation_id}] 保存配置失败: {e}")
-        return {"data": {"error": "保存配置失败"}}
+    async with conversation_locks.lock(conversation_id):
+        # 读-改-写元数据前等待本会话尚在后台保存的轮次落盘
+        await turn_pipeline.wait(conversation_id)
+        if not await storage.conversations.exists(conversation_id):
+            return {"data": {"error": "会话不存在"}}
+        try:
+            conv_obj = await storage.conversations.load(conversation_id)
+        except Exception as e:
+            logger.error(f"[会话ID:{conversation_id}] 读取会话失败: {e}")
+            return {"data": {"error": "读取会话失败"}}
+        # 更新config字段
+        conv_obj["config"] = body
+        conv_obj["conversation_id"] = conversation_id
+        # 兼容老字段
+        if "model" in body:
+            conv_obj["model"] = body["model"]
+        conv_obj["updated_at"] = now_iso()
+        try:
+            conv_obj["revision"] = await storage.conversations.write_meta(
+                conversation_id, conv_obj, expected_revision=conv_obj.get("revision", 0))
+        except ConflictError as e:
+            logger.warning(f"[会话ID:{conversation_id}] 保存配置失败: {e}")
+            return {"data": {"error": CONFLICT_ERROR}}
+        except Exception as e:
+            logger.error(f"[会话ID:{conversation_id}] 保存配置失败: {e}")
+            return {"data": {"error": "保存配置失败"}}
+        await search_index.update_meta(conversation_id, conv_obj)
+        await change_feed.conversation_changed(conversation_id, conv_obj)
     return {"data": conv_obj.get("config", {})}
+
+@router.post("/{conversation_id}/pin", summary="置顶/取消置顶消息")
+async def pin_message(
+    conversation_id: str,
+    body: dict = Body(..., example={"index": 0, "pinned": True}),
+    # user=Depends(jwt_auth)
+):
+    """置顶的消息在构建上下文时始终发送；以消息序号标识，记录在会话元数据中"""
+    async with conversation_locks.lock(conversation_id):
+        await turn_pipeline.wait(conversation_id)
+        conv_obj = await load_conversation(conversation_id)
+        if conv_obj is None:
+            return {"data": {"error": "会话不存在"}}
+        index = body.get("index")
+        if not isinstance(index, int) or not 0 <= index < len(conv_obj.get("messages", [])):
+            return {"data": {"error": "消息序号无效"}}
+        pinned = set(conv_obj.get("pinned") or [])
+        if body.get("pinned", True):
+            pinned.add(index)
+        else:
+            pinned.discard(index)
+        conv_obj["pinned"] = sorted(pinned)
+        conv_obj["conversation_id"] = conversation_id
+        conv_obj["updated_at"] = now_iso()
+        try:
+            conv_obj["revision"] = await storage.conversations.write_meta(
+                conversation_id, conv_obj, expected_revision=conv_obj.get("revision", 0))
+        except ConflictError as e:
+            logger.warning(f"[会话ID:{conversation_id}] 置顶失败: {e}")
+            return {"data": {"error": CONFLICT_ERROR}}
+        await change_feed.conversation_changed(conversation_id, conv_obj)
+    return {"data": {"pinned": conv_obj["pinned"]}}
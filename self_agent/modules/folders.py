@@ -1,18 +1,17 @@
 import os
 import json
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, Body
+from fastapi import APIRouter, HTTPException, Body, Request, Response
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 import uuid
-import aiofiles
+from core.etag import check_etag
+from core.storage import storage
+from modules.changes import CREATED, DELETED, UPDATED, change_feed
 
 router = APIRouter()
 
-FOLDER_DATA_PATH = Path(__file__).parent.parent / "data" / "folders.json"
-FOLDER_DATA_PATH.parent.mkdir(exist_ok=True)
-
 def now_iso():
     return datetime.utcnow().isoformat() + "Z"
 
@@ -25,29 +24,24 @@ class Folder(BaseModel):
     is_default: bool = False
 
 async def load_folders() -> List[Folder]:
-    if not FOLDER_DATA_PATH.exists():
+    try:
+        return [Folder(**item) for item in await storage.folders.list()]
+    except Exception:
         return []
-    async with aiofiles.open(FOLDER_DATA_PATH, "r", encoding="utf-8") as f:
-        content = await f.read()
-        try:
-            data = json.loads(content)
-            return [Folder(**item) for item in data]
-        except Exception:
-            return []
 
-async def save_folders(folders: List[Folder]):
-    async with aiofiles.open(FOLDER_DATA_PATH, "w", encoding="utf-8") as f:
-        await f.write(json.dumps([f.dict() for f in folders], ensure_ascii=False, indent=2))
+async def save_folder(folder: Folder):
+    await storage.folders.save(folder.dict())
 
 async def get_folder_by_id(folder_id: str) -> Optional[Folder]:
-    folders = await load_folders()
-    for folder in folders:
-        if folder.folder_id == folder_id:
-            return folder
-    return None
+    item = await storage.folders.get(folder_id)
+    return Folder(**item) if item else None
 
 @router.get("/", summary="获取所有收藏夹及内容")
-async def list_folders():
+async def list_folders(request: Request, response: Response):
+    # 侧边栏轮询：收藏夹未变化时按版本号直接返回 304
+    not_modified = check_etag(request, response, "folders", await storage.folders.version())
+    if not_modified is not None:
+        return not_modified
     folders = await load_folders()
     return {"data": [f.dict() for f in folders]}
 
@@ -61,8 +55,8 @@ async def create_folder(body: dict = Body(...)):
         raise HTTPException(status_code=400, detail="收藏夹名称已存在")
     folder_id = str(uuid.uuid4())
     folder = Folder(folder_id=folder_id, name=name)
-    folders.append(folder)
-    await save_folders(folders)
+    await save_folder(folder)
+    await change_feed.record("folder", folder_id, CREATED, folder.dict())
     return {"data": folder.dict()}
 
 @router.patch("/{folder_id}", summary="重命名收藏夹")
@@ -78,55 +72,49 @@ async def rename_folder(folder_id: str, body: dict = Body(...)):
         if folder.folder_id == folder_id:
             if folder.is_default:
                 raise HTTPException(status_code=400, detail="默认收藏夹不可重命名")
-            folder.name = new_name
-            folder.updated_at = now_iso()
-            await save_folders(folders)
-            return {"data": folder.dict()}
+            # 只改名称：不用上面读到的整份收藏夹覆盖，期间其他请求（或其他进程）加入的会话不会丢失
+            renamed = await storage.folders.rename(folder_id, new_name, now_iso())
+            if renamed is None:
+                break
+            await change_feed.record("folder", folder_id, UPDATED, renamed)
+            return {"data": renamed}
     raise HTTPException(status_code=404, detail="收藏夹不存在")
 
 @router.delete("/{folder_id}", summary="删除收藏夹")
 async def delete_folder(folder_id: str):
-    folders = await load_folders()
-    for folder in folders:
-        if folder.folder_id == folder_id:
-            if folder.is_default:
-                raise HTTPException(status_code=400, detail="默认收藏夹不可删除")
-            folders.remove(folder)
-            await save_folders(folders)
-            return {"data": {"success": True}}
-    raise HTTPException(status_code=404, detail="收藏夹不存在")
+    folder = await get_folder_by_id(folder_id)
+    if folder is None:
+        raise HTTPException(status_code=404, detail="收藏夹不存在")
+    if folder.is_default:
+        raise HTTPException(status_code=400, detail="默认收藏夹不可删除")
+    await storage.folders.delete(folder_id)
+    await change_feed.record("folder", folder_id, DELETED)
+    return {"data": {"success": True}}
 
 @router.post("/{folder_id}/add", summary="添加会话到收藏夹")
 async def add_conversation(folder_id: str, body: dict = Body(...)):
     conv_id = body.get("conversation_id")
     if not conv_id:
         raise HTTPException(status_code=400, detail="会话ID不能为空")
-    folders = await load_folders()
-    for folder in folders:
-        if folder.folder_id == folder_id:
-            if conv_id not in folder.conversation_ids:
-                folder.conversation_ids.append(conv_id)
-                folder.updated_at = now_iso()
-                await save_folders(folders)
-            return {"data": folder.dict()}
-    raise HTTPException(status_code=404, detail="收藏夹不存在")
+    # 成员判断与写入由存储层完成（内存集合判断，延迟合并写盘）
+    folder = await storage.folders.add_conversation(folder_id, conv_id, now_iso())
+    if folder is None:
+        raise HTTPException(status_code=404, detail="收藏夹不存在")
+    await change_feed.record("folder", folder_id, UPDATED, folder)
+    return {"data": folder}
 
 @router.post("/{folder_id}/remove", summary="从收藏夹移除会话")
 async def remove_conversation(folder_id: str, body: dict = Body(...)):
     conv_id = body.get("conversation_id")
     if not conv_id:
         raise HTTPException(status_code=400, detail="会话ID不能为空")
-    folders = await load_folders()
-    for folder in folders:
-        if folder.folder_id == folder_id:
-            if conv_id in folder.conversation_ids:
-                folder.conversation_ids.remove(conv_id)
-                folder.updated_at = now_iso()
-                await save_folders(folders)
-            return {"data": folder.dict()}
-    raise HTTPException(status_code=404, detail="收藏夹不存在")
+    folder = await storage.folders.remove_conversation(folder_id, conv_id, now_iso())
+    if folder is None:
+        raise HTTPException(status_code=404, detail="收藏夹不存在")
+    await change_feed.record("folder", folder_id, UPDATED, folder)
+    return {"data": folder}
 
-# 初始化时自动生成默认收藏夹（如不存在）
+# 启动时自动生成默认收藏夹（如不存在），由 app.py 的 lifespan 调用
 async def ensure_default_folder():
     folders = await load_folders()
     if not any(f.is_default for f in folders):
@@ -135,8 +123,5 @@ async def ensure_default_folder():
             name="默认收藏夹",
             is_default=True
         )
-        folders.append(default_folder)
-        await save_folders(folders)
-
-import asyncio
-asyncio.get_event_loop().create_task(ensure_default_folder())
+        await save_folder(default_folder)
+        await change_feed.record("folder", default_folder.folder_id, CREATED, default_folder.dict())
@@ -1,55 +1,98 @@
 # 大模型调用封装，支持多引擎（OpenAI/Azure等）
 import os
 import time
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+import httpx
 from langchain_openai import AzureChatOpenAI
 from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from core.config import settings
+from core.logger import logger
+from core.metrics import Counter, Histogram
+from modules.llm_cache import ResponseCache, cache_key, create_response_cache
+from modules.admission import (AdmissionController, PRIORITY_INTERACTIVE, create_admission_controller,
+                              prompt_tokens)
+from modules.context import estimate_tokens
 
-class CustomAzureCallbackHandler(BaseCallbackHandler):
-    def __init__(self):
+LLM_REQUEST_SECONDS = Histogram("llm_request_duration_seconds", "大模型调用总耗时", ("model", "streaming"))
+LLM_TTFT_SECONDS = Histogram("llm_time_to_first_token_seconds", "流式调用首个 token 的耗时", ("model",))
+LLM_PROMPT_TOKENS = Counter("llm_prompt_tokens_total", "发送给大模型的 prompt token 数", ("model",))
+LLM_COMPLETION_TOKENS = Counter("llm_completion_tokens_total", "大模型生成的 token 数", ("model",))
+LLM_ERRORS = Counter("llm_errors_total", "大模型调用失败次数", ("model",))
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    记录一次调用的耗时、首 token 时间与 token 用量，不输出 prompt 与回复内容
+    流式调用上游不返回用量时，prompt 取调用方的预估值，completion 按收到的 token 数计
+    """
+    # 在事件循环中直接调用，不转到线程池
+    run_inline = True
+
+    def __init__(self, model: str = "", streaming: bool = False, prompt_estimate: int = 0):
+        self.model = model
+        self.streaming = streaming
+        self.prompt_estimate = prompt_estimate
         self.start_time = None
-        self.end_time = None
+        self.first_token_time = None
+        self.streamed_tokens = 0
         self.prompt_tokens = 0
         self.completion_tokens = 0
         self.total_tokens = 0
 
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        # 实现此方法可避免 langchain 回退到 on_llm_start 时把消息拼成字符串
+        self.start_time = time.perf_counter()
+
     def on_llm_start(self, serialized, prompts, **kwargs):
-        self.start_time = time.time()
-        print("AzureChatOpenAI 调用开始...")
-        for prompt in prompts:
-            print("Prompt:", prompt)
+        self.start_time = time.perf_counter()
 
     def on_llm_new_token(self, token, **kwargs):
-        # 若采用流式输出，可逐个打印token
-        print(token, end="", flush=True)
+        if self.first_token_time is None and self.start_time is not None:
+            self.first_token_time = time.perf_counter()
+            LLM_TTFT_SECONDS.observe(self.first_token_time - self.start_time, model=self.model)
+        self.streamed_tokens += 1
 
     def on_llm_end(self, response, **kwargs):
-        self.end_time = time.time()
-        print(f"response is {response}")
-        usage = response.llm_output.get("token_usage")
-        self.prompt_tokens = usage.get("prompt_tokens", 0)
-        self.completion_tokens = usage.get("completion_tokens", 0)
-        self.total_tokens = usage.get("total_tokens", 0)
-        elapsed = self.end_time - self.start_time if self.start_time else None
-
-        print("\nAzureChatOpenAI 调用结束")
-        if elapsed is not None:
-            print(f"调用耗时：{elapsed:.2f} 秒")
-        print(f"Token 使用：总共 {self.total_tokens}（Prompt: {self.prompt_tokens}, Completion: {self.completion_tokens}）")
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0.0
+        # 流式调用时 llm_output 可能为空
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.prompt_tokens = usage.get("prompt_tokens") or self.prompt_estimate
+        self.completion_tokens = usage.get("completion_tokens") or self.streamed_tokens
+        self.total_tokens = usage.get("total_tokens") or self.prompt_tokens + self.completion_tokens
+        LLM_REQUEST_SECONDS.observe(elapsed, model=self.model, streaming=str(self.streaming).lower())
+        LLM_PROMPT_TOKENS.inc(self.prompt_tokens, model=self.model)
+        LLM_COMPLETION_TOKENS.inc(self.completion_tokens, model=self.model)
+        logger.debug(f"模型调用结束 model={self.model} 耗时 {elapsed:.2f}s "
+                     f"token {self.total_tokens}（prompt {self.prompt_tokens}, completion {self.completion_tokens}）")
+
+    def on_llm_error(self, error, **kwargs):
+        LLM_ERRORS.inc(model=self.model)
+
+def normalize_temperature(model_name, temperature):
+    # 判断是否为Azure的o开头模型
+    if isinstance(model_name, str) and model_name.startswith("o"):
+        return 1
+    return temperature
 
 def get_llm(
     model_name="gpt-4.1",
     temperature=0.7,
     streaming=False,
-    callbacks=None
+    callbacks=None,
+    http_client=None,
+    http_async_client=None
 ):
     """
     获取 AzureChatOpenAI 实例，自动读取配置
     如果模型名以'o'开头（如Azure的o系列模型），则强制temperature=1
+    callbacks 为 None 时挂载默认回调；传入共享的 httpx 客户端可复用连接池
     """
-    # 判断是否为Azure的o开头模型
-    if isinstance(model_name, str) and model_name.startswith("o"):
-        temperature = 1
+    temperature = normalize_temperature(model_name, temperature)
     llm = AzureChatOpenAI(
         openai_api_version=settings.AZURE_OPENAI_API_VERSION,
         azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
@@ -57,46 +100,257 @@ def get_llm(
         model_name=model_name,
         temperature=temperature,
         streaming=streaming,
-        callbacks=callbacks or [CustomAzureCallbackHandler()]
+        callbacks=[MetricsCallbackHandler(model_name, streaming)] if callbacks is None else callbacks,
+        http_client=http_client,
+        http_async_client=http_async_client
     )
     return llm
 
+class LLMClientRegistry:
+    """
+    复用 AzureChatOpenAI 实例及其 HTTP 连接池
+    实例按 (model, temperature, streaming, endpoint) 缓存，LRU 淘汰；
+    同一 endpoint 的所有实例共享一对 httpx 客户端（keep-alive 连接池），应用关闭时统一关闭。
+    回调按次传入调用，缓存的实例本身不带有状态的回调。
+    """
+
+    def __init__(self, max_size: int = 16, factory=get_llm):
+        self.max_size = max_size
+        self.factory = factory
+        self._clients: OrderedDict = OrderedDict()
+        # endpoint -> (httpx.Client, httpx.AsyncClient)
+        self._http_clients = {}
+
+    def _http_pair(self, endpoint: str):
+        pair = self._http_clients.get(endpoint)
+        if pair is None:
+            limits = httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+            )
+            timeout = httpx.Timeout(settings.LLM_TIMEOUT, connect=10.0)
+            pair = (httpx.Client(limits=limits, timeout=timeout), httpx.AsyncClient(limits=limits, timeout=timeout))
+            self._http_clients[endpoint] = pair
+        return pair
+
+    def get(self, model_name="gpt-4.1", temperature=0.7, streaming=False):
+        temperature = normalize_temperature(model_name, temperature)
+        endpoint = settings.AZURE_OPENAI_ENDPOINT
+        key = (model_name, temperature, streaming, endpoint)
+        llm = self._clients.get(key)
+        if llm is not None:
+            self._clients.move_to_end(key)
+            return llm
+        http_client, http_async_client = self._http_pair(endpoint)
+        llm = self.factory(
+            model_name=model_name,
+            temperature=temperature,
+            streaming=streaming,
+            callbacks=[],
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+        self._clients[key] = llm
+        # 淘汰最久未使用的实例；连接池按 endpoint 共享，不随实例关闭
+        while len(self._clients) > self.max_size:
+            self._clients.popitem(last=False)
+        return llm
+
+    def prewarm(self, models, temperature=0.7):
+        """预先创建常用模型的实例（流式与非流式），避免首个请求承担初始化开销"""
+        for model in models:
+            for streaming in (False, True):
+                try:
+                    self.get(model, temperature, streaming)
+                except Exception as e:
+                    # 配置缺失等情况下不阻止应用启动，首次调用时再报错
+                    logger.warning(f"模型客户端预热失败 model={model}: {e}")
+                    return
+
+    def __len__(self):
+        return len(self._clients)
+
+    async def aclose(self):
+        self._clients.clear()
+        pairs = list(self._http_clients.values())
+        self._http_clients.clear()
+        for http_client, http_async_client in pairs:
+            http_client.close()
+            await http_async_client.aclose()
+
+class LocalFakeChatModel(BaseChatModel):
+    """
+    本地假模型，不访问网络，用于测试与压测
+    回复按 chunk_size 个字符切分为 token，首 token 与后续 token 分别有可配置延迟
+    """
+    reply: str = "这是AI的回复"
+    first_token_delay: float = 0.0
+    token_delay: float = 0.0
+    chunk_size: int = 1
+
+    @property
+    def _llm_type(self) -> str:
+        return "local-fake"
+
+    def _tokens(self) -> List[str]:
+        return [self.reply[i:i + self.chunk_size] for i in range(0, len(self.reply), self.chunk_size)]
+
+    def _result(self, messages) -> ChatResult:
+        prompt_tokens = sum(len(str(m.content)) for m in messages)
+        completion_tokens = len(self._tokens())
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=self.reply))],
+            llm_output={"token_usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }},
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.first_token_delay + self.token_delay * max(len(self._tokens()) - 1, 0))
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.first_token_delay + self.token_delay * max(len(self._tokens()) - 1, 0))
+        return self._result(messages)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        for i, token in enumerate(self._tokens()):
+            await asyncio.sleep(self.first_token_delay if i == 0 else self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def get_fake_llm(**overrides):
+    """按配置创建本地假模型，overrides 可覆盖 reply / first_token_delay / token_delay / chunk_size"""
+    options = {
+        "reply": settings.FAKE_LLM_REPLY,
+        "first_token_delay": settings.FAKE_LLM_FIRST_TOKEN_DELAY,
+        "token_delay": settings.FAKE_LLM_TOKEN_DELAY,
+    }
+    options.update(overrides)
+    return LocalFakeChatModel(**options)
+
+
+def to_lc_message(msg):
+    role = msg.get("role")
+    content = msg.get("content", "")
+    if role == "user":
+        return HumanMessage(content=content)
+    elif role == "assistant":
+        return AIMessage(content=content)
+    elif role == "system":
+        return SystemMessage(content=content)
+    else:
+        # 兼容未知角色
+        return HumanMessage(content=content)
+
 # 可选：统一入口类，兼容多种大模型
 class LLMEngine:
-    def __init__(self, api_key: str = "", engine: str = "azure"):
+    def __init__(self, api_key: str = "", engine: str = "azure", fake_options: Optional[dict] = None,
+                 cache: Optional[ResponseCache] = None, admission: Optional[AdmissionController] = None):
         self.engine = engine
         self.api_key = api_key or settings.AZURE_OPENAI_API_KEY
+        # engine="fake" 时传给本地假模型的参数
+        self.fake_options = fake_options or {}
+        self.clients = LLMClientRegistry(max_size=settings.LLM_CLIENT_CACHE_SIZE)
+        # 回复缓存，为 None 时不缓存
+        self.cache = cache
+        # 上游调用准入控制，为 None 时不限制
+        self.admission = admission
+
+    def _get_llm(self, model, temperature, streaming):
+        if self.engine == "azure":
+            return self.clients.get(model_name=model, temperature=temperature, streaming=streaming)
+        if self.engine == "fake":
+            return get_fake_llm(**self.fake_options)
+        return None
+
+    @asynccontextmanager
+    async def _admitted(self, model, tokens, conversation_id, priority):
+        """占用准入名额（未开启准入控制时直接放行），产出的 ticket 为 None 或 admission.Ticket"""
+        if self.admission is None:
+            yield None
+            return
+        async with self.admission.slot(model, tokens, conversation_id, priority) as ticket:
+            yield ticket
+
+    def check_admission(self, model: Optional[str]):
+        """排队已满时立即抛出 AdmissionRejected（流式接口开始推送前调用）"""
+        if self.admission is not None:
+            self.admission.check(model or "gpt-4.1")
 
-    async def chat(self, messages, model="gpt-4.1", temperature=0.7, streaming=False):
+    async def chat(self, messages, model="gpt-4.1", temperature=0.7, streaming=False, cache: Optional[bool] = None,
+                   conversation_id: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE):
         """
         支持 AzureChatOpenAI 聊天
         messages: [{"role": "user"/"assistant", "content": "..."}]
+        cache: None 按默认策略（仅 temperature 为 0 时使用缓存），True 允许使用缓存，False 绕过缓存
+        conversation_id / priority: 准入控制排队时用于会话间公平轮转与优先级
         """
-        from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-
-        def to_lc_message(msg):
-            role = msg.get("role")
-            content = msg.get("content", "")
-            if role == "user":
-                return HumanMessage(content=content)
-            elif role == "assistant":
-                return AIMessage(content=content)
-            elif role == "system":
-                return SystemMessage(content=content)
-            else:
-                # 兼容未知角色
-                return HumanMessage(content=content)
+        key = None
+        if self.cache is not None and self.cache.should_use(normalize_temperature(model, temperature), cache):
+            key = cache_key(model, normalize_temperature(model, temperature), messages)
+            reply = await self.cache.get(key)
+            if reply is not None:
+                return reply
 
         lc_messages = [to_lc_message(m) for m in messages]
 
-        if self.engine == "azure":
-            llm = get_llm(model_name=model, temperature=temperature, streaming=streaming)
-            # langchain 的 AzureChatOpenAI 支持 async 调用
-            response = await llm.agenerate([lc_messages])
-            # 取第一个回复
-            return response.generations[0][0].text
-        else:
+        llm = self._get_llm(model, temperature, streaming)
+        if llm is None:
             # TODO: 支持其他引擎
             return "暂未实现其他引擎"
+        # langchain 的 AzureChatOpenAI 支持 async 调用；实例为缓存复用，回调按次传入
+        estimate = prompt_tokens(messages)
+        async with self._admitted(model, estimate, conversation_id, priority) as ticket:
+            response = await llm.agenerate([lc_messages], callbacks=[MetricsCallbackHandler(model, streaming, estimate)])
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            if ticket is not None and usage.get("total_tokens"):
+                ticket.actual_tokens = usage["total_tokens"]
+        # 取第一个回复
+        reply = response.generations[0][0].text
+        if key is not None:
+            await self.cache.put(key, reply)
+        return reply
+
+    async def stream(self, messages, model="gpt-4.1", temperature=0.7, conversation_id: Optional[str] = None,
+                     priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[str]:
+        """
+        流式聊天，逐个产出 token 文本
+        调用方提前关闭生成器（如客户端断开）时，上游请求随之关闭，准入名额随之归还
+        """
+        lc_messages = [to_lc_message(m) for m in messages]
+        llm = self._get_llm(model, temperature, True)
+        if llm is None:
+            yield "暂未实现其他引擎"
+            return
+        estimate = prompt_tokens(messages)
+        callbacks = [MetricsCallbackHandler(model, True, estimate)]
+        async with self._admitted(model, estimate, conversation_id, priority) as ticket:
+            completion = 0
+            try:
+                async for chunk in llm.astream(lc_messages, config={"callbacks": callbacks}):
+                    if chunk.content:
+                        completion += estimate_tokens(chunk.content)
+                        yield chunk.content
+            finally:
+                # 流式调用不返回用量，按预估 prompt + 已生成内容估算
+                if ticket is not None:
+                    ticket.actual_tokens = ticket.estimated_tokens + completion
+
+    def prewarm(self, models):
+        if self.engine == "azure":
+            self.clients.prewarm(models)
+
+    async def aclose(self):
+        await self.clients.aclose()
+        if self.cache is not None:
+            self.cache.close()
 
-llm_engine = LLMEngine()
+llm_engine = LLMEngine(engine=settings.LLM_ENGINE, cache=create_response_cache(),
+                       admission=create_admission_controller())
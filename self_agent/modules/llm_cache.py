@@ -0,0 +1,151 @@
+# 大模型回复缓存
+# 键为 (模型, 温度, 规范化消息列表) 的哈希：内存 LRU 在前，SQLite 文件持久化在后，均带过期时间。
+# 默认只缓存 temperature 为 0 的确定性请求，请求显式允许时（cache=True）才对其他温度生效。
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+from core.config import settings
+from core.logger import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    reply TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at);
+"""
+
+
+def cache_key(model: Optional[str], temperature, messages: List[dict]) -> str:
+    """只取 role 与 content 参与哈希，时间戳、token 数等字段不影响命中"""
+    normalized = [[m.get("role", "user"), m.get("content", "")] for m in messages]
+    payload = json.dumps([model, temperature, normalized], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, memory_size: int = 1024, ttl: float = 86400, db_path: Optional[Path] = None):
+        self.memory_size = memory_size
+        self.ttl = ttl
+        # 键 -> (过期时间, 回复)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.db_path = Path(db_path) if db_path else None
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0}
+
+    def should_use(self, temperature, allow: Optional[bool]) -> bool:
+        """allow=False 表示本次请求/会话要求绕过缓存；None 时只缓存温度为 0 的请求"""
+        if allow is False:
+            self.stats["bypassed"] += 1
+            return False
+        if allow or temperature == 0:
+            return True
+        return False
+
+    # ---------- 内存层 ----------
+    def _memory_get(self, key: str) -> Optional[str]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        expires_at, reply = item
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return reply
+
+    def _memory_put(self, key: str, reply: str, expires_at: float):
+        self._memory[key] = (expires_at, reply)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    # ---------- 磁盘层 ----------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        with self._db_lock:
+            return self._db().execute(
+                "SELECT expires_at, reply FROM responses WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+
+    def _disk_put(self, key: str, reply: str, expires_at: float):
+        now = time.time()
+        with self._db_lock:
+            conn = self._db()
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, reply, now, expires_at))
+            conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+
+    # ---------- 对外接口 ----------
+    async def get(self, key: str) -> Optional[str]:
+        reply = self._memory_get(key)
+        if reply is not None:
+            self.stats["memory_hits"] += 1
+            return reply
+        if self.db_path is not None:
+            try:
+                row = await asyncio.to_thread(self._disk_get, key)
+            except Exception as e:
+                logger.warning(f"读取回复缓存失败: {e}")
+                row = None
+            if row is not None:
+                self.stats["disk_hits"] += 1
+                self._memory_put(key, row[1], row[0])
+                return row[1]
+        self.stats["misses"] += 1
+        return None
+
+    async def put(self, key: str, reply: str):
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, reply, expires_at)
+        self.stats["stores"] += 1
+        if self.db_path is not None:
+            try:
+                await asyncio.to_thread(self._disk_put, key, reply, expires_at)
+            except Exception as e:
+                logger.warning(f"写入回复缓存失败: {e}")
+
+    def snapshot(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def create_response_cache() -> Optional[ResponseCache]:
+    """按配置创建缓存，未开启时返回 None"""
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    db_path = None
+    if settings.LLM_CACHE_DISK:
+        from core.storage import DATA_DIR
+        from core.storage.layout import system_path
+        db_path = Path(settings.LLM_CACHE_PATH) if settings.LLM_CACHE_PATH else system_path(DATA_DIR, "llm_cache.db")
+    return ResponseCache(settings.LLM_CACHE_MEMORY_SIZE, settings.LLM_CACHE_TTL, db_path)
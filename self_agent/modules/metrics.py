@@ -0,0 +1,93 @@
+# 指标接口：GET /metrics 以 Prometheus 文本格式输出
+# 请求耗时由 MetricsMiddleware 按路由模板记录；模型调用与存储耗时在各自模块中记录；
+# 排队深度、回复缓存计数等由对应模块自行维护，这里只在采集时读取。
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core.metrics import (REGISTRY, HTTP_REQUEST_SECONDS, CallbackCollector, format_labels, format_value,
+                          header, histogram_lines)
+from core.storage.locks import conversation_locks
+from modules import llm
+from modules.admission import WAIT_BUCKETS
+
+router = APIRouter()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件，按 路由模板 + 方法 + 状态码 记录请求耗时（未匹配的路径归为 unmatched，避免标签无限增长）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
+
+
+def collect_admission():
+    admission = llm.llm_engine.admission
+    if admission is None:
+        return []
+    stats = admission.snapshot()
+    lines = header("llm_queue_depth", "gauge", "排队等待上游调用的请求数")
+    lines += [f"llm_queue_depth{format_labels([('model', m)])} {s['queued']}" for m, s in stats.items()]
+    lines += header("llm_in_flight", "gauge", "正在进行的上游调用数")
+    lines += [f"llm_in_flight{format_labels([('model', m)])} {s['in_flight']}" for m, s in stats.items()]
+    lines += header("llm_admission_rejected_total", "counter", "准入控制拒绝的请求数（队列已满或排队超时）")
+    lines += [f"llm_admission_rejected_total{format_labels([('model', m)])} {s['rejected']}" for m, s in stats.items()]
+    lines += header("llm_queue_wait_seconds", "histogram", "请求在准入队列中的等待时间")
+    for model, s in stats.items():
+        lines += histogram_lines("llm_queue_wait_seconds", [("model", model)], WAIT_BUCKETS,
+                                 list(s["wait_buckets"].values()), s["wait_seconds_total"])
+    return lines
+
+
+def collect_cache():
+    cache = llm.llm_engine.cache
+    if cache is None:
+        return []
+    lines = header("llm_cache_events_total", "counter", "回复缓存命中/未命中/绕过/写入次数")
+    lines += [f"llm_cache_events_total{format_labels([('event', k)])} {v}" for k, v in cache.stats.items()]
+    lines += header("llm_cache_memory_entries", "gauge", "回复缓存内存层条目数")
+    lines.append(f"llm_cache_memory_entries {cache.snapshot()['memory_entries']}")
+    return lines
+
+
+def collect_locks():
+    return header("conversation_locks_active", "gauge", "有持有者或等待者的会话锁数量") + [
+        f"conversation_locks_active {format_value(len(conversation_locks))}"
+    ]
+
+
+CallbackCollector("llm_admission", collect_admission)
+CallbackCollector("llm_cache", collect_cache)
+CallbackCollector("conversation_locks", collect_locks)
+
+
+@router.get("/metrics", summary="Prometheus 指标", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
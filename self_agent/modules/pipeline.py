@@ -0,0 +1,356 @@
+# 发送消息的回复后处理流水线
+# 模型回复后，接口先返回结果，本轮的保存（会话日志、元数据索引）、搜索索引更新、摘要调度交给后台任务按提交顺序执行。
+# - 持久交接：任务入队前先追加到交接日志（pending_turns.jsonl，默认每次写入 fsync），进程异常退出后启动时重放；
+#   保存失败的任务按退避间隔重试，仍失败则保留在交接日志中，下次启动时重放；队列清空时日志只保留这些任务。
+#   同一会话之后的任务排在失败任务之后：执行前先重试失败任务，仍失败则一并保留，覆盖层也保留，消息顺序不会错乱
+#   多个 worker 进程时每个进程独占一个交接日志（flock），已被占用时改用 pending_turns.{pid}.jsonl；
+#   启动时重放所有无人占用（所属进程已退出）的交接日志
+# - 读己之写：任务完成前，会话的最新状态保存在内存覆盖层，下一轮对话与 get_conversation 从覆盖层读取；
+#   首次保存尚未完成的新会话由 unsaved() 列出，会话列表据此合并，无需等待队列
+# - 有界队列：未完成任务达到上限时，新提交等待空位（即退化为同步保存的速度），内存不会无限增长
+# - 关闭时等待全部任务完成
+import os
+import asyncio
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from core.logger import logger
+from core.metrics import Counter
+from core.storage.codec import encode_line, loads_json
+from core.storage.filelock import try_lock
+
+# handler(conversation_id, conv_obj, new_messages)：保存一轮对话；conv_obj 的 messages 已包含 new_messages
+Handler = Callable[[str, dict, List[dict]], Awaitable[Optional[int]]]
+# loader(conversation_id)：从存储读取完整会话，不存在返回 None
+Loader = Callable[[str], Awaitable[Optional[dict]]]
+
+TURNS = Counter("turn_pipeline_jobs_total", "回复后处理流水线执行的任务数", ("result",))
+
+
+class TurnJob:
+    __slots__ = ("id", "conversation_id", "conv_obj", "messages", "attempted")
+
+    def __init__(self, conversation_id: str, conv_obj: dict, messages: List[dict], job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.conversation_id = conversation_id
+        # 提交时的会话快照（含全部消息）；保存失败后重试时按存储的最新版本重建
+        self.conv_obj = conv_obj
+        self.messages = messages
+        # 执行中途被取消（事件循环退出）后重试时，需先确认是否已经写入
+        self.attempted = False
+
+    def record(self) -> dict:
+        meta = {k: v for k, v in self.conv_obj.items() if k != "messages"}
+        return {"id": self.id, "conversation_id": self.conversation_id, "meta": meta, "messages": self.messages}
+
+
+def already_saved(stored: Optional[dict], messages: List[dict]) -> bool:
+    """存储中的会话已包含本轮最后一条消息（按角色、时间戳与内容判断）"""
+    if not stored or not messages:
+        return False
+    last = messages[-1]
+    key = (last.get("role"), last.get("timestamp"), last.get("content"))
+    return any((m.get("role"), m.get("timestamp"), m.get("content")) == key
+               for m in reversed(stored.get("messages") or []))
+
+
+def replay_snapshot(meta: dict, stored: Optional[dict], messages: List[dict]) -> dict:
+    """基于存储中的最新版本重放一轮：历史取自存储，版本检查按存储的版本号"""
+    return {**meta, "messages": (stored or {}).get("messages", []) + messages,
+            "revision": (stored or {}).get("revision", 0)}
+
+
+class TurnPipeline:
+    def __init__(self, handler: Handler, loader: Loader, journal_path: Optional[Path] = None, maxsize: int = 1000,
+                 retries: int = 3, retry_delay: float = 0.5, fsync: bool = True):
+        self.handler = handler
+        self.loader = loader
+        self.journal_path = Path(journal_path) if journal_path else None
+        self.maxsize = maxsize
+        # 保存失败后的重试次数与首次重试间隔（之后每次加倍）
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # 写交接日志后是否 fsync：关闭时机器断电可能丢失最近提交的任务，换取更低的提交延迟
+        self.fsync = fsync
+        # 尚未完成的任务（队首为正在执行的任务），按提交顺序
+        self._jobs: "deque[TurnJob]" = deque()
+        # 会话ID -> 最新快照 / 未完成任务数
+        self._overlay: Dict[str, dict] = {}
+        self._pending: Dict[str, int] = {}
+        # 首次保存尚未完成的新会话：会话ID -> 首个任务的 id
+        self._unsaved: Dict[str, str] = {}
+        # 已提交 / 已完成的任务总数，用于等待“此前提交的任务”完成
+        self._submitted = 0
+        self._done = 0
+        # 重试后仍未保存成功的任务，保留在交接日志中直到下次启动重放
+        self._failed: List[TurnJob] = []
+        # 本进程占用的交接日志（打开期间持有其 flock）
+        self._journal = None
+        self._journal_file: Optional[Path] = None
+        self._loop = None
+        self._cond: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- 读 ----------
+    def view(self, conversation_id: str) -> Optional[dict]:
+        """覆盖层中的会话（副本），没有未完成任务时返回 None"""
+        snapshot = self._overlay.get(conversation_id)
+        if snapshot is None:
+            return None
+        return {**snapshot, "messages": list(snapshot["messages"])}
+
+    def unsaved(self) -> List[dict]:
+        """首次保存尚未完成的新会话（覆盖层快照，不含消息），按创建时间降序"""
+        snapshots = [{**{k: v for k, v in self._overlay[cid].items() if k != "messages"}, "conversation_id": cid}
+                     for cid in self._unsaved]
+        snapshots.sort(key=lambda c: (c.get("created_at") or "", c["conversation_id"]), reverse=True)
+        return snapshots
+
+    def pending(self, conversation_id: Optional[str] = None) -> int:
+        if conversation_id is None:
+            return len(self._jobs)
+        return self._pending.get(conversation_id, 0)
+
+    # ---------- 提交 ----------
+    async def submit(self, conversation_id: str, conv_obj: dict, messages: List[dict]):
+        """提交一轮对话的保存任务；conv_obj 的 messages 已包含本轮新增的 messages"""
+        self._ensure_worker()
+        async with self._cond:
+            await self._cond.wait_for(lambda: len(self._jobs) < self.maxsize)
+            snapshot = {**conv_obj, "messages": list(conv_obj["messages"])}
+            job = TurnJob(conversation_id, snapshot, messages)
+            self._write_journal(job)
+            self._jobs.append(job)
+            # 每次带元数据的写入使版本号加一；按此预估，下一轮基于覆盖层提交的任务可直接通过版本检查
+            if not snapshot.get("revision") and conversation_id not in self._overlay:
+                self._unsaved[conversation_id] = job.id
+            self._overlay[conversation_id] = {**snapshot, "revision": (snapshot.get("revision") or 0) + 1}
+            self._pending[conversation_id] = self._pending.get(conversation_id, 0) + 1
+            self._submitted += 1
+            self._cond.notify_all()
+
+    def _claim_journal(self):
+        """占用交接日志；默认路径已被其他存活进程占用时改用本进程专属的文件"""
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        own = self.journal_path.with_name(f"{self.journal_path.stem}.{os.getpid()}{self.journal_path.suffix}")
+        for path in (self.journal_path, own):
+            f = open(path, "ab")
+            if try_lock(f.fileno()):
+                self._journal, self._journal_file = f, path
+                return
+            f.close()
+        raise RuntimeError(f"交接日志被占用: {own}")
+
+    def _write_journal(self, job: TurnJob):
+        if self.journal_path is None:
+            return
+        if self._journal is None:
+            self._claim_journal()
+        # 一行的小块追加写，直接在事件循环中完成，比切换到线程更快
+        self._journal.write(encode_line(job.record()))
+        self._sync_journal()
+
+    def _sync_journal(self):
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _clear_journal(self):
+        """队列清空：交接日志只保留仍未保存成功的任务"""
+        if self._journal is None:
+            if not self._failed or self.journal_path is None:
+                return
+            self._claim_journal()
+        self._journal.truncate(0)
+        for job in self._failed:
+            self._journal.write(encode_line(job.record()))
+        self._sync_journal()
+
+    # ---------- 执行 ----------
+    def _ensure_worker(self):
+        # 测试中每个用例可能运行在新的事件循环上，条件变量与后台任务随循环重建，未完成的任务保留
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._cond = asyncio.Condition()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._jobs)
+                job = self._jobs[0]
+            saved = await self._retry_held(job.conversation_id) and await self._apply(job)
+            async with self._cond:
+                self._jobs.popleft()
+                self._finish(job, saved)
+                self._cond.notify_all()
+
+    def _held(self, conversation_id: str) -> bool:
+        return any(j.conversation_id == conversation_id for j in self._failed)
+
+    async def _retry_held(self, conversation_id: str) -> bool:
+        """按顺序重试该会话此前保存失败的任务（各一次，不退避）；全部成功返回 True，否则本轮任务也须保留"""
+        for job in [j for j in self._failed if j.conversation_id == conversation_id]:
+            try:
+                stored = await self.loader(conversation_id)
+            except Exception as e:
+                logger.error(f"[会话ID:{conversation_id}] 读取会话失败，暂缓保存: {e}")
+                return False
+            # 重启后从交接日志载入的任务只带本轮消息，统一按存储中的最新版本重放
+            if not (job.attempted and already_saved(stored, job.messages)):
+                meta = {k: v for k, v in job.conv_obj.items() if k != "messages"}
+                job.conv_obj = replay_snapshot(meta, stored, job.messages)
+            if not await self._apply(job, retries=0):
+                TURNS.inc(result="held")
+                return False
+            self._failed.remove(job)
+            if self._unsaved.get(conversation_id) == job.id:
+                del self._unsaved[conversation_id]
+        return True
+
+    async def _apply(self, job: TurnJob, retries: Optional[int] = None) -> bool:
+        """执行一个任务，失败时按退避间隔重试；返回是否已保存"""
+        conversation_id = job.conversation_id
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                if job.attempted and already_saved(await self.loader(conversation_id), job.messages):
+                    TURNS.inc(result="skipped")
+                    return True
+                job.attempted = True
+                await self.handler(conversation_id, dict(job.conv_obj), job.messages)
+                TURNS.inc(result="ok")
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt < retries:
+                    TURNS.inc(result="retry")
+                    logger.warning(f"[会话ID:{conversation_id}] 后台保存失败，稍后重试: {e}")
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                else:
+                    TURNS.inc(result="error")
+                    logger.error(f"[会话ID:{conversation_id}] 后台保存失败，保留在交接日志中待下次启动重放: {e}")
+        return False
+
+    def _finish(self, job: TurnJob, saved: bool = True):
+        conversation_id = job.conversation_id
+        if not saved:
+            self._failed.append(job)
+        elif self._unsaved.get(conversation_id) == job.id:
+            del self._unsaved[conversation_id]
+        self._done += 1
+        self._pending[conversation_id] -= 1
+        if self._pending[conversation_id] == 0:
+            del self._pending[conversation_id]
+            # 存储已包含全部已提交内容时之后直接读存储；仍有未保存的任务时保留覆盖层，下一轮基于完整历史
+            if not self._held(conversation_id):
+                self._overlay.pop(conversation_id, None)
+        if not self._jobs:
+            self._clear_journal()
+
+    def discard(self, conversation_id: str):
+        """删除会话时丢弃其仍未保存成功的任务与覆盖层（调用方持有该会话的锁并已等待其任务完成）"""
+        if not self._held(conversation_id):
+            return
+        self._failed = [j for j in self._failed if j.conversation_id != conversation_id]
+        self._overlay.pop(conversation_id, None)
+        self._unsaved.pop(conversation_id, None)
+        if not self._jobs:
+            self._clear_journal()
+
+    async def wait(self, conversation_id: Optional[str] = None):
+        """
+        等待指定会话（默认全部会话）在此之前提交的任务完成
+        调用方持有该会话的锁时，等待结束后该会话不再有未完成任务
+        """
+        if self.pending(conversation_id) == 0:
+            return
+        self._ensure_worker()
+        async with self._cond:
+            if conversation_id is not None:
+                await self._cond.wait_for(lambda: self.pending(conversation_id) == 0)
+            else:
+                target = self._submitted
+                await self._cond.wait_for(lambda: self._done >= target)
+
+    async def close(self):
+        """等待全部任务完成后停止后台任务"""
+        while self._jobs:
+            await self.wait()
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._journal is not None:
+            if self._journal_file != self.journal_path and not self._failed:
+                # 专属文件此时已清空，不再需要
+                self._journal_file.unlink(missing_ok=True)
+            self._journal.close()
+            self._journal = None
+            self._journal_file = None
+
+    # ---------- 恢复 ----------
+    async def recover(self) -> int:
+        """启动时重放交接日志中未完成的任务（已写入存储的跳过），返回重放数量"""
+        if self.journal_path is None:
+            return 0
+        pattern = f"{self.journal_path.stem}.*{self.journal_path.suffix}"
+        paths = [self.journal_path, *sorted(self.journal_path.parent.glob(pattern))]
+        replayed = 0
+        failed = len(self._failed)
+        for path in paths:
+            if path != self._journal_file and path.exists():
+                replayed += await self._recover_file(path)
+        if len(self._failed) > failed and not self._jobs:
+            # 重放仍失败的任务写入本进程的交接日志，不随原文件一起删除
+            self._clear_journal()
+        if replayed:
+            logger.info(f"已重放 {replayed} 个未完成的保存任务")
+        return replayed
+
+    async def _recover_file(self, path: Path) -> int:
+        with open(path, "r+b") as f:
+            # 仍被其他存活的 worker 占用：其中的任务由该进程负责
+            if not try_lock(f.fileno()):
+                return 0
+            records = []
+            for line in f:
+                try:
+                    records.append(loads_json(line))
+                except ValueError:
+                    # 写到一半的最后一行
+                    continue
+            replayed = 0
+            # 已有任务保存失败的会话，其后的任务不再执行，按原顺序保留
+            held = {j.conversation_id for j in self._failed}
+            for record in records:
+                conversation_id = record["conversation_id"]
+                if conversation_id in held:
+                    self._failed.append(TurnJob(conversation_id, {**record["meta"], "messages": record["messages"]},
+                                                record["messages"], job_id=record.get("id")))
+                    continue
+                stored = await self.loader(conversation_id)
+                if already_saved(stored, record["messages"]):
+                    continue
+                conv_obj = replay_snapshot(record["meta"], stored, record["messages"])
+                try:
+                    await self.handler(conversation_id, conv_obj, record["messages"])
+                    replayed += 1
+                except Exception as e:
+                    logger.error(f"[会话ID:{conversation_id}] 重放未完成的保存任务失败: {e}")
+                    held.add(conversation_id)
+                    self._failed.append(TurnJob(conversation_id, {**record["meta"], "messages": record["messages"]},
+                                                record["messages"], job_id=record.get("id")))
+            if path == self.journal_path:
+                f.truncate(0)
+            else:
+                # 已退出进程的专属文件，持锁期间删除
+                path.unlink(missing_ok=True)
+        return replayed
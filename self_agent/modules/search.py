@@ -0,0 +1,287 @@
+# 全文搜索：消息内容、会话名称与摘要的倒排索引
+# 索引为独立的 SQLite FTS5 数据库（data/system/search.db），与存储后端无关。
+# 中文等 CJK 文本没有空格分词，写入前预先切分为单字 + 相邻二字（bigram），
+# 其他文字按词切分并转小写，再以空格连接交给 FTS5 的 unicode61 分词器。
+# 发送消息后增量写入，删除会话时移除，存量数据用 python manage.py rebuild-search 重建。
+import re
+import json
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+from fastapi import APIRouter, Query
+
+from core.config import settings
+from core.logger import logger
+from core.storage import DATA_DIR, storage
+from core.storage.layout import system_path
+from core.storage.sqlite_backend import SQLiteDatabase
+
+router = APIRouter()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT,
+    content TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_docs_conversation ON docs (conversation_id, kind);
+CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(tokens, tokenize = 'unicode61 remove_diacritics 2');
+CREATE TABLE IF NOT EXISTS convs (
+    conversation_id TEXT PRIMARY KEY,
+    name TEXT,
+    model TEXT,
+    updated_at TEXT
+);
+"""
+
+# 名称/摘要命中的权重高于消息内容
+TITLE_BOOST = 2.0
+# 每次查询先由 FTS5 按相关度取前 N 条候选（top-N，不对全部命中排序），再做名称加权、过滤与分页
+MAX_CANDIDATES = 1000
+SNIPPET_RADIUS = 30
+
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TERM_RE = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+
+
+def index_tokens(text: str) -> str:
+    """CJK 连续片段切为单字 + bigram，其他词转小写"""
+    tokens = []
+    for run in _TERM_RE.findall(text or ""):
+        if _CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return " ".join(tokens)
+
+
+def query_terms(q: str) -> List[str]:
+    """查询切分：单个汉字用单字，两个及以上用 bigram；所有词项需同时命中"""
+    terms = []
+    for run in _TERM_RE.findall(q or ""):
+        if _CJK_RE.match(run):
+            terms.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            terms.append(run.lower())
+    return list(dict.fromkeys(terms))
+
+
+def make_snippet(content: str, q: str, radius: int = SNIPPET_RADIUS) -> str:
+    """截取首个命中片段附近的文本，命中部分用 <mark> 标出"""
+    words = _TERM_RE.findall(q or "")
+    if not words:
+        return content[:radius * 2]
+    pattern = re.compile("|".join(re.escape(w) for w in sorted(words, key=len, reverse=True)), re.IGNORECASE)
+    m = pattern.search(content)
+    if m is None:
+        return content[:radius * 2]
+    start = max(m.start() - radius, 0)
+    end = min(m.end() + radius, len(content))
+    window = content[start:end]
+    marked = pattern.sub(lambda x: f"<mark>{x.group(0)}</mark>", window)
+    return ("…" if start > 0 else "") + marked + ("…" if end < len(content) else "")
+
+
+class SearchIndex:
+    def __init__(self, db_path: Path, enabled: bool = True, max_candidates: int = MAX_CANDIDATES):
+        self.db_path = Path(db_path)
+        self.enabled = enabled
+        self.max_candidates = max_candidates
+        self._db = None
+
+    @property
+    def db(self) -> SQLiteDatabase:
+        # 首次使用时才创建数据库文件
+        if self._db is None:
+            self._db = SQLiteDatabase(self.db_path, schema=SCHEMA)
+        return self._db
+
+    # ---------- 写 ----------
+    @staticmethod
+    def _insert(conn, conversation_id: str, kind: str, seq: int, role: Optional[str], content: str, created_at: Optional[str]):
+        tokens = index_tokens(content)
+        if not tokens:
+            return
+        doc_id = conn.execute(
+            "INSERT INTO docs (conversation_id, kind, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (conversation_id, kind, seq, role, content, created_at),
+        ).lastrowid
+        conn.execute("INSERT INTO docs_fts (rowid, tokens) VALUES (?, ?)", (doc_id, tokens))
+
+    @staticmethod
+    def _delete(conn, conversation_id: str, kind: Optional[str] = None):
+        where, args = "conversation_id = ?", (conversation_id,)
+        if kind is not None:
+            where, args = "conversation_id = ? AND kind = ?", (conversation_id, kind)
+        conn.execute(f"DELETE FROM docs_fts WHERE rowid IN (SELECT id FROM docs WHERE {where})", args)
+        conn.execute(f"DELETE FROM docs WHERE {where}", args)
+
+    @classmethod
+    def _put_meta(cls, conn, conversation_id: str, meta: dict):
+        config = meta.get("config") if isinstance(meta.get("config"), dict) else {}
+        conn.execute(
+            "INSERT OR REPLACE INTO convs VALUES (?, ?, ?, ?)",
+            (conversation_id, meta.get("name"), config.get("model") or meta.get("model"), meta.get("updated_at")),
+        )
+        cls._delete(conn, conversation_id, "title")
+        title = " ".join(t for t in (meta.get("name"), meta.get("summary")) if t)
+        cls._insert(conn, conversation_id, "title", -1, None, title, meta.get("updated_at"))
+
+    def _index(self, conn, conversation_id: str, meta: Optional[dict], messages: List[dict], start_seq: int):
+        for i, m in enumerate(messages):
+            self._insert(conn, conversation_id, "message", start_seq + i, m.get("role"), m.get("content", ""), m.get("timestamp"))
+        if meta is not None:
+            self._put_meta(conn, conversation_id, meta)
+
+    async def index_messages(self, conversation_id: str, messages: List[dict], start_seq: int, meta: Optional[dict] = None):
+        """增量写入新消息（start_seq 为第一条的序号），meta 不为空时同时更新名称/摘要/模型"""
+        if not self.enabled:
+            return
+        try:
+            await self.db.awrite(self._index, conversation_id, meta, messages, start_seq)
+        except Exception as e:
+            logger.error(f"[会话ID:{conversation_id}] 更新搜索索引失败: {e}")
+
+    async def update_meta(self, conversation_id: str, meta: dict):
+        await self.index_messages(conversation_id, [], 0, meta)
+
+    async def remove(self, conversation_id: str):
+        if not self.enabled:
+            return
+        def w(conn):
+            self._delete(conn, conversation_id)
+            conn.execute("DELETE FROM convs WHERE conversation_id = ?", (conversation_id,))
+        try:
+            await self.db.awrite(w)
+        except Exception as e:
+            logger.error(f"[会话ID:{conversation_id}] 删除搜索索引失败: {e}")
+
+    async def rebuild(self, conversations: AsyncIterator[dict]) -> int:
+        """清空后按完整会话对象逐个重建（命令行使用），返回会话数"""
+        def w(conn):
+            conn.execute("DELETE FROM docs_fts")
+            conn.execute("DELETE FROM docs")
+            conn.execute("DELETE FROM convs")
+        await self.db.awrite(w)
+        count = 0
+        async for conv_obj in conversations:
+            messages = conv_obj.get("messages") or []
+            await self.db.awrite(self._index, conv_obj["conversation_id"], conv_obj, messages, 0)
+            count += 1
+        return count
+
+    # ---------- 查询 ----------
+    async def search(self, q: str, limit: int = 20, offset: int = 0, conversation_ids: Optional[List[str]] = None,
+                     model: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None):
+        """返回 (命中列表, 是否还有更多)；按相关度排序，名称/摘要命中加权"""
+        terms = query_terms(q)
+        if not terms or (conversation_ids is not None and not conversation_ids):
+            return [], False
+        match = " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        where = []
+        args = []
+        if conversation_ids is not None:
+            where.append("d.conversation_id IN (SELECT value FROM json_each(?))")
+            args.append(json.dumps(conversation_ids, ensure_ascii=False))
+        if model:
+            where.append("c.model = ?")
+            args.append(model)
+        if date_from:
+            where.append("d.created_at >= ?")
+            args.append(date_from)
+        if date_to:
+            where.append("d.created_at <= ?")
+            args.append(date_to)
+        # 常见词、单字 bigram 可能命中大量行：内层只取相关度最高的 cap 条候选，外层再加权、过滤、分页
+        sql = f"""
+            SELECT d.conversation_id, d.kind, d.seq, d.role, d.content, d.created_at, c.name, c.model,
+                   cand.rank * (CASE d.kind WHEN 'title' THEN {TITLE_BOOST} ELSE 1.0 END) AS score
+            FROM (SELECT rowid, rank FROM docs_fts WHERE docs_fts MATCH ? ORDER BY rank LIMIT ?) AS cand
+            JOIN docs d ON d.id = cand.rowid
+            LEFT JOIN convs c ON c.conversation_id = d.conversation_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY score
+            LIMIT ? OFFSET ?
+        """
+
+        def query(conn):
+            cap = max(self.max_candidates, offset + limit + 1)
+            while True:
+                # 多取一条判断是否还有下一页，避免统计全部命中数
+                rows = conn.execute(sql, [match, cap, *args, limit + 1, offset]).fetchall()
+                if len(rows) > limit:
+                    return rows
+                # 过滤后不足一页：候选未被截断说明已是全部结果，否则扩大候选集重查
+                truncated = conn.execute(
+                    "SELECT count(*) FROM (SELECT rowid FROM docs_fts WHERE docs_fts MATCH ? LIMIT ?)", (match, cap + 1)
+                ).fetchone()[0] > cap
+                if not truncated:
+                    return rows
+                cap *= 4
+
+        rows = await self.db.aread(query)
+        hits = [
+            {
+                "conversation_id": r["conversation_id"],
+                "name": r["name"],
+                "model": r["model"],
+                "kind": r["kind"],
+                "index": r["seq"] if r["kind"] == "message" else None,
+                "role": r["role"],
+                "timestamp": r["created_at"],
+                "score": round(-r["score"], 4),
+                "snippet": make_snippet(r["content"], q),
+            }
+            for r in rows[:limit]
+        ]
+        return hits, len(rows) > limit
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def default_search_path() -> Path:
+    return Path(settings.SEARCH_PATH) if settings.SEARCH_PATH else system_path(DATA_DIR, "search.db")
+
+
+search_index = SearchIndex(default_search_path(), enabled=settings.SEARCH_ENABLED,
+                           max_candidates=settings.SEARCH_MAX_CANDIDATES)
+
+
+@router.get("/", summary="全文搜索会话与消息")
+async def search(
+    q: str = Query(..., min_length=1, description="搜索关键词"),
+    folder_id: Optional[str] = Query(None, description="只搜索该收藏夹中的会话"),
+    tag: Optional[str] = Query(None, description="只搜索带有该标签的会话"),
+    model: Optional[str] = Query(None, description="只搜索使用该模型的会话"),
+    date_from: Optional[str] = Query(None, description="消息时间下限（ISO8601）"),
+    date_to: Optional[str] = Query(None, description="消息时间上限（ISO8601）"),
+    page: int = Query(1, ge=1),
+    size: int = Query(20, ge=1, le=100),
+):
+    conversation_ids = None
+    if folder_id:
+        folder = await storage.folders.get(folder_id)
+        conversation_ids = folder["conversation_ids"] if folder else []
+    if tag:
+        tagged = await storage.tags.list_conversations(tag)
+        if conversation_ids is not None:
+            tagged_set = set(tagged)
+            tagged = [c for c in conversation_ids if c in tagged_set]
+        conversation_ids = tagged
+    hits, has_more = await search_index.search(
+        q, limit=size, offset=(page - 1) * size, conversation_ids=conversation_ids,
+        model=model, date_from=date_from, date_to=date_to,
+    )
+    return {
+        "data": hits,
+        "meta": {"page": page, "size": size, "has_more": has_more}
+    }
@@ -0,0 +1,196 @@
+# 长会话滚动摘要
+# 每轮对话保存后检查：摘要水位线之后的历史超过 SUMMARY_TRIGGER_TOKENS 时，把会话放入后台队列。
+# 后台任务用较便宜的模型（SUMMARY_MODEL）将“上一版摘要 + 水位线到最近若干轮之前的消息”压缩为新摘要，
+# 连同新水位线写入会话元数据 rolling_summary：{"text", "upto", "tokens", "model", "updated_at"}。
+# 之后构建上下文时，水位线之前的消息由摘要代替（见 modules/context.py）。
+# - 不在请求路径上执行：调用方只做一次 token 求和并入队
+# - 幂等：同一会话在队列中只出现一次；写入前重新读取会话，水位线已被推进或会话已变化则放弃本次结果
+import asyncio
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import Counter
+from core.storage import storage
+from core.storage.base import ConflictError
+from core.storage.locks import conversation_locks
+from modules.admission import PRIORITY_BACKGROUND
+from modules.changes import change_feed
+from modules.context import SUMMARY_PREFIX, count_tokens, message_tokens
+
+SUMMARY_PROMPT = (
+    "你负责压缩一段长对话的历史。请把已有摘要与新增对话合并为一份新的摘要，"
+    "保留用户的目标、已确定的事实与结论、约定的格式或偏好以及尚未解决的问题，省略寒暄与重复内容。"
+    "直接输出摘要正文，不要添加标题或说明。"
+)
+
+SUMMARIES = Counter("conversation_summaries_total", "后台滚动摘要执行次数", ("result",))
+
+
+def now_iso():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def transcript(messages: List[dict]) -> str:
+    return "\n".join(f"{m.get('role')}: {m.get('content', '')}" for m in messages if m.get("role") != "system")
+
+
+class Summarizer:
+    def __init__(self, engine=None, model: Optional[str] = None, trigger_tokens: Optional[int] = None,
+                 keep_recent_tokens: Optional[int] = None, enabled: Optional[bool] = None, pipeline=None):
+        # engine 为 None 时使用 modules.llm 中的全局 llm_engine（调用时才导入，便于测试替换）
+        self.engine = engine
+        # pipeline 为 None 时使用 modules.conversation 中的回复后处理流水线（同上；该模块导入本模块）
+        self.pipeline = pipeline
+        self.model = model or settings.SUMMARY_MODEL
+        self.trigger_tokens = trigger_tokens if trigger_tokens is not None else settings.SUMMARY_TRIGGER_TOKENS
+        self.keep_recent_tokens = (keep_recent_tokens if keep_recent_tokens is not None
+                                   else settings.SUMMARY_KEEP_RECENT_TOKENS)
+        self.enabled = settings.SUMMARY_ENABLED if enabled is None else enabled
+        # 已入队、尚未处理的会话
+        self._pending = set()
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop = None
+
+    def _engine(self):
+        if self.engine is not None:
+            return self.engine
+        from modules.llm import llm_engine
+        return llm_engine
+
+    def _pipeline(self):
+        if self.pipeline is not None:
+            return self.pipeline
+        from modules.conversation import turn_pipeline
+        return turn_pipeline
+
+    # ---------- 判断与划分 ----------
+    def plan(self, conversation_id: str, conv_obj: dict) -> Optional[Tuple[int, int]]:
+        """需要生成新摘要时返回待压缩的消息区间 [start, end)，否则返回 None"""
+        messages = conv_obj.get("messages") or []
+        state = conv_obj.get("rolling_summary") or {}
+        start = state.get("upto", 0) if 0 < state.get("upto", 0) < len(messages) else 0
+        counts = [message_tokens(m, conversation_id, i) for i, m in enumerate(messages)]
+        pending = sum(counts[start:]) + ((state.get("tokens") or 0) if start else 0)
+        if pending <= self.trigger_tokens:
+            return None
+        # 从最近往前保留 keep_recent_tokens 的原文，至少保留最后一轮（两条消息）
+        end = max(len(messages) - 2, 0)
+        kept = sum(counts[end:])
+        while end > start and kept + counts[end - 1] <= self.keep_recent_tokens:
+            end -= 1
+            kept += counts[end]
+        return (start, end) if end > start else None
+
+    # ---------- 调度 ----------
+    def schedule(self, conversation_id: str, conv_obj: dict) -> bool:
+        """每轮保存后调用：需要摘要时放入后台队列，返回是否入队"""
+        if not self.enabled or conversation_id in self._pending:
+            return False
+        if self.plan(conversation_id, conv_obj) is None:
+            return False
+        self._ensure_worker()
+        self._pending.add(conversation_id)
+        self._queue.put_nowait(conversation_id)
+        return True
+
+    def _ensure_worker(self):
+        # 测试中每个用例可能运行在新的事件循环上，队列与任务随循环重建
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._pending.clear()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            conversation_id = await self._queue.get()
+            try:
+                await self.summarize(conversation_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                SUMMARIES.inc(result="error")
+                logger.error(f"[会话ID:{conversation_id}] 生成滚动摘要失败: {e}")
+            finally:
+                self._pending.discard(conversation_id)
+                self._queue.task_done()
+
+    async def drain(self):
+        """等待队列中的摘要任务全部完成"""
+        if self._queue is not None and self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._pending.clear()
+
+    # ---------- 执行 ----------
+    async def summarize(self, conversation_id: str) -> bool:
+        """为会话生成一版新摘要并写入元数据，返回是否写入"""
+        conv_obj = await storage.conversations.load(conversation_id)
+        if conv_obj is None:
+            return False
+        span = self.plan(conversation_id, conv_obj)
+        if span is None:
+            SUMMARIES.inc(result="skipped")
+            return False
+        start, end = span
+        state = conv_obj.get("rolling_summary") or {}
+        previous = state.get("text") if start else ""
+        content = (f"已有摘要：\n{previous}\n\n" if previous else "") + f"新增对话：\n{transcript(conv_obj['messages'][start:end])}"
+        prompt = [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": content}]
+        text = await self._engine().chat(prompt, model=self.model, temperature=0, cache=False,
+                                         conversation_id=conversation_id, priority=PRIORITY_BACKGROUND)
+        text = (text or "").strip()
+        if not text:
+            SUMMARIES.inc(result="empty")
+            return False
+        return await self._save(conversation_id, conv_obj, start, end, text)
+
+    async def _save(self, conversation_id: str, snapshot: dict, start: int, end: int, text: str) -> bool:
+        # 与发送消息共用会话锁：写入期间不会有一轮对话基于旧元数据覆盖摘要
+        async with conversation_locks.lock(conversation_id):
+            # 先等待该会话已提交的后台保存完成：否则存储落后于生成摘要时的快照而被误判为过期，
+            # 写入摘要后版本号加一，排队中的保存任务也会全部冲突重放；持锁期间不会再有新的一轮提交
+            await self._pipeline().wait(conversation_id)
+            latest = await storage.conversations.load(conversation_id)
+            current = (latest or {}).get("rolling_summary") or {}
+            # 摘要生成期间会话被删除、重写，或另一个任务已推进水位线：放弃本次结果
+            if (latest is None or len(latest.get("messages") or []) < end
+                    or latest["messages"][end - 1].get("timestamp") != snapshot["messages"][end - 1].get("timestamp")
+                    or current.get("upto", 0) != (snapshot.get("rolling_summary") or {}).get("upto", 0)):
+                SUMMARIES.inc(result="stale")
+                return False
+            message_count = len(latest.pop("messages"))
+            latest["rolling_summary"] = {
+                "text": text,
+                "upto": end,
+                "tokens": count_tokens(SUMMARY_PREFIX + text),
+                "model": self.model,
+                "updated_at": now_iso(),
+            }
+            try:
+                latest["revision"] = await storage.conversations.append(
+                    conversation_id, [], meta=latest, expected_revision=latest.get("revision", 0))
+            except ConflictError as e:
+                # 其他进程刚写入，交给下一轮对话重新触发
+                SUMMARIES.inc(result="stale")
+                logger.warning(f"[会话ID:{conversation_id}] {e}，放弃本次摘要")
+                return False
+            await change_feed.conversation_changed(conversation_id, {**latest, "message_count": message_count})
+        SUMMARIES.inc(result="ok")
+        logger.info(f"[会话ID:{conversation_id}] 已生成滚动摘要，水位线 {start} -> {end}")
+        return True
+
+
+summarizer = Summarizer()
@@ -1,31 +1,23 @@
-import os
 import uuid
-import json
 from datetime import datetime
-from fastapi import APIRouter, HTTPException, Query, Body
+from fastapi import APIRouter, HTTPException, Query, Body, Request, Response
+from core.etag import check_etag
+from core.storage import storage
+from modules.changes import CREATED, DELETED, UPDATED, change_feed
 
-DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "tags.json")
 router = APIRouter(prefix="/api/v1/conversation_tags", tags=["conversation_tags"])
 
-def load_tags():
-    if not os.path.exists(DATA_PATH):
-        return {"tags": []}
-    with open(DATA_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def save_tags(data):
-    os.makedirs(os.path.dirname(DATA_PATH), exist_ok=True)
-    with open(DATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
 def now_iso():
     return datetime.utcnow().isoformat() + "Z"
 
+async def tags_etag(request: Request, response: Response, *params):
+    """查询接口的条件请求：ETag 取标签整体的版本号与查询参数，未变化时返回 304 响应"""
+    return check_etag(request, response, "tags", request.url.path, *params, await storage.tags.version())
+
 @router.post("/", summary="为会话添加标签")
-def add_tag(
+async def add_tag(
     body: dict = Body(..., example={"conversation_id": "conv-uuid-1", "tag": "工作"})
 ):
-    data = load_tags()
     tag_obj = {
         "id": str(uuid.uuid4()),
         "conversation_id": body["conversation_id"],
@@ -33,43 +25,51 @@ def add_tag(
         "created_at": now_iso(),
         "updated_at": now_iso()
     }
-    data["tags"].append(tag_obj)
-    save_tags(data)
+    await storage.tags.add(tag_obj)
+    await change_feed.record("tag", tag_obj["id"], CREATED, tag_obj)
     return tag_obj
 
 @router.delete("/{tag_id}", summary="删除标签")
-def delete_tag(tag_id: str):
-    data = load_tags()
-    tags = data["tags"]
-    new_tags = [t for t in tags if t["id"] != tag_id]
-    if len(tags) == len(new_tags):
+async def delete_tag(tag_id: str):
+    if not await storage.tags.delete(tag_id):
         raise HTTPException(status_code=404, detail="标签不存在")
-    data["tags"] = new_tags
-    save_tags(data)
+    await change_feed.record("tag", tag_id, DELETED)
     return {"ok": True}
 
 @router.put("/{tag_id}", summary="修改标签")
-def update_tag(tag_id: str, body: dict = Body(..., example={"tag": "新标签内容"})):
-    data = load_tags()
-    found = False
-    for t in data["tags"]:
-        if t["id"] == tag_id:
-            t["tag"] = body["tag"]
-            t["updated_at"] = now_iso()
-            found = True
-            break
-    if not found:
+async def update_tag(tag_id: str, body: dict = Body(..., example={"tag": "新标签内容"})):
+    t = await storage.tags.update(tag_id, {"tag": body["tag"], "updated_at": now_iso()})
+    if t is None:
         raise HTTPException(status_code=404, detail="标签不存在")
-    save_tags(data)
+    await change_feed.record("tag", tag_id, UPDATED, t)
     return t
 
 @router.get("/", summary="查询会话的所有标签")
-def list_tags(conversation_id: str = Query(...)):
-    data = load_tags()
-    tags = [t for t in data["tags"] if t["conversation_id"] == conversation_id]
+async def list_tags(request: Request, response: Response, conversation_id: str = Query(...)):
+    not_modified = await tags_etag(request, response, conversation_id)
+    if not_modified is not None:
+        return not_modified
+    tags = await storage.tags.list_by_conversation(conversation_id)
     return {"tags": tags}
 
 @router.get("/all", summary="查询所有标签")
-def list_all_tags():
-    data = load_tags()
-    return data
+async def list_all_tags(request: Request, response: Response):
+    not_modified = await tags_etag(request, response)
+    if not_modified is not None:
+        return not_modified
+    return {"tags": await storage.tags.list_all()}
+
+@router.get("/conversations", summary="查询带有某标签的会话")
+async def list_tag_conversations(request: Request, response: Response, tag: str = Query(...)):
+    not_modified = await tags_etag(request, response, tag)
+    if not_modified is not None:
+        return not_modified
+    return {"tag": tag, "conversation_ids": await storage.tags.list_conversations(tag)}
+
+@router.get("/counts", summary="各标签的会话数")
+async def tag_counts(request: Request, response: Response):
+    not_modified = await tags_etag(request, response)
+    if not_modified is not None:
+        return not_modified
+    counts = await storage.tags.counts()
+    return {"counts": [{"tag": t, "count": n} for t, n in sorted(counts.items(), key=lambda x: -x[1])]}
@@ -0,0 +1,30 @@
+import sys
+import os
+import atexit
+import asyncio
+import shutil
+import tempfile
+
+import pytest
+
+# 默认数据目录与日志目录指向临时目录，须在导入配置之前设置：
+# 各模块导入时即按配置创建全局 storage 与日志文件，测试不会写入工作区的 data/、logs/
+_tmp_root = tempfile.mkdtemp(prefix="self_agent_tests_")
+os.environ.setdefault("DATA_PATH", os.path.join(_tmp_root, "data"))
+os.environ.setdefault("LOG_PATH", os.path.join(_tmp_root, "logs"))
+atexit.register(shutil.rmtree, _tmp_root, ignore_errors=True)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage import create_storage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def storage(request, tmp_path):
+    """两种存储后端各运行一遍；需要替换模块中全局 storage 的测试文件用同名 fixture 覆盖并在其中 monkeypatch"""
+    s = create_storage(request.param, data_dir=tmp_path / "data", sqlite_path=tmp_path / "test.db")
+    yield s
+    run(s.close())
@@ -0,0 +1,146 @@
+import sys
+import os
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.errors import register_exception_handlers
+from modules.admission import (AdmissionController, AdmissionRejected, ModelLimits, TokenBucket,
+                               PRIORITY_BACKGROUND)
+from modules.llm import LLMEngine
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refill_and_debt():
+    clock = FakeClock()
+    bucket = TokenBucket(600, clock)  # 每秒补充 10
+    assert bucket.wait_time(400) == 0
+    bucket.consume(400)
+    assert bucket.wait_time(400) == pytest.approx(20.0)
+    clock.now = 20.0
+    assert bucket.wait_time(400) == 0
+    # 实际用量超出预扣时透支，之后需更久才能放行
+    bucket.consume(900)
+    assert bucket.level == pytest.approx(-500)
+    # 超过容量的请求在桶满时放行
+    assert bucket.wait_time(10000) == pytest.approx(110.0)
+
+
+def test_fair_order_and_priority():
+    controller = AdmissionController(default=ModelLimits(max_concurrency=1), queue_timeout=None)
+    order = []
+
+    async def call(name, conversation_id, priority=0):
+        async with controller.slot("m", conversation_id=conversation_id, priority=priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        tasks = [asyncio.create_task(call("a1", "a"))]
+        await asyncio.sleep(0)
+        for name, cid, priority in [("a2", "a", 0), ("a3", "a", 0), ("bg", "c", PRIORITY_BACKGROUND), ("b1", "b", 0)]:
+            tasks.append(asyncio.create_task(call(name, cid, priority)))
+            await asyncio.sleep(0)
+        stats = controller.snapshot()["m"]
+        assert stats["in_flight"] == 1 and stats["queued"] == 4
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    # 会话之间轮转，后台优先级最后
+    assert order == ["a1", "a2", "b1", "a3", "bg"]
+    stats = controller.snapshot()["m"]
+    assert stats["admitted"] == 5 and stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["wait_seconds_max"] > 0 and sum(stats["wait_buckets"].values()) == 5
+
+
+def test_queue_full_and_timeout_rejected():
+    controller = AdmissionController(default=ModelLimits(max_concurrency=1), max_queue=1, queue_timeout=0.05)
+
+    async def hold(seconds):
+        async with controller.slot("m"):
+            await asyncio.sleep(seconds)
+
+    async def scenario():
+        holder = asyncio.create_task(hold(0.2))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(0))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await hold(0)
+        with pytest.raises(AdmissionRejected) as timeout:
+            await waiter
+        await holder
+        return full.value, timeout.value
+
+    full, timeout = asyncio.run(scenario())
+    assert full.reason == "queue_full" and full.code == 429001
+    assert full.headers["Retry-After"] == str(full.retry_after) and full.retry_after >= 1
+    assert timeout.reason == "queue_timeout"
+    stats = controller.snapshot()["m"]
+    assert stats["rejected"] == 2 and stats["timeouts"] == 1 and stats["queued"] == 0
+
+
+def test_tpm_budget_delays_admission():
+    controller = AdmissionController(default=ModelLimits(max_concurrency=4, tpm=600), queue_timeout=None)
+
+    async def scenario():
+        async with controller.slot("m", tokens=590) as ticket:
+            # 实际用量低于预扣，退还差额
+            ticket.actual_tokens = 300
+        limiter = controller.limiter("m")
+        assert limiter.tpm.level == pytest.approx(300, abs=1)
+        # 剩余预算不足 400，需等待约 10 秒补充，超时取消后不占用名额
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(controller.slot("m", tokens=400).__aenter__(), 0.05)
+        assert limiter.queued == 0 and limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_engine_respects_concurrency_cap():
+    controller = AdmissionController(default=ModelLimits(max_concurrency=2), queue_timeout=None)
+    engine = LLMEngine(engine="fake", fake_options={"reply": "ok", "first_token_delay": 0.05}, admission=controller)
+    peak = 0
+
+    async def watch():
+        nonlocal peak
+        while True:
+            peak = max(peak, controller.limiter("gpt-4.1").in_flight)
+            await asyncio.sleep(0.005)
+
+    async def scenario():
+        watcher = asyncio.create_task(watch())
+        replies = await asyncio.gather(*(
+            engine.chat([{"role": "user", "content": "hi"}], conversation_id=f"c{i}") for i in range(5)
+        ))
+        tokens = [t async for t in engine.stream([{"role": "user", "content": "hi"}], conversation_id="s")]
+        watcher.cancel()
+        return replies, tokens
+
+    replies, tokens = asyncio.run(scenario())
+    assert replies == ["ok"] * 5 and "".join(tokens) == "ok"
+    assert peak == 2
+    assert controller.snapshot()["gpt-4.1"]["admitted"] == 6
+
+
+def test_rejection_returns_429_with_retry_after():
+    app = FastAPI()
+    register_exception_handlers(app)
+
+    @app.get("/busy")
+    async def busy():
+        raise AdmissionRejected("gpt-4.1", "queue_full", 2.5)
+
+    resp = TestClient(app).get("/busy")
+    assert resp.status_code == 429
+    assert resp.headers["retry-after"] == "3"
+    assert resp.json()["code"] == 429001 and resp.json()["details"]["reason"] == "queue_full"
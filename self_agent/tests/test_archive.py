@@ -0,0 +1,96 @@
+import sys
+import os
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage import create_storage
+from core.storage.archive import archive_idle, storage_report
+from tests.conftest import run
+
+NOW = datetime(2025, 6, 1)
+
+
+def meta(cid, updated_at):
+    return {"conversation_id": cid, "name": cid, "created_at": "2024-01-01T00:00:00Z", "updated_at": updated_at}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = create_storage("file", data_dir=tmp_path)
+    repo = s.conversations
+
+    async def seed():
+        for i in range(3):
+            await repo.append("old", [{"role": "user", "content": f"旧消息{i}" * 20}], meta=meta("old", "2025-01-01T00:00:00Z"))
+        await repo.append("new", [{"role": "user", "content": "新消息"}], meta=meta("new", "2025-05-30T00:00:00Z"))
+
+    run(seed())
+    return s
+
+
+def test_archive_and_transparent_rehydrate(storage, tmp_path):
+    repo = storage.conversations
+    before, after = run(repo.store.archive("old"))
+    assert after < before
+    log = repo.store.log_path("old")
+    assert not log.exists() and not log.with_suffix(".idx").exists()
+    assert repo.store.cold_path("old").name == "old.jsonl.gz"
+    assert repo.store.is_archived("old") and run(repo.exists("old"))
+
+    # 元数据仍在热索引中，列表照常显示
+    items, total = run(repo.list_page(0, 10))
+    assert total == 2 and {i["conversation_id"] for i in items} == {"old", "new"}
+    # 索引重建时直接读取冷文件，不解压回热目录
+    assert run(repo.rebuild_index()) == 2
+    assert repo.store.is_archived("old")
+
+    # 分页读取时解压回热日志，偏移索引随之重建
+    meta_obj, page, count = run(repo.load_page("old", 0, 2, reverse=True))
+    assert count == 3 and page[-1]["content"] == "旧消息2" * 20
+    assert meta_obj["name"] == "old"
+    assert log.exists() and repo.store.cold_path("old") is None
+
+    # 再次归档后直接追加
+    run(repo.store.archive("old"))
+    run(repo.append("old", [{"role": "user", "content": "回来了"}], meta=meta("old", "2025-06-01T00:00:00Z"),
+                    expected_revision=3))
+    conv = run(repo.load("old"))
+    assert [m["content"] for m in conv["messages"]][-1] == "回来了"
+    assert conv["revision"] == 4
+
+
+def test_delete_archived_conversation(storage, tmp_path):
+    repo = storage.conversations
+    run(repo.store.archive("old"))
+    assert run(repo.delete("old")) is True
+    assert not run(repo.exists("old"))
+    assert not [p for p in (tmp_path / "cold").rglob("*") if p.is_file()]
+
+
+def test_report_and_archive_idle(storage):
+    repo = storage.conversations
+    report = storage_report(repo, archive_after_days=30, now=NOW)
+    assert report["hot"]["conversations"] == 2 and report["cold"]["conversations"] == 0
+    assert report["age"][">=90d"]["conversations"] == 1 and report["age"]["<7d"]["conversations"] == 1
+    assert report["archivable"]["conversations"] == 1
+
+    dry = run(archive_idle(repo, 30, dry_run=True, now=NOW))
+    assert dry["conversations"] == 1 and not repo.store.is_archived("old")
+
+    result = run(archive_idle(repo, 30, now=NOW))
+    assert result["conversations"] == 1 and result["bytes_after"] < result["bytes_before"]
+    report = storage_report(repo, archive_after_days=30, now=NOW)
+    assert report["cold"] == {"conversations": 1, "bytes": result["bytes_after"]}
+    assert report["archivable"]["conversations"] == 0
+    # 已归档的不会重复处理
+    assert run(archive_idle(repo, 30, now=NOW))["conversations"] == 0
+
+
+def test_zstd_archive(storage, tmp_path):
+    pytest.importorskip("zstandard")
+    repo = storage.conversations
+    run(repo.store.archive("old", "zstd"))
+    assert repo.store.cold_path("old").name == "old.jsonl.zst"
+    assert len(run(repo.load("old"))["messages"]) == 3
@@ -0,0 +1,88 @@
+import sys
+import os
+import json
+import time
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation
+from core.storage import create_storage
+
+# 各模型的模拟耗时
+DELAYS = {"gpt-4.1": 0.3, "o4-mini": 0.1}
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    s = create_storage("file", data_dir=tmp_path)
+    monkeypatch.setattr(conversation, "storage", s)
+    return s
+
+
+@pytest.fixture
+def client(monkeypatch, storage):
+    async def fake_chat(messages, model="gpt-4.1", **kwargs):
+        if model == "broken":
+            raise RuntimeError("上游错误")
+        await asyncio.sleep(DELAYS[model])
+        return f"{model}: {messages[-1]['content']}"
+    monkeypatch.setattr(conversation.llm_engine, "chat", fake_chat)
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/modules/conversation")
+    with TestClient(app) as c:
+        yield c
+
+
+def parse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_batch_runs_targets_concurrently(client, storage):
+    start = time.perf_counter()
+    resp = client.post("/modules/conversation/batch", json={"content": "你好", "targets": [
+        {"conversation_id": "a", "model": "gpt-4.1"},
+        {"conversation_id": "b", "model": "o4-mini"},
+        {"conversation_id": "c", "model": "broken"},
+        {"model": "o4-mini", "content": "另一个问题"},
+    ]})
+    elapsed = time.perf_counter() - start
+    # 总耗时取决于最慢的模型，而不是各模型之和
+    assert elapsed < 0.3 + 0.1 + 0.05
+    results = resp.json()["data"]
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert results[0]["reply"] == "gpt-4.1: 你好"
+    assert results[1]["reply"] == "o4-mini: 你好"
+    assert results[2]["error"] == "上游错误" and "reply" not in results[2]
+    assert results[3]["reply"] == "o4-mini: 另一个问题" and results[3]["conversation_id"]
+
+    # 回复先返回，保存由后台流水线完成
+    client.portal.call(conversation.turn_pipeline.wait)
+    conv = asyncio.run(storage.conversations.load("a"))
+    assert [m["content"] for m in conv["messages"]] == ["你好", "gpt-4.1: 你好"]
+    assert conv["config"]["model"] == "gpt-4.1" and conv["revision"] == 1
+    # 失败的目标不保存
+    assert asyncio.run(storage.conversations.load("c")) is None
+
+
+def test_batch_stream_in_completion_order(client):
+    with client.stream("POST", "/modules/conversation/batch/stream", json={"content": "hi", "targets": [
+        {"conversation_id": "a", "model": "gpt-4.1"},
+        {"conversation_id": "b", "model": "o4-mini"},
+    ]}) as resp:
+        events = parse_events(resp.read().decode("utf-8"))
+    assert [(e, d.get("index")) for e, d in events] == [("result", 1), ("result", 0), ("done", None)]
+    assert events[-1][1] == {"count": 2, "errors": 0}
+
+
+def test_batch_validation(client):
+    assert client.post("/modules/conversation/batch", json={"content": "hi"}).json()["data"]["error"]
+    assert client.post("/modules/conversation/batch", json={"targets": [{"conversation_id": "a"}]}).json()["data"]["error"]
+    too_many = [{"conversation_id": str(i)} for i in range(conversation.settings.BATCH_MAX_TARGETS + 1)]
+    assert client.post("/modules/conversation/batch", json={"content": "hi", "targets": too_many}).json()["data"]["error"]
@@ -0,0 +1,61 @@
+import sys
+import os
+import asyncio
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation, folders, tags, search
+from modules.llm import LLMEngine
+from modules.search import SearchIndex
+from core.storage import create_storage
+from bench.dataset import generate
+from bench.runner import percentile, summarize, run_benchmark, compare
+
+
+def test_percentile_and_summary():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 99) == 0.099
+    assert percentile([], 50) == 0.0
+    result = summarize(values, errors=2, elapsed=2.0, peak_rss=50 * 1024 * 1024)
+    assert result["requests"] == 100 and result["errors"] == 2
+    assert result["rps"] == 50.0
+    assert result["p95_ms"] == 95.0 and result["max_ms"] == 100.0
+    assert result["peak_rss_mb"] == 50.0
+
+
+def test_run_small_benchmark(monkeypatch, tmp_path):
+    store = create_storage("file", data_dir=tmp_path / "data")
+    idx = SearchIndex(tmp_path / "search.db")
+    for module in (conversation, folders, tags, search):
+        monkeypatch.setattr(module, "storage", store)
+    monkeypatch.setattr(conversation, "search_index", idx)
+    monkeypatch.setattr(search, "search_index", idx)
+    monkeypatch.setattr(conversation, "llm_engine", LLMEngine(engine="fake", fake_options={"reply": "好的"}))
+
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/api/v1/conversations")
+    app.include_router(folders.router, prefix="/api/v1/folders")
+    app.include_router(tags.router)
+    app.include_router(search.router, prefix="/api/v1/search")
+
+    async def scenario():
+        dataset = await generate(store, idx, conversations=3, messages=4, words_per_message=5)
+        assert dataset.conversation_ids == ["bench-000000", "bench-000001", "bench-000002"]
+        names = ["get_conversation", "search", "tag_conversations", "send_message", "add_tag"]
+        results = await run_benchmark(app, dataset, requests=6, concurrency=2, scenarios=names)
+        await conversation.turn_pipeline.wait()
+        loaded = [await store.conversations.load(cid) for cid in dataset.conversation_ids]
+        await store.close()
+        return results, loaded
+
+    results, loaded = asyncio.run(scenario())
+    idx.close()
+    # 只读场景先于写入场景执行
+    assert list(results) == ["get_conversation", "search", "tag_conversations", "send_message", "add_tag"]
+    for r in results.values():
+        assert r["requests"] == 6 and r["errors"] == 0
+        assert r["p50_ms"] <= r["p99_ms"]
+    # 每次发送消息新增一问一答
+    assert sum(len(c["messages"]) for c in loaded) == 3 * 4 + 6 * 2
+    assert compare(results, results)[0].startswith("get_conversation: rps")
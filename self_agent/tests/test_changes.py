@@ -0,0 +1,139 @@
+import sys
+import os
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import changes, conversation, folders, tags
+from modules.changes import ChangeFeed
+from modules.pipeline import TurnPipeline
+from core.storage import create_storage
+
+
+@pytest.fixture
+def feed(tmp_path, monkeypatch):
+    s = create_storage("file", data_dir=tmp_path / "data")
+    feed = ChangeFeed(tmp_path / "changes.db")
+    for module in (conversation, folders, tags):
+        monkeypatch.setattr(module, "storage", s)
+    for module in (changes, conversation, folders, tags):
+        monkeypatch.setattr(module, "change_feed", feed)
+    monkeypatch.setattr(conversation, "turn_pipeline", TurnPipeline(conversation.save_turn, conversation.load_conversation))
+
+    async def fake_chat(messages, **kwargs):
+        return f"回复{len(messages)}"
+    monkeypatch.setattr(conversation.llm_engine, "chat", fake_chat)
+    yield feed
+    feed.close()
+    asyncio.run(s.close())
+
+
+def make_client():
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/conv")
+    app.include_router(folders.router, prefix="/folders")
+    app.include_router(tags.router)
+    app.include_router(changes.router, prefix="/changes")
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def sync(client, cursor):
+    return (await client.get("/changes/", params={"cursor": cursor})).json()["data"]
+
+
+def test_change_feed(feed):
+    async def scenario():
+        async with make_client() as client:
+            await client.post("/conv/c1/messages", json={"content": "一"})
+            await client.post("/conv/c2/messages", json={"content": "二"})
+            # 会话变更在后台保存完成时记录
+            await conversation.turn_pipeline.wait()
+            folder = (await client.post("/folders/", json={"name": "工作"})).json()["data"]
+            tag = (await client.post("/api/v1/conversation_tags/", json={"conversation_id": "c1", "tag": "x"})).json()
+
+            full = await sync(client, 0)
+            assert [(c["type"], c["id"], c["action"]) for c in full["changes"]] == [
+                ("conversation", "c1", "created"), ("conversation", "c2", "created"),
+                ("folder", folder["folder_id"], "created"), ("tag", tag["id"], "created"),
+            ]
+            assert full["changes"][0]["data"]["message_count"] == 2 and full["reset"] is False
+            cursor = full["cursor"]
+            assert await sync(client, cursor) == {"changes": [], "cursor": cursor, "has_more": False, "reset": False}
+
+            await client.post("/conv/c1/messages", json={"content": "三"})
+            await conversation.turn_pipeline.wait()
+            await client.post(f"/folders/{folder['folder_id']}/add", json={"conversation_id": "c1"})
+            await client.delete("/conv/c2")
+            delta = await sync(client, cursor)
+            assert [(c["id"], c["action"]) for c in delta["changes"]] == [
+                ("c1", "updated"), (folder["folder_id"], "updated"), ("c2", "deleted")]
+            assert delta["changes"][0]["data"]["message_count"] == 4
+            assert delta["changes"][1]["data"]["conversation_ids"] == ["c1"]
+            assert delta["changes"][2]["data"] is None
+
+            # 同一对象只保留最新一条，全量同步的条数与对象数相同
+            assert len((await sync(client, 0))["changes"]) == 4
+            # 分页
+            page = (await client.get("/changes/", params={"cursor": 0, "limit": 3})).json()["data"]
+            assert len(page["changes"]) == 3 and page["has_more"] is True
+            assert len((await sync(client, page["cursor"]))["changes"]) == 1
+            # 游标超出（变更库被重建）时从头同步并提示重置
+            reset = await sync(client, delta["cursor"] + 100)
+            assert reset["reset"] is True and len(reset["changes"]) == 4
+
+    asyncio.run(scenario())
+
+
+def test_message_cursor(feed):
+    async def scenario():
+        async with make_client() as client:
+            first = (await client.post("/conv/c/messages", json={"content": "一"})).json()["data"]
+            assert [m["seq"] for m in first["messages"]] == [0, 1] and first["cursor"] == 2
+            # 带上已有的消息数，只返回本轮新增的两条
+            second = (await client.post("/conv/c/messages", json={"content": "二", "cursor": 2})).json()["data"]
+            assert [(m["seq"], m["role"]) for m in second["messages"]] == [(2, "user"), (3, "assistant")]
+            assert second["cursor"] == 4
+
+            delta = (await client.get("/conv/c/messages", params={"cursor": 1, "limit": 2})).json()["data"]
+            assert [m["seq"] for m in delta["messages"]] == [1, 2]
+            assert delta["cursor"] == 3 and delta["has_more"] is True and delta["total"] == 4
+            await conversation.turn_pipeline.wait()
+            done = (await client.get("/conv/c/messages", params={"cursor": 4})).json()["data"]
+            assert done["messages"] == [] and done["cursor"] == 4 and done["has_more"] is False
+            assert done["meta"]["revision"] == 2
+
+            page = (await client.get("/conv/c", params={"size": 3, "reverse": True})).json()["data"]
+            assert [m["seq"] for m in page["messages"]] == [1, 2, 3]
+            missing = (await client.get("/conv/none/messages")).json()["data"]
+            assert missing == {"error": "会话不存在"}
+
+    asyncio.run(scenario())
+
+
+def test_change_recorded_before_background_save(feed, monkeypatch):
+    async def slow_save(conversation_id, conv_obj, new_messages):
+        await pipeline.gate.wait()
+        return await conversation.save_turn(conversation_id, conv_obj, new_messages)
+
+    pipeline = TurnPipeline(slow_save, conversation.load_conversation)
+    monkeypatch.setattr(conversation, "turn_pipeline", pipeline)
+
+    async def scenario():
+        pipeline.gate = asyncio.Event()
+        async with make_client() as client:
+            await client.post("/conv/c/messages", json={"content": "一"})
+            # 保存被阻塞时变更已可见，同步接口不等待后台队列
+            pending = await sync(client, 0)
+            assert [(c["id"], c["action"]) for c in pending["changes"]] == [("c", "created")]
+            assert pending["changes"][0]["data"]["message_count"] == 2
+            assert pending["changes"][0]["data"]["revision"] == 1
+            pipeline.gate.set()
+            await pipeline.wait()
+            saved = await sync(client, pending["cursor"])
+            assert [(c["id"], c["action"]) for c in saved["changes"]] == [("c", "created")]
+            assert saved["changes"][0]["data"]["revision"] == 1
+
+    asyncio.run(scenario())
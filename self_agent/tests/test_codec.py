@@ -0,0 +1,108 @@
+import sys
+import os
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage.codec import decode_document, detect_format, dumps_json, encode_line, get_codec, loads_json, read_document
+from core.storage.conv_log import ConversationLogStore
+from core.storage.file_backend import FileStorage
+from core.storage.migrate import convert_format
+import manage
+from tests.conftest import run
+
+
+def test_compact_json():
+    data = {"name": "会话", "n": [1, 2]}
+    encoded = dumps_json(data)
+    assert b" " not in encoded
+    assert loads_json(encoded) == data
+    assert encode_line(data).endswith(b"\n")
+    # 标准库 json 写出的旧文件照常读取
+    assert decode_document(json.dumps(data, indent=2).encode("utf-8")) == data
+
+
+def test_detect_format(tmp_path):
+    assert detect_format(b'{"a": 1}') == "json"
+    assert detect_format(b"  [1]") == "json"
+    assert read_document(tmp_path / "missing.json") is None
+    (tmp_path / "empty.json").write_bytes(b"")
+    assert read_document(tmp_path / "empty.json") is None
+    with pytest.raises(ValueError):
+        get_codec("xml")
+
+
+def test_msgpack_round_trip(tmp_path):
+    pytest.importorskip("msgpack")
+    codec = get_codec("msgpack")
+    data = {"tags": [{"id": "t1", "tag": "工作"}]}
+    encoded = codec.dumps(data)
+    assert detect_format(encoded) == "msgpack"
+    (tmp_path / "tags.json").write_bytes(encoded)
+    assert read_document(tmp_path / "tags.json") == data
+
+
+def test_file_storage_reads_legacy_indented_json(tmp_path):
+    folders = [{"folder_id": "f1", "name": "收藏", "conversation_ids": ["c1"]}]
+    (tmp_path / "folders.json").write_text(json.dumps(folders, ensure_ascii=False, indent=2), encoding="utf-8")
+    (tmp_path / "tags.json").write_text(json.dumps({"tags": [{"id": "t1", "conversation_id": "c1", "tag": "x"}]}, indent=2), encoding="utf-8")
+
+    async def scenario():
+        storage = FileStorage(tmp_path, flush_delay=0)
+        try:
+            folder = await storage.folders.get("f1")
+            tags = await storage.tags.list_all()
+            await storage.folders.save({**folder, "name": "改名"})
+        finally:
+            await storage.close()
+        return folder, tags
+
+    folder, tags = run(scenario())
+    assert folder["conversation_ids"] == ["c1"]
+    assert tags[0]["tag"] == "x"
+    # 写回为紧凑 JSON
+    content = (tmp_path / "folders.json").read_bytes()
+    assert b"\n" not in content and loads_json(content)[0]["name"] == "改名"
+
+
+def test_convert_format(tmp_path, capsys):
+    legacy = {"conversation_id": "old", "name": "旧会话", "messages": [{"role": "user", "content": "你好"}]}
+    (tmp_path / "old.json").write_text(json.dumps(legacy, ensure_ascii=False, indent=2), encoding="utf-8")
+    (tmp_path / "tags.json").write_text(json.dumps({"tags": [{"id": "t1", "conversation_id": "old", "tag": "x"}]}, indent=2), encoding="utf-8")
+
+    async def seed():
+        storage = FileStorage(tmp_path, flush_delay=0)
+        meta = {"conversation_id": "c1", "name": "n", "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00"}
+        for i in range(3):
+            await storage.conversations.append("c1", [{"role": "user", "content": str(i)}], meta={**meta, "name": f"n{i}"})
+        await storage.close()
+
+    run(seed())
+    log = ConversationLogStore(tmp_path).log_path("c1")
+    before = log.read_bytes().count(b"\n")
+
+    manage.main(["convert-format", "--to", "json", "--data-dir", str(tmp_path)])
+    out = capsys.readouterr().out
+    assert "会话 2 个" in out
+
+    assert not (tmp_path / "old.json").exists()
+    # 三条元数据快照压缩为一条
+    assert log.read_bytes().count(b"\n") == before - 2
+    assert b"\n" not in (tmp_path / "tags.json").read_bytes()
+
+    async def check():
+        storage = FileStorage(tmp_path)
+        try:
+            items, total = await storage.conversations.list_page(0, 10)
+            page = await storage.conversations.load_page("c1", 0, 10)
+            return total, page
+        finally:
+            await storage.close()
+
+    total, page = run(check())
+    assert total == 2
+    assert page[0]["name"] == "n2" and [m["content"] for m in page[1]] == ["0", "1", "2"]
+
+    counts = run(convert_format(tmp_path, "json"))
+    assert counts["conversations"] == 2 and counts["documents"] == 1
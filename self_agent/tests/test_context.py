@@ -0,0 +1,36 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules.context import build_context, estimate_tokens, MESSAGE_OVERHEAD
+
+
+def msg(role, content, tokens=10, **kwargs):
+    return {"role": role, "content": content, "tokens": tokens, **kwargs}
+
+
+def test_recent_messages_fill_budget():
+    history = [msg("user", str(i)) for i in range(10)]
+    per = 10 + MESSAGE_OVERHEAD
+    pack = build_context(history, budget=per * 3)
+    assert [m["content"] for m in pack.messages] == ["7", "8", "9"]
+    assert pack.tokens == per * 3
+    assert pack.meta() == {"tokens": per * 3, "messages": 3, "dropped": 7, "budget": per * 3}
+
+
+def test_system_and_pinned_always_included():
+    history = [msg("system", "sys")] + [msg("user", str(i)) for i in range(1, 10)]
+    history[2]["pinned"] = True
+    per = 10 + MESSAGE_OVERHEAD
+    pack = build_context(history, budget=per * 5, pinned=[4])
+    assert [m["content"] for m in pack.messages] == ["sys", "2", "4", "8", "9"]
+
+
+def test_latest_input_kept_even_over_budget():
+    pack = build_context([msg("user", "old"), msg("user", "new", tokens=1000)], budget=10)
+    assert [m["content"] for m in pack.messages] == ["new"]
+
+
+def test_estimate_tokens_cjk():
+    assert estimate_tokens("你好世界") == 4
+    assert estimate_tokens("abcdefgh") == 2
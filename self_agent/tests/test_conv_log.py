@@ -0,0 +1,84 @@
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage.conv_log import ConversationLogStore
+from tests.conftest import run
+
+
+def test_append_and_load(tmp_path):
+    store = ConversationLogStore(tmp_path)
+    meta = {"conversation_id": "c1", "name": "n", "config": {"model": "gpt-4.1"}}
+    run(store.append("c1", [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}], meta=meta))
+    run(store.append("c1", [{"role": "user", "content": "c"}], meta={**meta, "name": "n2"}))
+    conv = run(store.load("c1"))
+    assert conv["name"] == "n2"
+    assert [m["content"] for m in conv["messages"]] == ["a", "b", "c"]
+    # 只追加，不重写：共 3 条消息 + 2 条元数据
+    assert len(store.log_path("c1").read_text(encoding="utf-8").splitlines()) == 5
+
+
+def test_lazy_migration(tmp_path):
+    legacy = {"conversation_id": "old", "name": "旧会话", "messages": [{"role": "user", "content": "你好"}]}
+    (tmp_path / "old.json").write_text(json.dumps(legacy, ensure_ascii=False), encoding="utf-8")
+    store = ConversationLogStore(tmp_path)
+    assert store.conversation_ids() == ["old"]
+    conv = run(store.load("old"))
+    assert conv["name"] == "旧会话"
+    assert conv["messages"][0]["content"] == "你好"
+    assert not (tmp_path / "old.json").exists()
+    assert store.log_path("old").exists()
+
+
+def test_meta_compaction_and_torn_line(tmp_path):
+    store = ConversationLogStore(tmp_path, meta_compact_threshold=3)
+    run(store.append("c", [{"role": "user", "content": "x"}], meta={"name": "0"}))
+    run(store.load("c"))
+    for i in range(1, 4):
+        run(store.write_meta("c", {"name": str(i)}))
+    lines = store.log_path("c").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    # 模拟中断留下的半行
+    with open(store.log_path("c"), "a", encoding="utf-8") as f:
+        f.write('{"type": "msg", "da')
+    run(store.append("c", [{"role": "user", "content": "y"}]))
+    conv = run(store.load("c"))
+    assert conv["name"] == "3"
+    assert [m["content"] for m in conv["messages"]] == ["x", "y"]
+
+
+def test_read_page_uses_offset_index(tmp_path):
+    store = ConversationLogStore(tmp_path)
+    meta = {"conversation_id": "p", "name": "分页"}
+    run(store.append("p", [{"role": "user", "content": str(i)} for i in range(10)], meta=meta))
+
+    meta_read, page, total = run(store.read_page("p", 2, 3))
+    assert meta_read["name"] == "分页"
+    assert [m["content"] for m in page] == ["2", "3", "4"]
+    assert total == 10
+    # 最后 N 条 / 反向分页
+    assert [m["content"] for m in run(store.read_page("p", 0, 3, reverse=True))[1]] == ["7", "8", "9"]
+    assert [m["content"] for m in run(store.read_page("p", 9, 3, reverse=True))[1]] == ["0"]
+    assert run(store.read_page("p", 20, 3))[1] == []
+
+    # 索引建立后的追加只补扫新增部分，元数据取最新一条
+    run(store.append("p", [{"role": "assistant", "content": "十"}], meta={**meta, "name": "新"}))
+    meta_read, page, total = run(store.read_page("p", 0, 2, reverse=True))
+    assert meta_read["name"] == "新"
+    assert [m["content"] for m in page] == ["9", "十"]
+    assert total == 11
+
+    # 未写完的尾行不计入，写完后可读
+    with open(store.log_path("p"), "a", encoding="utf-8") as f:
+        f.write('{"type": "msg", "data": {"role": "user", "con')
+    assert run(store.read_page("p", 0, 1, reverse=True))[2] == 11
+    run(store.append("p", [{"role": "user", "content": "尾"}]))
+    assert [m["content"] for m in run(store.read_page("p", 0, 1, reverse=True))[1]] == ["尾"]
+
+    # 整体重写（压缩）后索引同步更新
+    run(store.compact("p"))
+    _, page, total = run(store.read_page("p", 10, 5))
+    assert [m["content"] for m in page] == ["十", "尾"]
+    assert total == 12
+    assert run(store.read_page("missing", 0, 5)) is None
@@ -28,7 +28,7 @@ def fake_jwt_auth():
     return {"user_id": "test_user"}
 
 # mock llm_engine.chat
-async def fake_llm_chat(messages):
+async def fake_llm_chat(messages, **kwargs):
     return "这是AI的回复"
 
 # patch 依赖
@@ -0,0 +1,96 @@
+import sys
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation, folders, tags
+from modules.pipeline import TurnPipeline
+from tests.conftest import run
+
+
+@pytest.fixture
+def storage(storage, monkeypatch):
+    for module in (conversation, folders, tags):
+        monkeypatch.setattr(module, "storage", storage)
+    monkeypatch.setattr(conversation, "turn_pipeline", TurnPipeline(conversation.save_turn, conversation.load_conversation))
+
+    async def fake_chat(messages, **kwargs):
+        return f"回复{len(messages)}"
+    monkeypatch.setattr(conversation.llm_engine, "chat", fake_chat)
+    return storage
+
+
+def make_app():
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/conv")
+    app.include_router(folders.router, prefix="/folders")
+    app.include_router(tags.router)
+    return app
+
+
+async def get(client, url, etag=None, **params):
+    headers = {"If-None-Match": etag} if etag else {}
+    return await client.get(url, params=params, headers=headers)
+
+
+def test_conversation_etag(storage):
+    async def scenario():
+        transport = httpx.ASGITransport(app=make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            assert "etag" not in (await get(client, "/conv/c")).headers
+
+            await client.post("/conv/c/messages", json={"content": "一"})
+            # 后台保存完成前（覆盖层）与完成后的 ETag 相同
+            first = await get(client, "/conv/c")
+            await conversation.turn_pipeline.wait()
+            etag = first.headers["etag"]
+            assert (await get(client, "/conv/c")).headers["etag"] == etag
+            assert first.headers["cache-control"] == "private, no-cache"
+
+            cached = await get(client, "/conv/c", etag)
+            assert cached.status_code == 304 and cached.content == b"" and cached.headers["etag"] == etag
+            assert (await get(client, "/conv/c", f'W/{etag}')).status_code == 304
+            # 分页参数不同，ETag 不同
+            assert (await get(client, "/conv/c", etag, size=1, reverse=True)).status_code == 200
+
+            await client.post("/conv/c/messages", json={"content": "二"})
+            changed = await get(client, "/conv/c", etag)
+            assert changed.status_code == 200 and changed.headers["etag"] != etag
+            assert changed.json()["data"]["meta"]["total"] == 4
+            await conversation.turn_pipeline.wait()
+
+    run(scenario())
+
+
+def test_folder_and_tag_etags(storage):
+    async def scenario():
+        await folders.ensure_default_folder()
+        transport = httpx.ASGITransport(app=make_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            etag = (await get(client, "/folders/")).headers["etag"]
+            assert (await get(client, "/folders/", etag)).status_code == 304
+            # 重复添加不改变内容，版本号不变
+            await client.post("/folders/default/add", json={"conversation_id": "a"})
+            version = await storage.folders.version()
+            await client.post("/folders/default/add", json={"conversation_id": "a"})
+            assert await storage.folders.version() == version
+            changed = await get(client, "/folders/", etag)
+            assert changed.status_code == 200 and changed.json()["data"][0]["conversation_ids"] == ["a"]
+
+            urls = ["/api/v1/conversation_tags/all", "/api/v1/conversation_tags/counts"]
+            etags = [(await get(client, url)).headers["etag"] for url in urls]
+            assert len(set(etags)) == 2
+            assert [(await get(client, u, e)).status_code for u, e in zip(urls, etags)] == [304, 304]
+            by_conv = (await get(client, "/api/v1/conversation_tags/", conversation_id="a")).headers["etag"]
+            assert (await get(client, "/api/v1/conversation_tags/", by_conv, conversation_id="b")).status_code == 200
+
+            tag = (await client.post("/api/v1/conversation_tags/", json={"conversation_id": "a", "tag": "工作"})).json()
+            assert [(await get(client, u, e)).status_code for u, e in zip(urls, etags)] == [200, 200]
+            etag = (await get(client, urls[0])).headers["etag"]
+            await client.delete(f"/api/v1/conversation_tags/{tag['id']}")
+            assert (await get(client, urls[0], etag)).json() == {"tags": []}
+
+    run(scenario())
@@ -0,0 +1,76 @@
+import sys
+import os
+import json
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import folders
+from core.storage.file_backend import FileFolderRepository
+
+
+@pytest.fixture
+def storage(storage, monkeypatch):
+    monkeypatch.setattr(folders, "storage", storage)
+    return storage
+
+
+@pytest.fixture
+def client(storage):
+    app = FastAPI()
+    app.include_router(folders.router, prefix="/api/v1/folders")
+    with TestClient(app) as c:
+        yield c
+
+
+def test_default_folder_and_membership(client, storage):
+    asyncio.run(folders.ensure_default_folder())
+    asyncio.run(folders.ensure_default_folder())
+    listed = client.get("/api/v1/folders/").json()["data"]
+    assert [f["folder_id"] for f in listed] == ["default"]
+
+    for cid in ["a", "b", "a", "c"]:
+        resp = client.post("/api/v1/folders/default/add", json={"conversation_id": cid})
+    assert resp.json()["data"]["conversation_ids"] == ["a", "b", "c"]
+    resp = client.post("/api/v1/folders/default/remove", json={"conversation_id": "b"})
+    assert resp.json()["data"]["conversation_ids"] == ["a", "c"]
+    assert client.post("/api/v1/folders/missing/add", json={"conversation_id": "a"}).status_code == 404
+
+    created = client.post("/api/v1/folders/", json={"name": "工作"}).json()["data"]
+    assert client.post("/api/v1/folders/", json={"name": "工作"}).status_code == 400
+    renamed = client.patch(f"/api/v1/folders/{created['folder_id']}", json={"name": "学习"}).json()["data"]
+    assert renamed["name"] == "学习"
+    assert client.delete("/api/v1/folders/default").status_code == 400
+    assert client.delete(f"/api/v1/folders/{created['folder_id']}").json()["data"]["success"] is True
+
+
+def test_file_folders_coalesce_writes(tmp_path, monkeypatch):
+    path = tmp_path / "folders.json"
+    repo = FileFolderRepository(path, flush_delay=0.05)
+    writes = []
+    original = repo._write
+
+    async def counting_write():
+        writes.append(1)
+        await original()
+    monkeypatch.setattr(repo._writer, "_write", counting_write)
+
+    async def scenario():
+        await repo.save({"folder_id": "f", "name": "收藏", "conversation_ids": [], "is_default": False})
+        for i in range(50):
+            await repo.add_conversation("f", f"c{i}", "t")
+        assert not path.exists()
+        await asyncio.sleep(0.2)
+        await repo.remove_conversation("f", "c0", "t2")
+        await repo.flush()
+
+    asyncio.run(scenario())
+    # 保存+50 次添加合并为一次写入，移除后 flush 再写一次
+    assert len(writes) == 2
+    saved = json.loads(path.read_text(encoding="utf-8"))
+    assert saved[0]["conversation_ids"] == [f"c{i}" for i in range(1, 50)]
+    assert saved[0]["updated_at"] == "t2"
+    reloaded = FileFolderRepository(path)
+    assert asyncio.run(reloaded.get("f"))["conversation_ids"] == saved[0]["conversation_ids"]
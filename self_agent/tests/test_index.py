@@ -0,0 +1,50 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage.index import ConversationIndex
+
+
+def make_conv(cid, created_at, messages=1):
+    return {
+        "conversation_id": cid,
+        "name": cid,
+        "summary": "",
+        "created_at": created_at,
+        "updated_at": created_at,
+        "messages": [{"role": "user", "content": "hi"}] * messages,
+        "config": {"model": "gpt-4.1"},
+    }
+
+
+def test_page_sorted_desc(tmp_path):
+    index = ConversationIndex(tmp_path / "index.jsonl")
+    for i in range(5):
+        index.upsert(make_conv(f"c{i}", f"2025-01-0{i + 1}T00:00:00Z"))
+    assert [e["conversation_id"] for e in index.page(0, 2)] == ["c4", "c3"]
+    assert [e["conversation_id"] for e in index.page(4, 2)] == ["c0"]
+    assert index.page(5, 2) == []
+    assert index.total == 5
+    assert index.get("c2")["message_count"] == 1
+    assert index.get("c2")["model"] == "gpt-4.1"
+
+
+def test_journal_replay_and_remove(tmp_path):
+    path = tmp_path / "index.jsonl"
+    index = ConversationIndex(path)
+    index.upsert(make_conv("a", "2025-01-01T00:00:00Z"))
+    index.upsert(make_conv("b", "2025-01-02T00:00:00Z"))
+    index.upsert(make_conv("a", "2025-01-01T00:00:00Z", messages=3))
+    index.remove("b")
+
+    reloaded = ConversationIndex(path)
+    assert reloaded.total == 1
+    assert reloaded.get("a")["message_count"] == 3
+    assert "b" not in reloaded
+
+
+def test_rebuild(tmp_path):
+    index = ConversationIndex(tmp_path / "index.jsonl")
+    index.upsert(make_conv("stale", "2025-01-01T00:00:00Z"))
+    index.rebuild([make_conv("x", "2025-02-01T00:00:00Z")])
+    assert [e["conversation_id"] for e in ConversationIndex(tmp_path / "index.jsonl").page(0, 10)] == ["x"]
@@ -0,0 +1,86 @@
+import sys
+import os
+import json
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage.codec import encode_line
+from core.storage.compression import get_compressor
+from core.storage.file_backend import FileStorage
+from core.storage.layout import shard, system_path
+import manage
+from tests.conftest import run
+
+
+def flat_log(cid, n):
+    meta = {"conversation_id": cid, "name": cid, "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+    lines = [encode_line({"type": "meta", "data": meta})]
+    lines += [encode_line({"type": "msg", "data": {"role": "user", "content": f"{cid}-{i}"}}) for i in range(n)]
+    return b"".join(lines)
+
+
+def test_sharded_paths(tmp_path):
+    storage = FileStorage(tmp_path, flush_delay=0)
+    repo = storage.conversations
+    meta = {"conversation_id": "c1", "name": "n", "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+    run(repo.append("c1", [{"role": "user", "content": "你好"}], meta=meta))
+    run(repo.load_page("c1", 0, 10))
+    run(storage.close())
+
+    assert len(shard("c1").parts) == 2 and all(len(p) == 2 for p in shard("c1").parts)
+    log = tmp_path / "conversations" / shard("c1") / "c1.jsonl"
+    assert repo.store.log_path("c1") == log and log.exists() and log.with_suffix(".idx").exists()
+    assert (tmp_path / "system" / "index.jsonl").exists()
+    # data 目录下只有分层的子目录
+    assert all(p.is_dir() for p in tmp_path.iterdir())
+    assert repo.store.conversation_ids() == ["c1"]
+
+
+def test_flat_layout_read_and_moved_on_access(tmp_path):
+    (tmp_path / "a.jsonl").write_bytes(flat_log("a", 3))
+    (tmp_path / "index.jsonl").write_bytes(b"")
+    (tmp_path / "tags.json").write_text(json.dumps({"tags": [{"id": "t1", "conversation_id": "a", "tag": "x"}]}), encoding="utf-8")
+
+    storage = FileStorage(tmp_path, flush_delay=0)
+    repo = storage.conversations
+    # 旧位置的系统文件继续使用，不会被当作会话
+    assert repo.index.journal_path == tmp_path / "index.jsonl"
+    assert repo.store.conversation_ids() == ["a"]
+    assert run(storage.tags.list_by_conversation("a"))[0]["tag"] == "x"
+    assert repo.store.read_sync("a")["messages"][-1]["content"] == "a-2"
+
+    _, page, total = run(repo.load_page("a", 0, 2))
+    assert total == 3 and [m["content"] for m in page] == ["a-0", "a-1"]
+    assert not (tmp_path / "a.jsonl").exists() and repo.store.log_path("a").exists()
+    run(storage.close())
+
+
+def test_migrate_layout_command(tmp_path, capsys):
+    (tmp_path / "a.jsonl").write_bytes(flat_log("a", 2))
+    (tmp_path / "a.idx").write_bytes(b"")
+    (tmp_path / "b.json").write_text(json.dumps({"conversation_id": "b", "name": "旧", "messages": [{"role": "user", "content": "hi"}]}),
+                                     encoding="utf-8")
+    (tmp_path / "cold").mkdir()
+    (tmp_path / "cold" / "c.jsonl.gz").write_bytes(get_compressor("gzip").compress(flat_log("c", 1)))
+    for name in ("folders.json", "index.jsonl", "search.db", "search.db-wal"):
+        (tmp_path / name).write_bytes(b"[]")
+
+    manage.main(["migrate-layout", "--data-dir", str(tmp_path)])
+    assert "系统文件 3 个，会话 2 个，冷文件 1 个" in capsys.readouterr().out
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cold", "conversations", "system"]
+    assert sorted(p.name for p in (tmp_path / "system").iterdir()) == ["folders.json", "index.jsonl", "search.db", "search.db-wal"]
+    assert system_path(tmp_path, "folders.json") == tmp_path / "system" / "folders.json"
+    assert (tmp_path / "cold" / shard("c") / "c.jsonl.gz").exists()
+
+    storage = FileStorage(tmp_path, flush_delay=0)
+    repo = storage.conversations
+    try:
+        assert repo.store.log_path("a").with_suffix(".idx").exists()
+        assert repo.store.conversation_ids() == ["a", "b", "c"]
+        assert run(repo.load("b"))["messages"][0]["content"] == "hi"
+        assert run(repo.load("c"))["messages"][0]["content"] == "c-0"
+    finally:
+        run(storage.close())
+
+    # 重复执行无事可做
+    manage.main(["migrate-layout", "--data-dir", str(tmp_path)])
+    assert "系统文件 0 个，会话 0 个，冷文件 0 个" in capsys.readouterr().out
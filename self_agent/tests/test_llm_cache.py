@@ -0,0 +1,85 @@
+import sys
+import os
+import asyncio
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules.llm import LLMEngine
+from modules.llm_cache import ResponseCache, cache_key
+
+
+def test_cache_key_ignores_extra_fields():
+    a = [{"role": "user", "content": "你好", "timestamp": "t1", "tokens": 2}]
+    b = [{"role": "user", "content": "你好", "timestamp": "t2"}]
+    assert cache_key("gpt-4.1", 0, a) == cache_key("gpt-4.1", 0, b)
+    assert cache_key("gpt-4.1", 0, a) != cache_key("gpt-4.1", 0.7, a)
+    assert cache_key("gpt-4.1", 0, a) != cache_key("o4-mini", 0, a)
+
+
+def test_lru_ttl_and_disk_tier(tmp_path):
+    db = tmp_path / "cache.db"
+
+    async def scenario():
+        cache = ResponseCache(memory_size=2, ttl=60, db_path=db)
+        for k in ("a", "b", "c"):
+            await cache.put(k, f"reply-{k}")
+        # a 被挤出内存层，从磁盘层取回
+        assert await cache.get("a") == "reply-a"
+        assert await cache.get("c") == "reply-c"
+        assert await cache.get("x") is None
+        assert cache.stats["disk_hits"] == 1
+        assert cache.stats["memory_hits"] == 1
+        assert cache.stats["misses"] == 1
+        cache.close()
+
+        # 重启后磁盘层仍然有效
+        reopened = ResponseCache(memory_size=2, ttl=60, db_path=db)
+        assert await reopened.get("b") == "reply-b"
+        reopened.close()
+
+        expired = ResponseCache(memory_size=2, ttl=-1, db_path=tmp_path / "expired.db")
+        await expired.put("k", "v")
+        assert await expired.get("k") is None
+        expired.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = LLMEngine(engine="fake", fake_options={"reply": "答案"}, cache=ResponseCache(memory_size=8))
+    calls = []
+    original = engine._get_llm
+
+    def counting(*args):
+        calls.append(args)
+        return original(*args)
+    monkeypatch.setattr(engine, "_get_llm", counting)
+    engine.calls = calls
+    return engine
+
+
+def test_engine_cache_policy(engine):
+    messages = [{"role": "user", "content": "1+1=?"}]
+
+    async def scenario():
+        # 温度为 0：默认使用缓存
+        assert await engine.chat(messages, temperature=0) == "答案"
+        assert await engine.chat(messages, temperature=0) == "答案"
+        assert len(engine.calls) == 1
+        # 非 0 温度默认不缓存
+        await engine.chat(messages)
+        await engine.chat(messages)
+        assert len(engine.calls) == 3
+        # 显式允许时缓存
+        await engine.chat(messages, cache=True)
+        await engine.chat(messages, cache=True)
+        assert len(engine.calls) == 4
+        # 显式绕过
+        await engine.chat(messages, temperature=0, cache=False)
+        assert len(engine.calls) == 5
+
+    asyncio.run(scenario())
+    stats = engine.cache.snapshot()
+    assert stats["memory_hits"] == 2
+    assert stats["bypassed"] == 1
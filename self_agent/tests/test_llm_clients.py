@@ -0,0 +1,36 @@
+import sys
+import os
+import asyncio
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules.llm import LLMClientRegistry
+
+
+class DummyLLM:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+def test_registry_reuses_and_evicts():
+    registry = LLMClientRegistry(max_size=2, factory=DummyLLM)
+    a = registry.get("gpt-4.1", 0.7, False)
+    assert registry.get("gpt-4.1", 0.7, False) is a
+    assert registry.get("gpt-4.1", 0.7, True) is not a
+    # o 系列模型温度固定为 1，不同温度命中同一实例
+    assert registry.get("o4-mini", 0.2) is registry.get("o4-mini", 0.9)
+    assert len(registry) == 2
+    # 最久未用的 gpt-4.1 非流式实例已被淘汰
+    assert registry.get("gpt-4.1", 0.7, False) is not a
+    # 所有实例共享同一 endpoint 的连接池
+    pools = {id(c.kwargs["http_async_client"]) for c in registry._clients.values()}
+    assert len(pools) == 1
+
+
+def test_registry_prewarm_and_close():
+    registry = LLMClientRegistry(max_size=8, factory=DummyLLM)
+    registry.prewarm(["gpt-4.1", "o4-mini"])
+    assert len(registry) == 4
+    http_async_client = next(iter(registry._clients.values())).kwargs["http_async_client"]
+    asyncio.run(registry.aclose())
+    assert len(registry) == 0
+    assert http_async_client.is_closed
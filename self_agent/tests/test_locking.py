@@ -0,0 +1,97 @@
+import sys
+import os
+import time
+import asyncio
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation
+from modules.llm import LLMEngine
+from core.storage.base import ConflictError
+from core.storage.locks import KeyedLocks
+
+
+@pytest.fixture
+def patched(monkeypatch, storage):
+    # 每次调用模型耗时约 0.1s
+    engine = LLMEngine(engine="fake", fake_options={"reply": "ok", "first_token_delay": 0.1})
+    monkeypatch.setattr(conversation, "storage", storage)
+    monkeypatch.setattr(conversation, "llm_engine", engine)
+    return storage
+
+
+def test_keyed_locks_fifo_and_cleanup():
+    locks = KeyedLocks()
+    order = []
+
+    async def worker(i):
+        async with locks.lock("c"):
+            order.append(i)
+            await asyncio.sleep(0)
+
+    async def scenario():
+        await asyncio.gather(*(worker(i) for i in range(5)))
+
+    asyncio.run(scenario())
+    assert order == list(range(5))
+    assert len(locks) == 0
+
+
+def test_same_conversation_sends_are_serialized(patched):
+    async def scenario():
+        await asyncio.gather(*(
+            conversation.send_message("c1", body={"content": f"q{i}"}) for i in range(4)
+        ))
+        await conversation.turn_pipeline.wait()
+        return await patched.conversations.load("c1")
+
+    conv = asyncio.run(scenario())
+    contents = [m["content"] for m in conv["messages"]]
+    # 每轮都基于上一轮的结果：按到达顺序交替出现，没有丢失
+    assert contents == ["q0", "ok", "q1", "ok", "q2", "ok", "q3", "ok"]
+    assert conv["revision"] == 4
+
+
+def test_different_conversations_run_in_parallel(patched):
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(*(
+            conversation.send_message(f"p{i}", body={"content": "hi"}) for i in range(4)
+        ))
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(scenario())
+    # 串行执行至少需要 0.4s
+    assert elapsed < 0.35
+
+
+def test_stale_revision_is_rejected(storage):
+    async def scenario():
+        repo = storage.conversations
+        rev = await repo.append("r1", [{"role": "user", "content": "a"}], meta={"name": "r1"})
+        assert rev == 1
+        assert await repo.append("r1", [{"role": "user", "content": "b"}], meta={"name": "r1"},
+                                 expected_revision=1) == 2
+        with pytest.raises(ConflictError):
+            await repo.write_meta("r1", {"name": "stale"}, expected_revision=1)
+        conv = await repo.load("r1")
+        assert conv["name"] == "r1"
+        assert conv["revision"] == 2
+        assert [m["content"] for m in conv["messages"]] == ["a", "b"]
+        assert (await repo.get_meta("r1"))["revision"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_persist_turn_rebases_on_conflict(patched):
+    async def scenario():
+        conv_obj, user_msg, _ = await conversation.prepare_turn("m1", "first")
+        # 读取之后另一个写入者抢先保存了一轮
+        other, other_msg, _ = await conversation.prepare_turn("m1", "other")
+        await conversation.persist_turn("m1", other, other_msg, "r0")
+        await conversation.persist_turn("m1", conv_obj, user_msg, "r1")
+        return conv_obj, await patched.conversations.load("m1")
+
+    conv_obj, conv = asyncio.run(scenario())
+    assert [m["content"] for m in conv["messages"]] == ["other", "r0", "first", "r1"]
+    assert conv["revision"] == conv_obj["revision"] == 2
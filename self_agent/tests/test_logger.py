@@ -0,0 +1,61 @@
+import sys
+import os
+import queue
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core import logger as log_module
+from core.config import settings
+from core.logger import brief, SamplingFilter, DroppingQueueHandler, DROPPED, SAMPLED
+
+
+def test_brief_modes(monkeypatch):
+    monkeypatch.setattr(settings, "LOG_BODY_MAX_CHARS", 5)
+    monkeypatch.setattr(settings, "LOG_BODY_MODE", "truncate")
+    assert brief("短文本") == "短文本"
+    assert brief("一二三四五六七") == "一二三四五…(共 7 字)"
+    monkeypatch.setattr(settings, "LOG_BODY_MODE", "hash")
+    assert brief("一二三四五六七").startswith("<7 字 sha256:")
+    assert brief("一二三四五六七") == brief("一二三四五六七") != brief("一二三四五六八")
+    monkeypatch.setattr(settings, "LOG_BODY_MODE", "full")
+    assert brief("一二三四五六七") == "一二三四五六七"
+
+
+def make_record(level, sampled):
+    record = logging.LogRecord("self_agent", level, __file__, 0, "msg", None, None)
+    if sampled:
+        record.sampled = True
+    return record
+
+
+def test_sampling_only_drops_sampled_info():
+    drop_all = SamplingFilter(0.0)
+    assert not drop_all.filter(make_record(logging.INFO, True))
+    assert drop_all.filter(make_record(logging.INFO, False))
+    assert drop_all.filter(make_record(logging.WARNING, True))
+    assert SamplingFilter(1.0).filter(make_record(logging.INFO, True))
+
+
+def test_full_queue_drops_without_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    before = DROPPED.value()
+    handler.handle(make_record(logging.INFO, False))
+    handler.handle(make_record(logging.INFO, False))
+    assert handler.queue.qsize() == 1
+    assert DROPPED.value() == before + 1
+
+
+def test_records_written_by_background_listener():
+    log_module.logger.info("后台写入测试-0417", extra=SAMPLED)
+    # 监听线程取出并写完所有记录后 join 返回
+    log_module.log_queue.join()
+    log_module.file_handler.flush()
+    with open(log_module.LOG_FILE, encoding="utf-8") as f:
+        assert "后台写入测试-0417" in f.read()
+    assert log_module.logger.level == logging.getLevelName(settings.LOG_LEVEL)
+
+
+def test_log_file_per_process():
+    assert log_module.log_file_path().endswith(os.path.join("logs", "app.log"))
+    assert log_module.log_file_path(True, pid=42).endswith(os.path.join("logs", "app.42.log"))
+    assert log_module.log_file_path(True) != log_module.log_file_path(True, pid=os.getpid() + 1)
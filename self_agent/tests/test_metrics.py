@@ -0,0 +1,74 @@
+import sys
+import os
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.metrics import Registry, Counter, Histogram, STORAGE_SECONDS
+from core.storage import create_storage
+from modules import metrics
+from modules.llm import LLMEngine, LLM_TTFT_SECONDS, LLM_COMPLETION_TOKENS, LLM_REQUEST_SECONDS
+
+
+def test_text_format():
+    registry = Registry()
+    counter = Counter("demo_total", "示例计数", ("kind",), registry=registry)
+    histogram = Histogram("demo_seconds", "示例耗时", ("op",), buckets=(0.1, 1.0), registry=registry)
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    histogram.observe(0.05, op="x")
+    histogram.observe(5, op="x")
+    text = registry.render()
+    assert '# TYPE demo_total counter\ndemo_total{kind="a\\"b"} 3\n' in text
+    assert 'demo_seconds_bucket{op="x",le="0.1"} 1\n' in text
+    assert 'demo_seconds_bucket{op="x",le="1"} 1\n' in text
+    assert 'demo_seconds_bucket{op="x",le="+Inf"} 2\n' in text
+    assert 'demo_seconds_sum{op="x"} 5.05\ndemo_seconds_count{op="x"} 2\n' in text
+
+
+def test_storage_and_llm_instrumentation(tmp_path):
+    store = create_storage("file", data_dir=tmp_path)
+    engine = LLMEngine(engine="fake", fake_options={"reply": "abc", "token_delay": 0.01})
+    before_append = STORAGE_SECONDS.count(backend="file", repo="conversations", op="append")
+    before_ttft = LLM_TTFT_SECONDS.count(model="m1")
+    before_tokens = LLM_COMPLETION_TOKENS.value(model="m1")
+    before_chat = LLM_REQUEST_SECONDS.count(model="m1", streaming="false")
+    before_streaming_chat = LLM_REQUEST_SECONDS.count(model="m2", streaming="true")
+
+    async def scenario():
+        await store.conversations.append("c1", [{"role": "user", "content": "hi"}], {"name": "c1"})
+        tokens = [t async for t in engine.stream([{"role": "user", "content": "hi"}], model="m1")]
+        await engine.chat([{"role": "user", "content": "hi"}], model="m1")
+        await engine.chat([{"role": "user", "content": "hi"}], model="m2", streaming=True)
+        return tokens
+
+    assert asyncio.run(scenario()) == ["a", "b", "c"]
+    assert STORAGE_SECONDS.count(backend="file", repo="conversations", op="append") == before_append + 1
+    assert LLM_TTFT_SECONDS.count(model="m1") == before_ttft + 1
+    # 流式按收到的 token 计 3，非流式取假模型返回的用量 3
+    assert LLM_COMPLETION_TOKENS.value(model="m1") == before_tokens + 6
+    assert LLM_REQUEST_SECONDS.count(model="m1", streaming="false") == before_chat + 1
+    # chat 以流式方式调用时按流式记录
+    assert LLM_REQUEST_SECONDS.count(model="m2", streaming="true") == before_streaming_chat + 1
+
+
+def test_metrics_endpoint_records_route_templates():
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.include_router(metrics.router)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    client = TestClient(app)
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/nowhere")
+    resp = client.get("/metrics")
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_duration_seconds_count{method="GET",route="/items/{item_id}",status="200"} 2' in resp.text
+    assert 'route="unmatched",status="404"' in resp.text
+    assert "# TYPE storage_operation_duration_seconds histogram" in resp.text
+    assert "conversation_locks_active 0" in resp.text
@@ -0,0 +1,195 @@
+import sys
+import os
+import asyncio
+import multiprocessing
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage import index
+from core.storage.base import ConflictError
+from core.storage.codec import encode_line
+from core.storage.file_backend import FileStorage
+from core.storage.filelock import FileLock
+from modules.pipeline import TurnPipeline
+from tests.conftest import run
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="需要 fcntl 与 fork")
+
+WORKERS = 4
+ROUNDS = 25
+META = {"name": "共享", "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+
+
+async def hammer(data_dir, worker):
+    # 索引 journal 频繁压缩，覆盖“其他进程替换了 journal”的路径
+    index.COMPACT_SLACK = 3
+    storage = FileStorage(data_dir, flush_delay=0, multiprocess=True)
+    repo = storage.conversations
+    for i in range(ROUNDS):
+        message = {"role": "user", "content": f"w{worker}-{i}"}
+        # 与 save_turn 相同：带版本号追加，冲突时取最新版本重试
+        while True:
+            meta = await repo.get_meta("shared")
+            try:
+                await repo.append("shared", [message], meta={**META, "conversation_id": "shared"},
+                                  expected_revision=meta["revision"] if meta else 0)
+                break
+            except ConflictError:
+                continue
+        await repo.append(f"own-{worker}", [message], meta={**META, "conversation_id": f"own-{worker}"})
+        await storage.folders.add_conversation("default", f"w{worker}-{i}", "2024-01-02T00:00:00Z")
+        await storage.tags.add({"id": f"t{worker}-{i}", "conversation_id": "shared", "tag": f"w{worker}"})
+        # 读取与写入交错：分页读偏移索引，整体读取后本进程会按 meta 记录数触发日志压缩
+        await repo.load_page("shared", 0, 5, reverse=True)
+        if i % 5 == 0:
+            await repo.load("shared")
+    await storage.close()
+
+
+def worker_main(data_dir, worker):
+    run(hammer(data_dir, worker))
+
+
+def test_workers_share_data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    storage = FileStorage(data_dir, flush_delay=0, multiprocess=True)
+    run(storage.folders.save({"folder_id": "default", "name": "默认收藏夹", "conversation_ids": [], "is_default": True}))
+
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=worker_main, args=(data_dir, w)) for w in range(WORKERS)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    assert [p.exitcode for p in procs] == [0] * WORKERS
+
+    # 新进程视角：所有写入都在，计数与索引一致
+    storage = FileStorage(data_dir, flush_delay=0, multiprocess=True)
+    repo = storage.conversations
+    expected = {f"w{w}-{i}" for w in range(WORKERS) for i in range(ROUNDS)}
+    shared = run(repo.load("shared"))
+    assert sorted(m["content"] for m in shared["messages"]) == sorted(expected)
+    assert shared["revision"] == WORKERS * ROUNDS
+    meta = run(repo.get_meta("shared"))
+    assert meta["revision"] == WORKERS * ROUNDS and meta["message_count"] == WORKERS * ROUNDS
+    _, page, total = run(repo.load_page("shared", 0, 3, reverse=True))
+    assert total == WORKERS * ROUNDS and page == shared["messages"][-3:]
+    for w in range(WORKERS):
+        own = run(repo.load(f"own-{w}"))
+        assert [m["content"] for m in own["messages"]] == [f"w{w}-{i}" for i in range(ROUNDS)]
+    assert run(repo.list_page(0, 100))[1] == WORKERS + 1
+
+    assert set(run(storage.folders.get("default"))["conversation_ids"]) == expected
+    assert run(storage.tags.counts()) == {f"w{w}": 1 for w in range(WORKERS)}
+    assert len(run(storage.tags.list_all())) == WORKERS * ROUNDS
+
+
+def test_other_process_changes_visible(tmp_path):
+    # 两个实例模拟两个进程：一方写入后，另一方下次读取即可见，版本号（ETag）一致
+    a = FileStorage(tmp_path, flush_delay=0, multiprocess=True)
+    b = FileStorage(tmp_path, flush_delay=0, multiprocess=True)
+
+    async def scenario():
+        assert await b.conversations.list_page(0, 10) == ([], 0)
+        await a.conversations.append("c1", [{"role": "user", "content": "你好"}], meta=META)
+        assert (await b.conversations.get_meta("c1"))["revision"] == 1
+        # b 的索引已读入 a 的追加，版本检查以最新版本为准
+        with pytest.raises(ConflictError):
+            await b.conversations.write_meta("c1", META, expected_revision=0)
+        await b.conversations.write_meta("c1", {**META, "name": "改名"}, expected_revision=1)
+        assert (await a.conversations.get_meta("c1"))["name"] == "改名"
+
+        await a.folders.save({"folder_id": "f", "name": "甲", "conversation_ids": ["c1"]})
+        await b.folders.rename("f", "乙", "2024-01-02T00:00:00Z")
+        await a.folders.add_conversation("f", "c2", "2024-01-02T00:00:00Z")
+        assert await b.folders.get("f") == await a.folders.get("f")
+        assert (await b.folders.get("f"))["name"] == "乙" and (await b.folders.get("f"))["conversation_ids"] == ["c1", "c2"]
+        assert await a.folders.version() == await b.folders.version()
+
+        await a.tags.add({"id": "t1", "conversation_id": "c1", "tag": "x"})
+        version = await b.tags.version()
+        await b.tags.update("t1", {"tag": "y"})
+        assert await a.tags.counts() == {"y": 1} and await a.tags.version() != version
+
+    run(scenario())
+
+
+def test_pipeline_journal_per_process(tmp_path):
+    journal = tmp_path / "pending_turns.jsonl"
+    saved = []
+
+    async def handler(conversation_id, conv_obj, messages):
+        saved.append((conversation_id, messages[-1]["content"]))
+
+    async def loader(conversation_id):
+        return None
+
+    first = TurnPipeline(handler, loader, journal_path=journal)
+    second = TurnPipeline(handler, loader, journal_path=journal)
+    first._claim_journal()
+    # 默认交接日志已被占用，第二个“进程”使用专属文件
+    second._claim_journal()
+    assert second._journal_file.name == f"pending_turns.{os.getpid()}.jsonl"
+    second._journal.write(encode_line({"id": "j", "conversation_id": "c", "meta": {},
+                                       "messages": [{"role": "user", "content": "未保存"}]}))
+    # 第二个进程异常退出：文件关闭、锁释放，任务留在专属文件中
+    second._journal.close()
+
+    # 存活进程启动时重放无人占用的交接日志，跳过自己占用的
+    assert run(first.recover()) == 1
+    assert saved == [("c", "未保存")]
+    assert not second._journal_file.exists() and journal.exists()
+    run(first.close())
+
+
+def test_file_lock_hold_does_not_block_loop(tmp_path):
+    # 同一锁文件的两个 FileLock 各自打开文件描述，flock 互斥，等同于两个进程
+    other = FileLock(tmp_path / "x.lock")
+    lock = FileLock(tmp_path / "x.lock")
+    held, release = threading.Event(), threading.Event()
+
+    def holder():
+        with other:
+            held.set()
+            release.wait(5)
+
+    async def scenario():
+        thread = threading.Thread(target=holder)
+        thread.start()
+        held.wait(5)
+        assert lock.acquire(blocking=False) is False
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while not release.is_set():
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        # 等待期间事件循环照常运行
+        async with lock.hold():
+            with lock:
+                assert lock._depth == 2
+        await task
+        thread.join()
+        return ticks
+
+    assert run(scenario()) > 1
+    assert lock._depth == 0 and lock.acquire(blocking=False) is True
+    lock.release()
+
+
+def test_legacy_layout_shares_lock_dir(tmp_path):
+    # 旧版平铺布局：folders.json、tags.json 仍在 data/ 下，锁文件与会话仓库同在 data/system/locks
+    (tmp_path / "folders.json").write_text("{}")
+    (tmp_path / "tags.json").write_text("[]")
+    storage = FileStorage(tmp_path, flush_delay=0, multiprocess=True)
+    assert storage.folders.path == tmp_path / "folders.json"
+    lock_dir = tmp_path / "system" / "locks"
+    assert storage.folders._locks.lock_dir == lock_dir
+    assert storage.tags._locks.lock_dir == lock_dir
+    assert storage.conversations._write_locks.lock_dir == lock_dir
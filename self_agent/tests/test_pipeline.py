@@ -0,0 +1,248 @@
+import sys
+import os
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation
+from modules.pipeline import TurnPipeline
+from core.storage import create_storage
+from core.storage.codec import encode_line
+from tests.conftest import run
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    s = create_storage("file", data_dir=tmp_path / "data")
+    monkeypatch.setattr(conversation, "storage", s)
+    return s
+
+
+@pytest.fixture
+def gated(monkeypatch, storage, tmp_path):
+    """保存前等待 gate 打开的流水线，模拟慢存储；gate 在测试自己的事件循环中创建"""
+    async def slow_save(conversation_id, conv_obj, new_messages):
+        await pipeline.gate.wait()
+        return await conversation.save_turn(conversation_id, conv_obj, new_messages)
+
+    pipeline = TurnPipeline(slow_save, conversation.load_conversation, journal_path=tmp_path / "pending_turns.jsonl")
+    monkeypatch.setattr(conversation, "turn_pipeline", pipeline)
+
+    async def fake_chat(messages, **kwargs):
+        return f"回复{len(messages)}"
+    monkeypatch.setattr(conversation.llm_engine, "chat", fake_chat)
+    return pipeline
+
+
+def test_reply_returns_before_save_with_read_your_writes(gated, storage):
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/conv")
+
+    async def scenario():
+        gated.gate = asyncio.Event()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = (await client.post("/conv/c/messages", json={"content": "一"})).json()["data"]
+            second = (await client.post("/conv/c/messages", json={"content": "二"})).json()["data"]
+            # 尚未落盘，但下一轮与读取都能看到
+            assert await storage.conversations.load("c") is None
+            assert gated.pending("c") == 2
+            page = (await client.get("/conv/c", params={"size": 2, "reverse": True})).json()["data"]
+            gated.gate.set()
+            await gated.wait()
+        return first, second, page
+
+    first, second, page = run(scenario())
+    assert first["reply"] == "回复1"
+    # 第二轮的上下文包含第一轮的问答
+    assert second["reply"] == "回复3"
+    assert [m["content"] for m in page["messages"]] == ["二", "回复3"]
+    assert page["meta"]["total"] == 4
+
+    conv = run(storage.conversations.load("c"))
+    assert [m["content"] for m in conv["messages"]] == ["一", "回复1", "二", "回复3"]
+    # 按预估版本号串联，两次写入都没有冲突重试
+    assert conv["revision"] == 2
+    assert gated.view("c") is None
+    assert (gated.journal_path.read_bytes()) == b""
+
+
+def test_list_includes_unsaved_without_waiting(gated, storage):
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/conv")
+
+    async def scenario():
+        await storage.conversations.append("old", [{"role": "user", "content": "旧"}],
+                                           meta={"name": "旧", "created_at": "2024-01-01T00:00:00Z",
+                                                 "updated_at": "2024-01-01T00:00:00Z"})
+        gated.gate = asyncio.Event()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/conv/a/messages", json={"content": "一"})
+            await client.post("/conv/b/messages", json={"content": "二"})
+            await client.post("/conv/old/messages", json={"content": "三"})
+            # 保存被阻塞时列表立即返回：新会话排在最前，已保存的会话不重复列出
+            first = (await client.get("/conv/", params={"page": 1, "size": 2})).json()
+            second = (await client.get("/conv/", params={"page": 2, "size": 2})).json()
+            gated.gate.set()
+            await gated.wait()
+            after = (await client.get("/conv/", params={"page": 1, "size": 10})).json()
+        return first, second, after
+
+    first, second, after = run(scenario())
+    assert sorted(first["data"]) == ["a", "b"] and first["meta"]["total"] == 3
+    assert second["data"] == ["old"]
+    assert after["data"][-1] == "old" and sorted(after["data"]) == ["a", "b", "old"]
+    assert gated.unsaved() == []
+
+
+def test_bounded_queue_and_close_flushes(storage, tmp_path):
+    saved = []
+
+    async def handler(conversation_id, conv_obj, new_messages):
+        await asyncio.sleep(0.05)
+        saved.append(new_messages[0]["content"])
+
+    async def scenario():
+        pipeline = TurnPipeline(handler, conversation.load_conversation, maxsize=1)
+        conv = {"conversation_id": "c", "messages": []}
+        for i in range(3):
+            msg = {"role": "user", "content": str(i)}
+            conv["messages"].append(msg)
+            await pipeline.submit("c", conv, [msg])
+            # 队列容量为 1：提交返回时前面的任务已完成
+            assert pipeline.pending() == 1
+        await pipeline.close()
+        return pipeline
+
+    pipeline = run(scenario())
+    assert saved == ["0", "1", "2"]
+    assert pipeline.pending() == 0
+
+
+def test_recover_replays_unsaved_turns(storage, tmp_path):
+    journal = tmp_path / "pending_turns.jsonl"
+    meta = {"conversation_id": "r", "name": "r", "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+    turn1 = [{"role": "user", "content": "a", "timestamp": "1"}, {"role": "assistant", "content": "b", "timestamp": "2"}]
+    turn2 = [{"role": "user", "content": "c", "timestamp": "3"}, {"role": "assistant", "content": "d", "timestamp": "4"}]
+    # 第一轮在退出前已写入，第二轮尚未写入；最后一行写到一半
+    run(storage.conversations.append("r", turn1, meta=meta))
+    journal.write_bytes(
+        encode_line({"id": "1", "conversation_id": "r", "meta": meta, "messages": turn1})
+        + encode_line({"id": "2", "conversation_id": "r", "meta": meta, "messages": turn2})
+        + b'{"id": "3", "conv'
+    )
+    pipeline = TurnPipeline(conversation.save_turn, conversation.load_conversation, journal_path=journal)
+    assert run(pipeline.recover()) == 1
+    conv = run(storage.conversations.load("r"))
+    assert [m["content"] for m in conv["messages"]] == ["a", "b", "c", "d"]
+    assert journal.read_bytes() == b""
+    # 重复执行不会再次写入
+    assert run(pipeline.recover()) == 0
+
+
+def test_failed_save_retried_then_kept_in_journal(storage, tmp_path):
+    journal = tmp_path / "pending_turns.jsonl"
+    meta = {"conversation_id": "f", "name": "f", "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+    turn = [{"role": "user", "content": "q", "timestamp": "1"}, {"role": "assistant", "content": "a", "timestamp": "2"}]
+    calls = []
+
+    async def flaky(conversation_id, conv_obj, new_messages):
+        calls.append(conversation_id)
+        if conversation_id == "down" or len(calls) < 3:
+            raise OSError("磁盘不可用")
+        return await conversation.save_turn(conversation_id, conv_obj, new_messages)
+
+    async def scenario():
+        pipeline = TurnPipeline(flaky, conversation.load_conversation, journal_path=journal, retries=2, retry_delay=0)
+        # 前两次失败，第三次（第二次重试）成功
+        await pipeline.submit("f", {**meta, "messages": list(turn)}, turn)
+        await pipeline.wait()
+        assert calls == ["f"] * 3 and journal.read_bytes() == b""
+        # 重试用尽仍失败：不丢弃，留在交接日志中
+        await pipeline.submit("down", {**meta, "conversation_id": "down", "messages": list(turn)}, turn)
+        await pipeline.wait()
+        await pipeline.close()
+        assert b'"down"' in journal.read_bytes()
+
+        # 下次启动时重放
+        restarted = TurnPipeline(conversation.save_turn, conversation.load_conversation, journal_path=journal)
+        assert await restarted.recover() == 1
+        assert journal.read_bytes() == b""
+        return await storage.conversations.load("down")
+
+    assert [m["content"] for m in run(scenario())["messages"]] == ["q", "a"]
+    assert [m["content"] for m in run(storage.conversations.load("f"))["messages"]] == ["q", "a"]
+
+
+def test_failed_turn_holds_later_turns_in_order(storage, tmp_path):
+    journal = tmp_path / "pending_turns.jsonl"
+    meta = {"conversation_id": "h", "name": "h", "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+    down = {"一"}
+
+    async def flaky(conversation_id, conv_obj, new_messages):
+        if new_messages[0]["content"] in down:
+            raise OSError("磁盘不可用")
+        return await conversation.save_turn(conversation_id, conv_obj, new_messages)
+
+    def turn(conv, content):
+        msgs = [{"role": "user", "content": content, "timestamp": content},
+                {"role": "assistant", "content": f"答{content}", "timestamp": content}]
+        conv["messages"] = conv["messages"] + msgs
+        return msgs
+
+    async def scenario():
+        pipeline = TurnPipeline(flaky, conversation.load_conversation, journal_path=journal, retries=1, retry_delay=0)
+        conv = {**meta, "messages": []}
+        # 第 N 轮保存失败：覆盖层保留，下一轮仍基于完整历史
+        await pipeline.submit("h", conv, turn(conv, "一"))
+        await pipeline.wait("h")
+        assert [m["content"] for m in pipeline.view("h")["messages"]] == ["一", "答一"]
+        conv = pipeline.view("h")
+        # 第 N+1 轮本可保存成功，但排在失败任务之后一并保留，不先于第 N 轮写入
+        await pipeline.submit("h", conv, turn(conv, "二"))
+        await pipeline.wait("h")
+        assert await storage.conversations.load("h") is None
+        assert [m["content"] for m in pipeline.view("h")["messages"]] == ["一", "答一", "二", "答二"]
+        await pipeline.close()
+
+        restarted = TurnPipeline(conversation.save_turn, conversation.load_conversation, journal_path=journal)
+        assert await restarted.recover() == 2
+        return await storage.conversations.load("h")
+
+    conv = run(scenario())
+    assert [m["content"] for m in conv["messages"]] == ["一", "答一", "二", "答二"]
+    assert conv["revision"] == 2
+
+
+def test_held_turns_saved_when_storage_recovers(storage, tmp_path):
+    meta = {"conversation_id": "k", "name": "k", "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+    broken = [True]
+
+    async def flaky(conversation_id, conv_obj, new_messages):
+        if broken[0]:
+            raise OSError("磁盘不可用")
+        return await conversation.save_turn(conversation_id, conv_obj, new_messages)
+
+    async def scenario():
+        pipeline = TurnPipeline(flaky, conversation.load_conversation, journal_path=tmp_path / "j.jsonl",
+                                retries=0, retry_delay=0)
+        conv = {**meta, "messages": []}
+        for i, content in enumerate(["一", "二", "三"]):
+            # 存储在第三轮前恢复：先按顺序补存前两轮，再存本轮
+            broken[0] = i < 2
+            msgs = [{"role": "user", "content": content, "timestamp": str(i)}]
+            conv = {**(pipeline.view("k") or conv), "messages": (pipeline.view("k") or conv)["messages"] + msgs}
+            await pipeline.submit("k", conv, msgs)
+            await pipeline.wait("k")
+        assert pipeline.view("k") is None and pipeline.unsaved() == []
+        await pipeline.close()
+        assert (tmp_path / "j.jsonl").read_bytes() == b""
+        return await storage.conversations.load("k")
+
+    conv = run(scenario())
+    assert [m["content"] for m in conv["messages"]] == ["一", "二", "三"]
+    assert conv["revision"] == 3
@@ -0,0 +1,117 @@
+import sys
+import os
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation, search
+from modules.search import SearchIndex, index_tokens, query_terms, make_snippet
+from core.storage import create_storage
+
+
+def test_cjk_tokenization():
+    assert index_tokens("机器学习 Python") == "机 器 学 习 机器 器学 学习 python"
+    assert query_terms("学习") == ["学习"]
+    assert query_terms("机器学习") == ["机器", "器学", "学习"]
+    assert query_terms("猫") == ["猫"]
+    assert make_snippet("今天我们讨论机器学习的基本概念", "机器学习", radius=3) == "…们讨论<mark>机器学习</mark>的基本…"
+
+
+@pytest.fixture
+def index(tmp_path):
+    idx = SearchIndex(tmp_path / "search.db")
+    yield idx
+    idx.close()
+
+
+def test_index_search_and_filters(index):
+    async def scenario():
+        await index.index_messages("a", [
+            {"role": "user", "content": "如何学习机器学习？", "timestamp": "2025-01-01T00:00:00Z"},
+            {"role": "assistant", "content": "先学 Python 和线性代数", "timestamp": "2025-01-01T00:00:01Z"},
+        ], 0, meta={"name": "机器学习入门", "summary": "", "config": {"model": "gpt-4.1"}})
+        await index.index_messages("b", [
+            {"role": "user", "content": "今天天气怎么样", "timestamp": "2025-02-01T00:00:00Z"},
+        ], 0, meta={"name": "天气", "config": {"model": "o4-mini"}})
+
+        hits, has_more = await index.search("机器学习")
+        assert not has_more
+        # 名称命中加权排在前面，消息命中带序号
+        assert [(h["conversation_id"], h["kind"]) for h in hits] == [("a", "title"), ("a", "message")]
+        assert hits[1]["index"] == 0
+        assert "<mark>机器学习</mark>" in hits[1]["snippet"]
+
+        assert [h["conversation_id"] for h in (await index.search("python"))[0]] == ["a"]
+        assert [h["conversation_id"] for h in (await index.search("天"))[0]] == ["b", "b"]
+        assert (await index.search("天气", model="gpt-4.1"))[0] == []
+        assert (await index.search("天气", conversation_ids=["a"]))[0] == []
+        assert len((await index.search("天气", date_from="2025-01-15"))[0]) == 1
+        assert (await index.search("学习", date_to="2024-12-31"))[0] == []
+        assert (await index.search("！？"))[0] == []
+
+        hits, has_more = await index.search("学习", limit=1)
+        assert len(hits) == 1 and has_more
+
+        await index.remove("a")
+        assert (await index.search("机器学习"))[0] == []
+
+    asyncio.run(scenario())
+
+
+def test_candidate_cap(tmp_path):
+    # 候选上限只有 1 条：分页与过滤仍返回完整结果
+    idx = SearchIndex(tmp_path / "search.db", max_candidates=1)
+
+    async def scenario():
+        for i in range(5):
+            await idx.index_messages(f"c{i}", [{"role": "user", "content": "学习" * (i + 1), "timestamp": "2025-01-01T00:00:00Z"}], 0)
+        page = [(await idx.search("学习", limit=2, offset=o))[0] for o in (0, 2, 4)]
+        assert sum(len(p) for p in page) == 5
+        assert len({h["conversation_id"] for p in page for h in p}) == 5
+        # 过滤掉全部候选时扩大候选集重查，排名靠后的会话也能找到
+        for i in range(5):
+            hits, has_more = await idx.search("学习", limit=1, conversation_ids=[f"c{i}"])
+            assert [h["conversation_id"] for h in hits] == [f"c{i}"] and not has_more
+
+    asyncio.run(scenario())
+    idx.close()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    store = create_storage("file", data_dir=tmp_path / "data")
+    idx = SearchIndex(tmp_path / "search.db")
+    monkeypatch.setattr(conversation, "storage", store)
+    monkeypatch.setattr(conversation, "search_index", idx)
+    monkeypatch.setattr(search, "storage", store)
+    monkeypatch.setattr(search, "search_index", idx)
+
+    async def fake_chat(messages, **kwargs):
+        return "可以从线性代数开始"
+    monkeypatch.setattr(conversation.llm_engine, "chat", fake_chat)
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/api/v1/conversations")
+    app.include_router(search.router, prefix="/api/v1/search")
+    with TestClient(app) as c:
+        c.store = store
+        yield c
+    idx.close()
+
+
+def test_search_endpoint_follows_conversations(client):
+    client.post("/api/v1/conversations/c1/messages", json={"content": "怎么入门深度学习"})
+    client.post("/api/v1/conversations/c2/messages", json={"content": "推荐一本深度学习的书"})
+    # 搜索索引由后台流水线更新
+    client.portal.call(conversation.turn_pipeline.wait)
+    asyncio.run(client.store.tags.add({"id": "t", "conversation_id": "c2", "tag": "读书"}))
+
+    resp = client.get("/api/v1/search/", params={"q": "线性代数"})
+    assert {h["conversation_id"] for h in resp.json()["data"]} == {"c1", "c2"}
+    resp = client.get("/api/v1/search/", params={"q": "深度学习", "tag": "读书"})
+    assert {h["conversation_id"] for h in resp.json()["data"]} == {"c2"}
+
+    client.delete("/api/v1/conversations/c2")
+    resp = client.get("/api/v1/search/", params={"q": "深度学习"})
+    assert {h["conversation_id"] for h in resp.json()["data"]} == {"c1"}
@@ -0,0 +1,78 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from core.storage import create_storage
+from core.storage.migrate import copy_storage
+from tests.conftest import run
+
+
+def meta(cid, created_at, **kwargs):
+    return {"conversation_id": cid, "name": cid, "summary": "", "created_at": created_at,
+            "updated_at": created_at, "config": {"model": "gpt-4.1"}, **kwargs}
+
+
+def test_conversations(storage):
+    repo = storage.conversations
+    run(repo.append("a", [{"role": "user", "content": "1"}, {"role": "assistant", "content": "2"}],
+                    meta("a", "2025-01-01T00:00:00Z")))
+    run(repo.append("b", [{"role": "user", "content": "x"}], meta("b", "2025-01-02T00:00:00Z")))
+    run(repo.append("a", [{"role": "user", "content": "3"}], meta("a", "2025-01-01T00:00:00Z", name="新名字")))
+
+    conv = run(repo.load("a"))
+    assert conv["name"] == "新名字"
+    assert [m["content"] for m in conv["messages"]] == ["1", "2", "3"]
+    entries, total = run(repo.list_page(0, 10))
+    assert total == 2
+    assert [e["conversation_id"] for e in entries] == ["b", "a"]
+    assert run(repo.get_meta("a"))["message_count"] == 3
+
+    assert run(repo.delete("b")) is True
+    assert run(repo.delete("b")) is False
+    assert run(repo.load("b")) is None
+    assert run(repo.list_page(0, 10))[1] == 1
+
+
+def test_load_page(storage):
+    repo = storage.conversations
+    run(repo.append("p", [{"role": "user", "content": str(i)} for i in range(7)], meta("p", "2025-01-01T00:00:00Z")))
+    conv_meta, page, total = run(repo.load_page("p", 5, 5))
+    assert conv_meta["name"] == "p"
+    assert [m["content"] for m in page] == ["5", "6"]
+    assert total == 7
+    assert [m["content"] for m in run(repo.load_page("p", 0, 3, reverse=True))[1]] == ["4", "5", "6"]
+    assert [m["content"] for m in run(repo.load_page("p", 6, 3, reverse=True))[1]] == ["0"]
+    assert run(repo.load_page("missing", 0, 3)) is None
+
+
+def test_folders_and_tags(storage):
+    folder = {"folder_id": "f1", "name": "收藏", "conversation_ids": ["a", "b"],
+              "created_at": "t", "updated_at": "t", "is_default": False}
+    run(storage.folders.save(folder))
+    run(storage.folders.save({**folder, "conversation_ids": ["b"]}))
+    assert run(storage.folders.get("f1"))["conversation_ids"] == ["b"]
+    assert len(run(storage.folders.list())) == 1
+    assert run(storage.folders.delete("f1")) is True
+
+    run(storage.tags.add({"id": "t1", "conversation_id": "a", "tag": "工作", "created_at": "t", "updated_at": "t"}))
+    run(storage.tags.add({"id": "t2", "conversation_id": "b", "tag": "生活", "created_at": "t", "updated_at": "t"}))
+    assert [t["id"] for t in run(storage.tags.list_by_conversation("a"))] == ["t1"]
+    assert run(storage.tags.update("t1", {"tag": "学习"}))["tag"] == "学习"
+    assert run(storage.tags.update("missing", {"tag": "x"})) is None
+    assert run(storage.tags.delete("t2")) is True
+    assert [t["tag"] for t in run(storage.tags.list_all())] == ["学习"]
+
+
+def test_migrate_file_to_sqlite(tmp_path):
+    src = create_storage("file", data_dir=tmp_path / "data")
+    run(src.conversations.append("c", [{"role": "user", "content": "你好"}], meta("c", "2025-01-01T00:00:00Z")))
+    run(src.folders.save({"folder_id": "default", "name": "默认收藏夹", "conversation_ids": ["c"], "is_default": True}))
+    run(src.tags.add({"id": "t", "conversation_id": "c", "tag": "工作"}))
+
+    dst = create_storage("sqlite", sqlite_path=tmp_path / "out.db")
+    counts = run(copy_storage(src, dst))
+    assert counts == {"conversations": 1, "messages": 1, "folders": 1, "tags": 1}
+    assert run(dst.conversations.load("c"))["messages"][0]["content"] == "你好"
+    assert run(dst.folders.get("default"))["conversation_ids"] == ["c"]
+    assert run(dst.tags.list_by_conversation("c"))[0]["tag"] == "工作"
+    run(dst.close())
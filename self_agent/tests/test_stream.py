@@ -0,0 +1,74 @@
+import sys
+import os
+import json
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation
+from modules.llm import LLMEngine
+from core.storage import create_storage
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    s = create_storage("file", data_dir=tmp_path)
+    monkeypatch.setattr(conversation, "storage", s)
+    return s
+
+
+@pytest.fixture
+def client(monkeypatch, storage):
+    engine = LLMEngine(engine="fake", fake_options={"reply": "你好世界", "token_delay": 0.01})
+    monkeypatch.setattr(conversation, "llm_engine", engine)
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/modules/conversation")
+    with TestClient(app) as c:
+        yield c
+
+
+def parse_events(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_tokens_and_persist(client, storage):
+    with client.stream("POST", "/modules/conversation/s1/messages/stream", json={"content": "hi"}) as resp:
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        events = parse_events(resp.read().decode("utf-8"))
+    tokens = [data["content"] for event, data in events if event == "token"]
+    assert tokens == list("你好世界")
+    event, done = events[-1]
+    assert event == "done"
+    assert done["reply"] == "你好世界"
+    assert done["finish_reason"] == "stop"
+
+    client.portal.call(conversation.turn_pipeline.wait)
+    conv = asyncio.run(storage.conversations.load("s1"))
+    assert [m["content"] for m in conv["messages"]] == ["hi", "你好世界"]
+
+
+def test_stream_cancel_persists_partial(monkeypatch, storage):
+    engine = LLMEngine(engine="fake", fake_options={"reply": "abcdef", "token_delay": 0.01})
+    monkeypatch.setattr(conversation, "llm_engine", engine)
+
+    async def scenario():
+        conv_obj, user_msg, model = await conversation.prepare_turn("s2", "hi")
+        gen = conversation.stream_turn("s2", conv_obj, user_msg, model)
+        first = await gen.__anext__()
+        assert '"a"' in first
+        # 模拟客户端断开
+        await gen.aclose()
+        await conversation.turn_pipeline.wait()
+        return await storage.conversations.load("s2")
+
+    conv = asyncio.run(scenario())
+    assert conv["messages"][0]["content"] == "hi"
+    assert conv["messages"][1]["content"] == "a"
+    assert conv["messages"][1]["finish_reason"] == "cancelled"
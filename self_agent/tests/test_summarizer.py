@@ -0,0 +1,151 @@
+import sys
+import os
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import conversation, summarizer as summarizer_module
+from modules.context import MESSAGE_OVERHEAD, SUMMARY_PREFIX, build_context
+from modules.llm import LLMEngine
+from modules.pipeline import TurnPipeline
+from modules.summarizer import Summarizer
+from core.storage import create_storage
+from tests.conftest import run
+
+
+def msg(role, content, tokens=10):
+    return {"role": role, "content": content, "tokens": tokens, "timestamp": content}
+
+
+class RecordingEngine:
+    """记录收到的 prompt，回复固定为本地假模型的内容"""
+
+    def __init__(self, reply="摘要"):
+        self.fake = LLMEngine(engine="fake", fake_options={"reply": reply}, cache=None, admission=None)
+        self.calls = []
+
+    async def chat(self, messages, **kwargs):
+        self.calls.append((messages, kwargs))
+        return await self.fake.chat(messages, **kwargs)
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path):
+    s = create_storage("file", data_dir=tmp_path)
+    monkeypatch.setattr(conversation, "storage", s)
+    monkeypatch.setattr(summarizer_module, "storage", s)
+    return s
+
+
+def test_context_uses_summary_before_watermark():
+    history = [msg("system", "sys")] + [msg("user", str(i)) for i in range(1, 10)]
+    history[2]["pinned"] = True
+    summary = {"text": "前情", "upto": 6, "tokens": 5}
+    pack = build_context(history, budget=10000, summary=summary)
+    contents = [m["content"] for m in pack.messages]
+    # 水位线之前只保留 system 与置顶消息，随后是摘要，再接水位线之后的原文
+    assert contents == ["sys", "2", SUMMARY_PREFIX + "前情", "6", "7", "8", "9"]
+    assert pack.tokens == 7 * (10 + MESSAGE_OVERHEAD) + 5 + MESSAGE_OVERHEAD - (10 + MESSAGE_OVERHEAD)
+    assert pack.meta()["summarized"] == 6 and pack.meta()["dropped"] == 4
+    # 水位线超出当前历史（会话被重写）时忽略摘要
+    assert build_context(history[:3], budget=10000, summary=summary).summarized == 0
+
+
+def test_plan_keeps_recent_turns():
+    s = Summarizer(engine=RecordingEngine(), trigger_tokens=100, keep_recent_tokens=30, enabled=True)
+    history = [msg("user" if i % 2 == 0 else "assistant", str(i)) for i in range(10)]
+    # 每条 14 token，共 140 > 100；最近 2 条 28 token 保留
+    assert s.plan("c", {"messages": history}) == (0, 8)
+    assert s.plan("c", {"messages": history[:7]}) is None
+    # 已有摘要时只统计水位线之后
+    assert s.plan("c", {"messages": history, "rolling_summary": {"text": "x", "upto": 8, "tokens": 1}}) is None
+
+
+def test_summarize_is_idempotent_and_rolls_forward(storage):
+    engine = RecordingEngine()
+    s = Summarizer(engine=engine, model="o4-mini", trigger_tokens=100, keep_recent_tokens=30, enabled=True)
+    history = [msg("user" if i % 2 == 0 else "assistant", f"m{i}") for i in range(10)]
+    run(storage.conversations.put("c", {"conversation_id": "c", "name": "c", "revision": 0}, history))
+
+    assert run(s.summarize("c")) is True
+    conv = run(storage.conversations.load("c"))
+    state = conv["rolling_summary"]
+    assert state["text"] == "摘要" and state["upto"] == 8 and state["model"] == "o4-mini"
+    prompt, kwargs = engine.calls[0]
+    assert "m0" in prompt[1]["content"] and "m8" not in prompt[1]["content"]
+    assert kwargs["model"] == "o4-mini" and kwargs["cache"] is False
+    # 没有新消息时重复执行不调用模型、不写入
+    revision = conv["revision"]
+    assert run(s.summarize("c")) is False
+    assert len(engine.calls) == 1 and run(storage.conversations.load("c"))["revision"] == revision
+
+    more = [msg("user" if i % 2 == 0 else "assistant", f"m{i}") for i in range(10, 20)]
+    run(storage.conversations.append("c", more))
+    assert run(s.summarize("c")) is True
+    prompt, _ = engine.calls[1]
+    # 上一版摘要与水位线之后的消息一起压缩
+    assert "已有摘要：\n摘要" in prompt[1]["content"] and "m8" in prompt[1]["content"]
+    assert run(storage.conversations.load("c"))["rolling_summary"]["upto"] == 18
+
+
+def test_send_message_schedules_background_summary(monkeypatch, storage):
+    engine = RecordingEngine()
+    s = Summarizer(engine=engine, trigger_tokens=60, keep_recent_tokens=20, enabled=True)
+    monkeypatch.setattr(conversation, "summarizer", s)
+
+    async def fake_chat(messages, **kwargs):
+        return "回复" * 5
+    monkeypatch.setattr(conversation.llm_engine, "chat", fake_chat)
+    app = FastAPI()
+    app.include_router(conversation.router, prefix="/conv")
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            contexts = []
+            for i in range(6):
+                resp = await client.post("/conv/c/messages", json={"content": f"问题{i}" * 5})
+                contexts.append(resp.json()["data"]["context"])
+                await conversation.turn_pipeline.wait()
+                await s.drain()
+            await s.close()
+        return contexts
+
+    contexts = run(scenario())
+    assert engine.calls, "超过阈值后应在后台生成摘要"
+    assert contexts[-1].get("summarized", 0) > 0
+    state = run(storage.conversations.load("c"))["rolling_summary"]
+    assert state["upto"] > 0
+
+
+def test_summary_waits_for_queued_turns(storage):
+    meta = {"conversation_id": "c", "name": "c", "created_at": "2024-01-01T00:00:00Z", "updated_at": "2024-01-01T00:00:00Z"}
+    gate = {}
+
+    async def slow_save(conversation_id, conv_obj, new_messages):
+        await gate["open"].wait()
+        return await conversation.save_turn(conversation_id, conv_obj, new_messages)
+
+    pipeline = TurnPipeline(slow_save, conversation.load_conversation)
+    s = Summarizer(engine=RecordingEngine(), enabled=False, pipeline=pipeline)
+
+    async def scenario():
+        gate["open"] = asyncio.Event()
+        first = [msg("user", f"m{i}") for i in range(4)]
+        revision = await storage.conversations.append("c", first, meta=meta)
+        turn = [msg("user", "m4"), msg("assistant", "m5")]
+        await pipeline.submit("c", {**meta, "revision": revision, "messages": first + turn}, turn)
+        # 摘要基于覆盖层快照生成，此时存储仍落后一轮
+        snapshot = pipeline.view("c")
+        asyncio.get_running_loop().call_later(0.02, gate["open"].set)
+        saved = await s._save("c", snapshot, 0, 6, "摘要")
+        return saved, await storage.conversations.load("c")
+
+    saved, conv = run(scenario())
+    assert saved is True
+    assert conv["rolling_summary"]["upto"] == 6 and len(conv["messages"]) == 6
+    # 排队的保存任务先完成，没有因摘要写入而冲突重放
+    assert conv["revision"] == 3
@@ -0,0 +1,88 @@
+import sys
+import os
+import json
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from modules import tags
+from core.storage.file_backend import FileTagRepository
+
+
+def tag(tid, cid, text):
+    return {"id": tid, "conversation_id": cid, "tag": text, "created_at": "t", "updated_at": "t"}
+
+
+def test_tag_queries(storage):
+    async def scenario():
+        repo = storage.tags
+        await repo.add(tag("t1", "a", "工作"))
+        await repo.add(tag("t2", "b", "工作"))
+        await repo.add(tag("t3", "a", "工作"))
+        await repo.add(tag("t4", "a", "生活"))
+        assert await repo.list_conversations("工作") == ["a", "b"]
+        assert await repo.counts() == {"工作": 2, "生活": 1}
+
+        await repo.update("t2", {"tag": "生活"})
+        await repo.delete("t1")
+        assert await repo.list_conversations("工作") == ["a"]
+        assert sorted(await repo.list_conversations("生活")) == ["a", "b"]
+        await repo.delete("t3")
+        assert await repo.counts() == {"生活": 2}
+        assert await repo.list_conversations("工作") == []
+        assert [t["id"] for t in await repo.list_by_conversation("a")] == ["t4"]
+
+    asyncio.run(scenario())
+
+
+def test_file_tags_coalesce_writes(tmp_path, monkeypatch):
+    path = tmp_path / "tags.json"
+    repo = FileTagRepository(path, flush_delay=0.05)
+    writes = []
+    original = repo._write
+
+    async def counting_write():
+        writes.append(len(repo._by_id))
+        await original()
+    monkeypatch.setattr(repo._writer, "_write", counting_write)
+
+    async def scenario():
+        for i in range(20):
+            await repo.add(tag(f"t{i}", "a", "x"))
+        # 变更只在内存中，尚未写盘
+        assert not path.exists()
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+    assert writes == [20]
+    assert len(json.loads(path.read_text(encoding="utf-8"))["tags"]) == 20
+
+    # 关闭时写回剩余变更，重新加载后索引一致
+    asyncio.run(repo.delete("t0"))
+    asyncio.run(repo.flush())
+    reloaded = FileTagRepository(path)
+    assert asyncio.run(reloaded.counts()) == {"x": 1}
+    assert len(asyncio.run(reloaded.list_by_conversation("a"))) == 19
+
+
+def test_corrupt_tags_file_loads_empty(tmp_path):
+    # 写到一半的 tags.json：记录日志后按空数据处理，接口不会每次都报错
+    path = tmp_path / "tags.json"
+    path.write_text('{"tags": [{"id": "t1"', encoding="utf-8")
+    repo = FileTagRepository(path)
+    assert asyncio.run(repo.counts()) == {}
+    assert asyncio.run(repo.list_all()) == []
+
+
+def test_tag_endpoints(monkeypatch, storage):
+    monkeypatch.setattr(tags, "storage", storage)
+    app = FastAPI()
+    app.include_router(tags.router)
+    with TestClient(app) as client:
+        for cid, text in [("a", "工作"), ("b", "工作"), ("a", "生活")]:
+            client.post("/api/v1/conversation_tags/", json={"conversation_id": cid, "tag": text})
+        resp = client.get("/api/v1/conversation_tags/conversations", params={"tag": "工作"})
+        assert resp.json() == {"tag": "工作", "conversation_ids": ["a", "b"]}
+        resp = client.get("/api/v1/conversation_tags/counts")
+        assert resp.json()["counts"] == [{"tag": "工作", "count": 2}, {"tag": "生活", "count": 1}]